@@ -13,10 +13,22 @@ class PaperMatricesCommand(S3SyncCommand):
         paper_matrix_store = PaperMatrixStore(s3_bucket_client)
         if args.command == 'upload':
             self.print_info('Uploading Paper Matrices')
-            paper_matrix_store.update_remote(directory, args.names)
+            keys = self._matrix_keys(os.listdir(directory), args.names)
+            paper_matrix_store.update_remote(directory, keys)
         elif args.command == 'download':
             self.print_info("Downloading Paper Matrices")
-            paper_matrix_store.sync_to_local_directory(directory, keys=[f'{key}.pkl' for key in args.names], force=args.force)
+            keys = self._matrix_keys(paper_matrix_store.remote_keys(), args.names)
+            paper_matrix_store.sync_to_local_directory(directory, keys=keys, force=args.force)
+
+    @staticmethod
+    def _matrix_keys(file_names, names):
+        """
+        Selects the files that belong to the given paper matrices, i.e. the matrix file, its segments and its
+        artifacts, which are all prefixed by the name of the matrix.
+        """
+        return [file_name for file_name in file_names for name in names
+                if file_name == f'{name}.pkl' or (file_name.startswith(f'{name}_') and
+                                                  os.path.splitext(file_name)[1] in ['.npy', '.pkl'])]
 
     @property
     def default_directory(self):
@@ -0,0 +1 @@
+from .registry import get_registry, render, stage_timer, observe_stage, set_request_labels, filter_shape
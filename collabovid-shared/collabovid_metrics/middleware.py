@@ -0,0 +1,25 @@
+import time
+
+from .registry import requests_total, request_seconds, clear_request_labels
+
+
+class MetricsMiddleware:
+    """
+    Counts the requests per view and status and records their duration.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        clear_request_labels()
+        start = time.perf_counter()
+        response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else 'unresolved'
+
+        requests_total.labels(view=view, status=str(response.status_code)).inc()
+        request_seconds.labels(view=view).observe(duration)
+        return response
@@ -0,0 +1,96 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest, multiprocess
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STAGE_LABELS = ('stage', 'tab', 'sort', 'filters')
+FILTER_KEYS = ['categories', 'authors', 'journals', 'locations', 'topics', 'paper_hosts']
+
+# The metrics of all gunicorn workers are shared through files in this directory, it has to be set before the
+# workers start, see run_server.sh
+MULTIPROCESS_DIR_VARIABLES = ('PROMETHEUS_MULTIPROC_DIR', 'prometheus_multiproc_dir')
+
+requests_total = Counter('collabovid_requests', 'Number of handled requests', ('view', 'status'))
+request_seconds = Histogram('collabovid_request_seconds', 'Duration of handled requests', ('view',),
+                            buckets=DEFAULT_BUCKETS)
+stage_errors_total = Counter('collabovid_stage_errors', 'Number of failed stages', STAGE_LABELS)
+stage_seconds = Histogram('collabovid_stage_seconds', 'Duration of the stages of a request', STAGE_LABELS,
+                          buckets=DEFAULT_BUCKETS)
+
+# Labels of the current search request, they are attached to all stages that are timed while handling it
+_request_labels = ContextVar('request_labels', default=None)
+
+
+def get_registry():
+    """
+    Returns the registry that is exposed. In multiprocess mode it collects the metrics of all workers, otherwise
+    only the metrics of this process exist.
+    """
+    if any(os.getenv(variable) for variable in MULTIPROCESS_DIR_VARIABLES):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def render():
+    """
+    Renders the metrics in the Prometheus text format.
+    """
+    return generate_latest(get_registry())
+
+
+def filter_shape(form: dict):
+    """
+    Describes which filters a search form uses without their values, e.g. 'categories+published_at'.
+    :param form: The search form as dict.
+    :return: The filter shape, 'none' if no filter is used.
+    """
+    filters = [key for key in FILTER_KEYS if form.get(key)]
+    if form.get('published_at_start') or form.get('published_at_end'):
+        filters.append('published_at')
+    if form.get('article_type') not in (None, '', 'all'):
+        filters.append('article_type')
+    return '+'.join(filters) if filters else 'none'
+
+
+def set_request_labels(form: dict):
+    """
+    Sets the labels of the current search request from its form.
+    """
+    _request_labels.set({'tab': form.get('tab', ''), 'sort': form.get('sorted_by', ''),
+                         'filters': filter_shape(form)})
+
+
+def clear_request_labels():
+    _request_labels.set(None)
+
+
+def _stage_labels(stage):
+    labels = _request_labels.get() or {}
+    return {'stage': stage, 'tab': labels.get('tab', ''), 'sort': labels.get('sort', ''),
+            'filters': labels.get('filters', '')}
+
+
+def observe_stage(stage, duration):
+    stage_seconds.labels(**_stage_labels(stage)).observe(duration)
+
+
+@contextmanager
+def stage_timer(stage):
+    """
+    Records the duration of the enclosed block as stage of the current request. Failures are counted separately.
+    :param stage: Name of the stage.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        stage_errors_total.labels(**_stage_labels(stage)).inc()
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
@@ -0,0 +1,29 @@
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotFound
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from .registry import render
+
+
+def _authorized(request):
+    """
+    The metrics are only served to internal scrapers. Requests that were proxied from the internet carry a
+    X-Forwarded-For header, if METRICS_TOKEN is set the scraper has to send it as bearer token.
+    """
+    if 'HTTP_X_FORWARDED_FOR' in request.META:
+        return False
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token:
+        return hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer ' + token)
+    return True
+
+
+def metrics(request):
+    """
+    Exposes the metrics of all workers in the Prometheus text format.
+    """
+    if not _authorized(request):
+        return HttpResponseNotFound()
+    return HttpResponse(render(), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,2 @@
+from .client import SearchClient, AsyncSearchClient, get_search_client, get_async_search_client
+from .doi_encoding import DOI_LIST_CONTENT_TYPE, encode_dois, decode_dois
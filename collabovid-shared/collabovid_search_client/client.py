@@ -0,0 +1,111 @@
+import inspect
+import threading
+
+import requests
+from asgiref.sync import sync_to_async
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .doi_encoding import DOI_LIST_CONTENT_TYPE, encode_dois
+
+
+class SearchClient:
+    """
+    Client of the search service. Connections are kept alive in a pool that is shared by all threads, requests
+    time out and failed connections are retried. Read timeouts are not retried, a slow search would otherwise be
+    sent again while the search service is overloaded.
+    """
+
+    # 503 is not retried, the search service already waits before it answers that it is not ready
+    RETRY_STATUSES = (502, 504)
+    RETRY_METHODS = frozenset(['GET', 'POST'])
+
+    def __init__(self, base_url: str, connect_timeout: float = 2, read_timeout: float = 30, retries: int = 2,
+                 pool_size: int = 10, compact_doi_threshold: int = 0):
+        """
+        :param base_url: The url of the search service.
+        :param connect_timeout: Seconds to wait for a connection.
+        :param read_timeout: Seconds to wait for the response.
+        :param retries: Number of retries of failed connections and gateway errors, read timeouts are not retried.
+        :param pool_size: Number of connections that are kept alive.
+        :param compact_doi_threshold: Lists of at least this many dois are sent compactly encoded, 0 disables it.
+        """
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.compact_doi_threshold = compact_doi_threshold
+
+        # urllib3 renamed method_whitelist to allowed_methods
+        if 'allowed_methods' in inspect.signature(Retry.__init__).parameters:
+            methods = {'allowed_methods': SearchClient.RETRY_METHODS}
+        else:
+            methods = {'method_whitelist': SearchClient.RETRY_METHODS}
+        retry = Retry(total=retries, connect=retries, read=0, status=retries, backoff_factor=0.1,
+                      status_forcelist=SearchClient.RETRY_STATUSES, raise_on_status=False, **methods)
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def _request(self, method, path, **kwargs):
+        response = self._session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    def search(self, form_json: str):
+        """
+        Searches papers. The form is sent in the request body, so its size is not limited by the url length.
+        :param form_json: The search form as json.
+        :return: The response of the search service.
+        """
+        return self._request('POST', '/search', data=form_json, headers={'Content-Type': 'application/json'})
+
+    def similar(self, dois, limit: int):
+        """
+        Finds the papers that are most similar to the given papers.
+        :param dois: List of dois.
+        :param limit: Maximum number of similar papers.
+        :return: The response of the search service.
+        """
+        if self.compact_doi_threshold and len(dois) >= self.compact_doi_threshold:
+            return self._request('POST', '/similar', params={'limit': limit}, data=encode_dois(dois),
+                                 headers={'Content-Type': DOI_LIST_CONTENT_TYPE})
+        return self._request('GET', '/similar', params={'dois': dois, 'limit': limit})
+
+
+class AsyncSearchClient:
+    """
+    Async variant of the SearchClient for async views. The requests run in threads of their own, so several
+    requests of a view can be awaited concurrently, e.g. with asyncio.gather.
+    """
+
+    def __init__(self, client: SearchClient):
+        self._client = client
+        self.search = sync_to_async(client.search, thread_sensitive=False)
+        self.similar = sync_to_async(client.similar, thread_sensitive=False)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_search_client():
+    """
+    Returns the search client of this process, it is configured by the SEARCH_CLIENT_* settings.
+    """
+    global _client
+    from django.conf import settings
+
+    with _client_lock:
+        if _client is None:
+            _client = SearchClient(settings.SEARCH_SERVICE_URL,
+                                   connect_timeout=settings.SEARCH_CLIENT_CONNECT_TIMEOUT,
+                                   read_timeout=settings.SEARCH_CLIENT_READ_TIMEOUT,
+                                   retries=settings.SEARCH_CLIENT_RETRIES,
+                                   pool_size=settings.SEARCH_CLIENT_POOL_SIZE,
+                                   compact_doi_threshold=settings.SEARCH_CLIENT_COMPACT_DOI_THRESHOLD)
+    return _client
+
+
+def get_async_search_client():
+    return AsyncSearchClient(get_search_client())
@@ -0,0 +1,24 @@
+import zlib
+
+# Content type of a compact list of dois, the dois are separated by newlines and compressed with zlib. Dois of the
+# same host share long prefixes, so large lists shrink to a fraction of their json size.
+DOI_LIST_CONTENT_TYPE = 'application/x-doi-list'
+
+
+def encode_dois(dois):
+    """
+    Encodes a list of dois compactly.
+    :param dois: List of dois.
+    :return: The encoded bytes.
+    """
+    return zlib.compress('\n'.join(dois).encode('utf-8'))
+
+
+def decode_dois(data: bytes):
+    """
+    Decodes a list of dois encoded with encode_dois.
+    :param data: The encoded bytes.
+    :return: List of dois.
+    """
+    content = zlib.decompress(data).decode('utf-8')
+    return content.split('\n') if content else []
@@ -1,2 +1,3 @@
 from .paper_statistics import PaperStatistics
+from .aggregated_statistics import AggregatedPaperStatistics
 from .category_statistics import CategoryStatistics
\ No newline at end of file
@@ -0,0 +1,48 @@
+from django.core.serializers.json import DjangoJSONEncoder
+import json
+
+
+class AggregatedPaperStatistics:
+    """
+    Provides the interface of PaperStatistics for statistics that the search service already aggregated, no database
+    queries are needed to render them.
+    """
+
+    def __init__(self, aggregates: dict):
+        self._aggregates = aggregates
+
+    @property
+    def available(self):
+        return self._aggregates['paper_count'] > 0
+
+    @property
+    def published_at_data(self):
+        return json.dumps(self._aggregates['published_at'], cls=DjangoJSONEncoder)
+
+    @property
+    def paper_host_data(self):
+        return json.dumps(self._aggregates['paper_hosts'], cls=DjangoJSONEncoder)
+
+    @property
+    def has_category_data(self):
+        return len(self._aggregates['categories']) > 0
+
+    @property
+    def category_data(self):
+        return json.dumps(self._aggregates['categories'], cls=DjangoJSONEncoder)
+
+    @property
+    def topic_data(self):
+        return json.dumps(self._aggregates['topics'], cls=DjangoJSONEncoder)
+
+    @property
+    def paper_count(self):
+        return self._aggregates['paper_count']
+
+    @property
+    def paper_host_count(self):
+        return self._aggregates['paper_host_count']
+
+    @property
+    def author_count(self):
+        return self._aggregates['author_count']
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-18 02:52
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0059_auto_20210705_1922'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaperSimilarities',
+            fields=[
+                ('paper', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='similarities', serialize=False, to='data.paper')),
+                ('similar_papers', django.contrib.postgres.fields.jsonb.JSONField(default=list)),
+                ('matrix_version', models.CharField(default=None, max_length=32, null=True)),
+            ],
+        ),
+    ]
@@ -419,6 +419,9 @@ class Paper(models.Model):
 
     @property
     def ranked_authors(self):
+        if hasattr(self, 'ranked_memberships'):
+            # prefetched, see search.paper_hydration in web
+            return [m.author for m in self.ranked_memberships]
         memberships = AuthorPaperMembership.objects.filter(paper=self).order_by('rank')
         return [m.author for m in memberships]
 
@@ -458,10 +461,27 @@ class Paper(models.Model):
 
     @property
     def ordered_locations(self):
+        if hasattr(self, 'prefetched_locations'):
+            # prefetched with their city and country rows, see search.paper_hydration in web
+            cities = [location.geocity for location in self.prefetched_locations if hasattr(location, 'geocity')]
+            countries = [location.geocountry for location in self.prefetched_locations
+                         if hasattr(location, 'geocountry')] + [city.country for city in cities]
+        else:
+            cities = list(self.cities.select_related('country'))
+            countries = list(self.countries.all())
+        return Paper._order_locations(countries, cities)
+
+    @staticmethod
+    def _order_locations(countries, cities):
+        """
+        Orders locations such that every country is followed by its cities, countries without cities come first.
+        :param countries: The countries, duplicates are ignored.
+        :param cities: The cities.
+        :return: List of the ordered locations.
+        """
         result = []
-        cities = list(self.cities.all())
-        for country in self.countries.all():
-            country_cities = [city for city in cities if city.country == country]
+        for country in sorted({country.pk: country for country in countries}.values(), key=lambda c: c.pk):
+            country_cities = sorted([city for city in cities if city.country_id == country.pk], key=lambda c: c.pk)
             if country_cities:
                 result.append(country)
                 result += country_cities
@@ -501,6 +521,15 @@ class Paper(models.Model):
         return self.data.abstract
 
 
+class PaperSimilarities(models.Model):
+    """
+    Precomputed most similar papers of a paper, stored as list of [doi, score] pairs sorted by descending score.
+    """
+    paper = models.OneToOneField(Paper, primary_key=True, related_name='similarities', on_delete=models.CASCADE)
+    similar_papers = JSONField(default=list)
+    matrix_version = models.CharField(max_length=32, null=True, default=None)
+
+
 class ScrapeConflict(models.Model):
     paper = models.ForeignKey(Paper, on_delete=models.CASCADE)
     datapoint = JSONField()
@@ -1,30 +1,132 @@
 import json
+import os
+import threading
+import time
+import weakref
 from os.path import join, exists
 import dateutil.parser
 
 
+def _read_timestamps(timestamp_file_path):
+    if not exists(timestamp_file_path):
+        return None
+    with open(timestamp_file_path, 'r') as f:
+        return json.load(f)
+
+
+class _TimestampWatcher:
+    """
+    Polls the modification time of a timestamp file in a background thread. When the file changed, all references
+    that are registered for it are updated in the watcher thread.
+    """
+
+    def __init__(self, timestamp_file_path, interval):
+        self._timestamp_file_path = timestamp_file_path
+        self._interval = interval
+        self._references = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def register(self, reference):
+        with self._lock:
+            self._references.add(reference)
+
+    def _run(self):
+        last_modified = None
+        while True:
+            time.sleep(self._interval)
+            try:
+                modified = os.stat(self._timestamp_file_path).st_mtime_ns
+            except OSError:
+                continue
+
+            if modified == last_modified:
+                continue
+
+            try:
+                timestamp_data = _read_timestamps(self._timestamp_file_path)
+            except (OSError, ValueError):
+                # the file is being written, it is read again in the next round
+                continue
+
+            with self._lock:
+                references = list(self._references)
+
+            success = True
+            for reference in references:
+                success = reference._update(timestamp_data, raise_errors=False) and success
+
+            # failed loads are retried in the next round
+            last_modified = modified if success else None
+
+
+_watchers = dict()
+_watchers_lock = threading.Lock()
+
+
+def _get_watcher(timestamp_file_path):
+    with _watchers_lock:
+        if timestamp_file_path not in _watchers:
+            interval = float(os.getenv('AUTO_UPDATE_POLL_INTERVAL', '1.0'))
+            _watchers[timestamp_file_path] = _TimestampWatcher(timestamp_file_path, interval)
+        return _watchers[timestamp_file_path]
+
+
 class AutoUpdateReference():
-    def __init__(self, base_path, key, load_function, timestamp_file='timestamps.json'):
+    """
+    Reference to a file that is reloaded when its timestamp in the timestamp file changes. By default, the timestamp
+    file is checked on every access. If background is True, the file is loaded synchronously on the first access.
+    Afterwards, a background watcher loads new versions and swaps them in, such that an access only reads the
+    current reference. The watcher is a daemon thread per timestamp file, so it should only be enabled in
+    long-running services.
+    """
+
+    def __init__(self, base_path, key, load_function, timestamp_file='timestamps.json', background=False):
         self._base_path = base_path
         self._key = key
         self._timestamp_file_path = join(self._base_path, timestamp_file)
         self._reference = None
         self._load_function = load_function
         self._timestamp = None
+        self._background = background
+        self._initialized = False
+        self._lock = threading.Lock()
+
+    def _update(self, timestamp_data, raise_errors=True):
+        """
+        Loads the file if its timestamp is newer than the timestamp of the current reference.
+        :return: False if loading failed.
+        """
+        if timestamp_data is None or self._key not in timestamp_data:
+            return True
+
+        file_timestamp = dateutil.parser.parse(timestamp_data[self._key])
+        if self._timestamp is None or file_timestamp > self._timestamp:
+            try:
+                reference = self._load_function(join(self._base_path, self._key))
+            except Exception as e:
+                if raise_errors:
+                    raise
+                print("Could not reload " + self._key + ":", e)
+                return False
+            # the reference is replaced at once, threads that still use the old one keep it
+            self._reference = reference
+            self._timestamp = file_timestamp
+        return True
 
     @property
     def reference(self):
-        if not exists(self._timestamp_file_path):
-            return None
-
-        with open(self._timestamp_file_path, 'r') as f:
-            timestamp_data = json.load(f)
-            if self._key not in timestamp_data:
-                return None
-
-            file_timestamp = dateutil.parser.parse(timestamp_data[self._key])
-            if self._timestamp is None or file_timestamp > self._timestamp:
-                self._reference = self._load_function(join(self._base_path, self._key))
-                self._timestamp = file_timestamp
+        if not self._background:
+            with self._lock:
+                self._update(_read_timestamps(self._timestamp_file_path))
+            return self._reference
+
+        if not self._initialized:
+            with self._lock:
+                if not self._initialized:
+                    self._update(_read_timestamps(self._timestamp_file_path))
+                    self._initialized = True
+                    _get_watcher(self._timestamp_file_path).register(self)
 
         return self._reference
@@ -40,7 +40,7 @@ class SyncableStore:
         self.remote_root_path = remote_root_path
         self.remote_timestamp_file_path = join(remote_root_path, timestamp_file_name)
 
-    def sync_to_local_directory(self, local_root_path: str, verbose=True, keys=None, force=False):
+    def sync_to_local_directory(self, local_root_path: str, verbose=True, keys=None, force=False, prune=False):
         local_root_path = local_root_path
         local_timestamp_file_path = join(local_root_path, self.timestamp_file_name)
 
@@ -75,6 +75,17 @@ class SyncableStore:
                 if verbose:
                     print(f'{key} already up to date')
 
+        # Remove files that were synced before but were deleted remotely
+        if prune:
+            for key in timestamps_local.keys():
+                if key not in timestamps_remote:
+                    if verbose:
+                        print("Removing: " + key)
+                    try:
+                        os.remove(join(local_root_path, key))
+                    except FileNotFoundError:
+                        pass
+
         # Write new timestamps file
         with open(local_timestamp_file_path, 'w') as f:
             json.dump(timestamps_remote, f)
@@ -93,6 +104,22 @@ class SyncableStore:
             self._post_file_upload(directory_path, key)
         self.s3_bucket_client.upload_as_json(self.remote_timestamp_file_path, timestamp_data)
 
+    def delete_remote(self, keys: List[str], verbose=True):
+        timestamp_data = self._get_remote_timestamps(verbose=verbose)
+
+        # The timestamps are updated first, such that no client downloads a file that is about to be deleted
+        for key in keys:
+            timestamp_data.pop(key, None)
+        self.s3_bucket_client.upload_as_json(self.remote_timestamp_file_path, timestamp_data)
+
+        for key in keys:
+            if verbose:
+                print("Deleting: " + key)
+            self.s3_bucket_client.delete_file(join(self.remote_root_path, key))
+
+    def remote_keys(self, verbose=True):
+        return list(self._get_remote_timestamps(verbose=verbose).keys())
+
     def _get_remote_timestamps(self, verbose=True):
         # Downloading remote timestamps json file
         try:
@@ -126,14 +153,18 @@ class PaperMatrixStore(SyncableStore):
 
     def sync(self):
         directory = os.getenv('PAPER_MATRIX_BASE_DIR', '/models/paper_matrix')
-        self.sync_to_local_directory(directory)
+        # Segments that were superseded by a compaction are deleted remotely, processes that still map them keep
+        # their copy
+        self.sync_to_local_directory(directory, prune=True)
 
     def _post_file_download(self, directory, file_name):
         file_path = join(directory, file_name)
         os.chmod(file_path, 0o666)
 
     def update_remote(self, directory_path: str, keys: List[str], verbose=True):
-        super().update_remote(directory_path=directory_path, keys=[f'{key}.pkl' for key in keys])
+        # Keys without an extension refer to the paper matrix pickle itself
+        super().update_remote(directory_path=directory_path,
+                              keys=[key if os.path.splitext(key)[1] else f'{key}.pkl' for key in keys])
 
 
 class ModelsStore(SyncableStore):
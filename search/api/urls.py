@@ -1,8 +1,13 @@
 from django.urls import path
-from .views import search, startup_probe, similar
+from collabovid_metrics.views import metrics
+from .views import search, search_batch, startup_probe, startup_status, similar, cache_status
 
 urlpatterns = [
     path('search', search),
+    path('search/batch', search_batch),
     path('similar', similar),
     path('status', startup_probe),
+    path('status/startup', startup_status),
+    path('status/cache', cache_status),
+    path('metrics', metrics),
 ]
@@ -1,16 +1,21 @@
-from django.db.models import QuerySet
 from django.http import JsonResponse, HttpResponse, HttpResponseServerError, HttpResponseBadRequest
+from django.views.decorators.csrf import csrf_exempt
+from django.conf import settings
 
 from data.models import Paper
 from src.search.search_engine import SearchEngine
+from src.search.result_cache import get_search_result_cache
+from src.search.filter_index import get_filter_index
 from src.analyze import get_semantic_paper_search, get_similar_paper_finder
+from src.analyze.vectorizer.utils.query_embedding_cache import get_query_embedding_cache
+from src.startup import get_startup
 import time
 import json
 
 from src.search.utils import TimerUtilities
+from collabovid_metrics import set_request_labels
+from collabovid_search_client import DOI_LIST_CONTENT_TYPE, decode_dois
 from src.search.virtual_paginator import VirtualPaginator
-from collections import defaultdict
-import heapq
 
 
 def wait_until(condition, interval=0.1, timeout=10):
@@ -20,69 +25,115 @@ def wait_until(condition, interval=0.1, timeout=10):
     return condition()
 
 
+def not_ready_response(message):
+    response = HttpResponse(message, status=503)
+    response['Retry-After'] = '5'
+    return response
+
+
+@csrf_exempt
 def search(request):
-    if request.method == "GET":
+    if request.method in ("GET", "POST"):
         semantic_paper_search = get_semantic_paper_search()
         if not wait_until(semantic_paper_search.is_ready):
-            return HttpResponseBadRequest("Semantic Paper Search is not initialized yet")
+            return not_ready_response("Semantic Paper Search is not initialized yet")
+
+        # the search client sends the form as body, the url length does not limit it there
+        form = json.loads(request.body if request.method == "POST" else request.GET.get('form'))
+        set_request_labels(form)
 
-        form = json.loads(request.GET.get('form'))
-        search_engine = SearchEngine(form)
-        search_result = TimerUtilities.time_function(search_engine.search)
+        def sorted_search_result():
+            search_engine = SearchEngine(form)
+            search_result = TimerUtilities.time_function(search_engine.search)
+            sorted_dois = TimerUtilities.time_function(VirtualPaginator.sort_results, search_result, form)
+            return sorted_dois, search_engine.data_version
+
+        sorted_dois = get_search_result_cache().get_or_compute(form, semantic_paper_search.matrix_version,
+                                                               sorted_search_result)
 
         if form['result_type'] == 'papers':
-            paginator = VirtualPaginator(search_result, form)
+            paginator = VirtualPaginator(sorted_dois, form)
             page = TimerUtilities.time_function(paginator.get_page)
 
             return JsonResponse(page)
         elif form['result_type'] == 'statistics':
-            if isinstance(search_result, dict):
-                result = list(search_result.keys())
-            elif isinstance(search_result, QuerySet):
-                result = list(search_result.values_list('doi', flat=True))
-            else:
-                raise ValueError()
-            return JsonResponse({'results': result})
+            filter_index = get_filter_index(semantic_paper_search.paper_matrix)
+            if filter_index is not None:
+                # only the aggregates are sent, the web service does not need to query the matching papers
+                statistics = TimerUtilities.time_function(filter_index.statistics, filter_index.mask_of(sorted_dois))
+                return JsonResponse({'statistics': statistics})
+            return JsonResponse({'results': list(sorted_dois)})
 
         return HttpResponseBadRequest()
 
 
+@csrf_exempt
+def search_batch(request):
+    """
+    Api method for programmatic clients to find the best matching papers of many queries at once.
+    :param request: POST request with a json body {"queries": [...], "limit": 10}
+    :return: json response with a list of papers and their scores per query
+    """
+    if request.method == "POST":
+        semantic_paper_search = get_semantic_paper_search()
+        if not wait_until(semantic_paper_search.is_ready):
+            return not_ready_response("Semantic Paper Search is not initialized yet")
+
+        try:
+            body = json.loads(request.body)
+            queries = [str(query) for query in body['queries']]
+            limit = int(body.get('limit', 10))
+        except (ValueError, KeyError, TypeError):
+            return HttpResponseBadRequest("Invalid body")
+
+        if len(queries) > settings.QUERY_BATCH_ENDPOINT_LIMIT or limit <= 0:
+            return HttpResponseBadRequest("Too many queries or invalid limit")
+
+        matches = TimerUtilities.time_function(semantic_paper_search.top_matches, queries, top=limit)
+        return JsonResponse({'results': [
+            {'query': query, 'papers': [{'doi': doi, 'score': score} for doi, score in query_matches]}
+            for query, query_matches in zip(queries, matches)
+        ]})
+    return HttpResponseBadRequest("Only Post is allowed here")
+
+
+@csrf_exempt
 def similar(request):
     """
     Api method to retrieve the most similar paper given a doi.
-    :param request: Request containing the doi as a HTTP GET parameter
+    :param request: Request containing the dois as HTTP GET parameter or as compactly encoded POST body, see
+    collabovid_search_client.encode_dois
     :return: json response with the list of papers and the corresponding similarity score
     """
-    if request.method == "GET":
+    if request.method in ("GET", "POST"):
         paper_finder = get_similar_paper_finder()
         if not wait_until(paper_finder.is_ready):
-            return HttpResponseBadRequest("Similar Paper finder is not initialized yet")
-
-        dois = request.GET.getlist('dois')
+            return not_ready_response("Similar Paper finder is not initialized yet")
+
+        if request.method == "POST":
+            if request.content_type != DOI_LIST_CONTENT_TYPE:
+                return HttpResponseBadRequest("Unsupported content type")
+            dois = decode_dois(request.body)
+        else:
+            dois = request.GET.getlist('dois')
         limit = int(request.GET.get('limit'))
 
         dois = list(Paper.objects.filter(pk__in=dois).values_list('doi', flat=True))
-        doi_scores = defaultdict(int)
-        for doi in dois:
-            similar_paper = paper_finder.similar(doi)
-            for doi, score in similar_paper:
-                doi_scores[doi] += score
-
-        result = []
-
-        flattened_score_dict = list(doi_scores.items())
-
-        for doi, score in heapq.nlargest(limit, flattened_score_dict, key=lambda x: x[1]):
-            result.append({
-                'doi': doi,
-                'score': score
-            })
+        if len(dois) == 1:
+            similar_papers = paper_finder.similar(dois[0], top=limit)
+        else:
+            similar_papers = paper_finder.similar_to_many(dois, top=limit)
+        result = [{'doi': doi, 'score': score} for doi, score in similar_papers]
 
         return JsonResponse({'similar': result})
-    return HttpResponseBadRequest("Only Get is allowed here")
+    return HttpResponseBadRequest("Only Get and Post are allowed here")
 
 
 def startup_probe(request):
+    startup = get_startup()
+    if startup.started and not startup.finished:
+        return JsonResponse(startup.status(), status=503)
+
     paper_finder = get_similar_paper_finder()
     paper_search = get_semantic_paper_search()
 
@@ -93,3 +144,18 @@ def startup_probe(request):
         return HttpResponseServerError("Semantic Paper Search not ready.")
 
     return HttpResponse("OK")
+
+
+def startup_status(request):
+    return JsonResponse(get_startup().status())
+
+
+def cache_status(request):
+    statistics = {
+        'query_embeddings': get_query_embedding_cache().statistics(),
+        'search_results': get_search_result_cache().statistics()
+    }
+    semantic_paper_search = get_semantic_paper_search()
+    if semantic_paper_search and semantic_paper_search.query_batcher:
+        statistics['query_batches'] = semantic_paper_search.query_batcher.statistics()
+    return JsonResponse(statistics)
@@ -0,0 +1,69 @@
+"""
+Benchmarks the search on a synthetic corpus and prints the results as json.
+
+The corpus is written to the database of search.settings_benchmark and removed afterwards, the paper matrix is
+written to a temporary directory. Other settings modules are refused unless --allow-db-writes is given.
+Example: python run_benchmark.py --size 100000 --iterations 20 --output results.json
+"""
+import argparse
+import json
+import os
+import tempfile
+
+import django
+
+if __name__ == "__main__":
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'search.settings_benchmark')
+
+    parser = argparse.ArgumentParser(description="Search latency benchmark")
+    parser.add_argument('--size', type=int, default=10000, help="Number of synthetic papers")
+    parser.add_argument('--dimension', type=int, default=768, help="Dimension of the synthetic embeddings")
+    parser.add_argument('--iterations', type=int, default=5, help="Requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=1, help="Concurrent requests per scenario")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default=None, help="File the json report is written to")
+    parser.add_argument('--keep', action='store_true', help="Keep the corpus in the database")
+    parser.add_argument('--reuse', action='store_true', help="Reuse a corpus that was kept before")
+    parser.add_argument('--allow-db-writes', action='store_true',
+                        help="Write the corpus to the database of a settings module that is not meant for benchmarks")
+    args = parser.parse_args()
+
+    django.setup()
+
+    from django.conf import settings
+
+    if not getattr(settings, 'BENCHMARK_DATABASE', False) and not args.allow_db_writes:
+        parser.error(f"{os.environ['DJANGO_SETTINGS_MODULE']} does not use a benchmark database. Use "
+                     f"search.settings_benchmark or pass --allow-db-writes to write the corpus to its database.")
+    from src.analyze import SEARCH_VECTORIZER, SIMILAR_VECTORIZER
+    from src.analyze.vectorizer import vectorizers
+    from src.benchmark.corpus import SyntheticCorpus, SyntheticVectorizer
+    from src.benchmark.harness import SearchBenchmark
+
+    # The synthetic matrix replaces the matrices of the search, the vectorizers read the directory when created
+    settings.PAPER_MATRIX_BASE_DIR = tempfile.mkdtemp(prefix='benchmark_paper_matrix_')
+    matrix_file_name = 'benchmark_paper_matrix.pkl'
+
+    corpus = SyntheticCorpus(size=args.size, dimension=args.dimension, seed=args.seed)
+    if not args.reuse:
+        SyntheticCorpus.delete()
+        corpus.generate()
+    corpus.write_paper_matrix(settings.PAPER_MATRIX_BASE_DIR, matrix_file_name)
+
+    vectorizer = SyntheticVectorizer(matrix_file_name=matrix_file_name, dimension=args.dimension)
+    vectorizers[SEARCH_VECTORIZER] = vectorizer
+    vectorizers[SIMILAR_VECTORIZER] = vectorizer
+
+    try:
+        benchmark = SearchBenchmark(corpus.dois, iterations=args.iterations, concurrency=args.concurrency,
+                                    seed=args.seed)
+        report = benchmark.report(corpus, benchmark.run())
+    finally:
+        if not args.keep:
+            SyntheticCorpus.delete()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
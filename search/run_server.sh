@@ -2,4 +2,13 @@
 chmod 777 -R /models
 chown -R root:root /models
 echo "Changed permissions for /models"
-gunicorn ${PROJECT_NAME}.wsgi --user www-data --bind 0.0.0.0:80 --workers 1  --timeout 500
\ No newline at end of file
+# the workers share their metrics through this directory, it is cleared on every start
+export prometheus_multiproc_dir=/tmp/metrics
+export PROMETHEUS_MULTIPROC_DIR=/tmp/metrics
+rm -rf /tmp/metrics && mkdir -p /tmp/metrics && chown www-data /tmp/metrics
+# query batching needs concurrent requests in the worker, otherwise every query waits for its batch window alone
+GUNICORN_THREAD_ARGS=""
+if [ "${USE_QUERY_BATCHING:-0}" -gt 0 ]; then
+  GUNICORN_THREAD_ARGS="--threads ${GUNICORN_THREADS:-4}"
+fi
+gunicorn ${PROJECT_NAME}.wsgi --user www-data --bind 0.0.0.0:80 --workers 1 ${GUNICORN_THREAD_ARGS} --timeout 500
\ No newline at end of file
@@ -22,6 +22,7 @@ INSTALLED_APPS = [
 INSTALLED_APPS += SHARED_INSTALLED_APPS
 
 MIDDLEWARE = [
+    'collabovid_metrics.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -106,3 +107,73 @@ PAPER_MATRIX_BASE_DIR = os.getenv('PAPER_MATRIX_BASE_DIR', None)
 PUSH_PAPER_MATRIX = True
 SENTENCE_TRANSFORMER_MODEL_NAME = os.getenv('SENTENCE_TRANSFORMER_MODEL_NAME', 'sentence_transformer')
 
+# Approximate nearest neighbour index for semantic search without filters
+USE_ANN_INDEX = int(os.getenv('USE_ANN_INDEX', '0')) > 0
+ANN_INDEX_TOP_K = int(os.getenv('ANN_INDEX_TOP_K', '1000'))
+ANN_INDEX_N_PROBE = int(os.getenv('ANN_INDEX_N_PROBE', '32'))
+
+# Cache for query embeddings, persisted to QUERY_EMBEDDING_CACHE_DIR if set
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv('QUERY_EMBEDDING_CACHE_SIZE', '10000'))
+QUERY_EMBEDDING_CACHE_TTL = int(os.getenv('QUERY_EMBEDDING_CACHE_TTL', str(60 * 60 * 24)))
+QUERY_EMBEDDING_CACHE_DIR = os.getenv('QUERY_EMBEDDING_CACHE_DIR', None)
+
+# Number of precomputed similar papers per paper
+NEIGHBOR_GRAPH_SIZE = int(os.getenv('NEIGHBOR_GRAPH_SIZE', '20'))
+
+# Cache for sorted search results, shared by all pages and result types of a search
+SEARCH_RESULT_CACHE_SIZE = int(os.getenv('SEARCH_RESULT_CACHE_SIZE', '128'))
+SEARCH_RESULT_CACHE_TTL = int(os.getenv('SEARCH_RESULT_CACHE_TTL', '600'))
+
+# Seconds between checks of the database for changed papers, see src.search.data_version
+DATA_VERSION_INTERVAL = int(os.getenv('DATA_VERSION_INTERVAL', '30'))
+
+# In-memory index of the filterable paper attributes, aligned with the rows of the paper matrix
+USE_FILTER_INDEX = int(os.getenv('USE_FILTER_INDEX', '1')) > 0
+
+# Maximum number of Elasticsearch hits fetched by a keyword search (index.max_result_window)
+ELASTICSEARCH_MAX_HITS = int(os.getenv('ELASTICSEARCH_MAX_HITS', '10000'))
+# Number of best semantic results that are reordered by keyword matches
+ELASTICSEARCH_RESCORE_WINDOW = int(os.getenv('ELASTICSEARCH_RESCORE_WINDOW', '1000'))
+
+# Int8 quantised embeddings for the first scan over all papers, the best candidates are re-ranked exactly
+USE_QUANTIZED_EMBEDDINGS = int(os.getenv('USE_QUANTIZED_EMBEDDINGS', '0')) > 0
+QUANTIZED_RERANK_SIZE = int(os.getenv('QUANTIZED_RERANK_SIZE', '2000'))
+
+# Inference backend of the transformer vectorizers, 'eager' or 'quantized-torchscript'
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'eager')
+# Maximum deviation of quantised models from the original models, checked when they are created
+INFERENCE_PARITY_TOLERANCE = float(os.getenv('INFERENCE_PARITY_TOLERANCE', '0.05'))
+QUANTIZE_CATEGORY_CLASSIFIER = int(os.getenv('QUANTIZE_CATEGORY_CLASSIFIER', '0')) > 0
+
+# Queries that arrive within QUERY_BATCH_MAX_WAIT_MS are encoded and scored together, which delays every query by
+# up to the batch window. run_server.sh only starts gunicorn with several threads if it is enabled.
+USE_QUERY_BATCHING = int(os.getenv('USE_QUERY_BATCHING', '0')) > 0
+QUERY_BATCH_MAX_SIZE = int(os.getenv('QUERY_BATCH_MAX_SIZE', '32'))
+QUERY_BATCH_MAX_WAIT_MS = int(os.getenv('QUERY_BATCH_MAX_WAIT_MS', '5'))
+# Maximum number of queries of a request to the batch endpoint
+QUERY_BATCH_ENDPOINT_LIMIT = int(os.getenv('QUERY_BATCH_ENDPOINT_LIMIT', '256'))
+
+# Number of delta segments of a paper matrix after which compact-paper-matrix should run
+PAPER_MATRIX_MAX_DELTA_SEGMENTS = int(os.getenv('PAPER_MATRIX_MAX_DELTA_SEGMENTS', '30'))
+
+# Worker processes for computing paper embeddings, 0 uses one worker per EMBEDDING_THREADS_PER_WORKER cores
+EMBEDDING_WORKERS = int(os.getenv('EMBEDDING_WORKERS', '0'))
+EMBEDDING_THREADS_PER_WORKER = int(os.getenv('EMBEDDING_THREADS_PER_WORKER', '4'))
+# Number of papers that are tokenized at once while computing the paper matrix
+EMBEDDING_CHUNK_SIZE = int(os.getenv('EMBEDDING_CHUNK_SIZE', '2048'))
+
+# Load models and paper matrices when the server starts instead of on the first request
+EAGER_STARTUP = int(os.getenv('EAGER_STARTUP', '1'))
+# Query that is run once at the end of the startup to warm up the model
+STARTUP_WARMUP_QUERY = os.getenv('STARTUP_WARMUP_QUERY', 'sars-cov-2 transmission')
+# Directory of model snapshots that are restored on startup, empty to disable snapshots
+STARTUP_SNAPSHOT_DIR = os.getenv('STARTUP_SNAPSHOT_DIR', '')
+
+# Re-rank semantic results with the sparse BM25 index of the paper matrix instead of Elasticsearch. The index is
+# only built when it is enabled, search results change, so it has to be opted into.
+USE_LEXICAL_RERANKER = int(os.getenv('USE_LEXICAL_RERANKER', '0')) > 0
+LEXICAL_INCLUDE_ABSTRACTS = int(os.getenv('LEXICAL_INCLUDE_ABSTRACTS', '0')) > 0
+LEXICAL_RESCORE_WINDOW = int(os.getenv('LEXICAL_RESCORE_WINDOW', '1000'))
+
+# Bearer token scrapers of /metrics have to send, the endpoint is only served to requests that were not proxied
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
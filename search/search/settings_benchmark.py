@@ -0,0 +1,5 @@
+from .settings_dev import *
+
+# The benchmark writes a synthetic corpus to the database, which therefore must not hold real papers
+DATABASES['default']['NAME'] = os.getenv('BENCHMARK_DB_NAME', 'collabovid_benchmark')
+BENCHMARK_DATABASE = True
@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'search.settings_dev')
 
 application = get_wsgi_application()
+
+from django.conf import settings
+
+if settings.EAGER_STARTUP:
+    # load models and matrices before the first request arrives
+    from src.startup import get_startup
+    get_startup().start()
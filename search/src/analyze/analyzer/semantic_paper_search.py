@@ -1,4 +1,10 @@
+import joblib
+import numpy as np
+from django.conf import settings
+from collabovid_store.auto_update_reference import AutoUpdateReference
+from collabovid_metrics import stage_timer
 from src.analyze.vectorizer.exceptions import *
+from src.analyze.vectorizer.utils.micro_batcher import MicroBatcher
 
 
 class SemanticPaperSearch:
@@ -12,10 +18,163 @@ class SemanticPaperSearch:
 class EmbeddingSemanticPaperSearch:
     def __init__(self, vectorizer):
         self._vectorizer = vectorizer
+        self._ann_index_reference = AutoUpdateReference(base_path=settings.PAPER_MATRIX_BASE_DIR,
+                                                        key=vectorizer.ann_index_file_name,
+                                                        load_function=joblib.load, background=True)
+        self._lexical_index_reference = AutoUpdateReference(base_path=settings.PAPER_MATRIX_BASE_DIR,
+                                                            key=vectorizer.lexical_file_name,
+                                                            load_function=joblib.load, background=True)
+        self._query_batcher = None
+        if settings.USE_QUERY_BATCHING:
+            self._query_batcher = MicroBatcher(self._batch_query_scores, max_batch_size=settings.QUERY_BATCH_MAX_SIZE,
+                                               max_wait=settings.QUERY_BATCH_MAX_WAIT_MS / 1000)
 
-    def query(self, query: str):
-        indices, scores = self._vectorizer.matching_to_query(query)
-        return list(zip(indices, scores))
+    @property
+    def vectorizer(self):
+        return self._vectorizer
+
+    @property
+    def query_batcher(self):
+        return self._query_batcher
+
+    @property
+    def paper_matrix(self):
+        return self._vectorizer.paper_matrix
+
+    @property
+    def matrix_version(self):
+        return self.paper_matrix.get('version')
+
+    @property
+    def ann_index(self):
+        """
+        The approximate nearest neighbour index of the paper matrix. Returns None if the index is disabled, not
+        available or stale, i.e. it was built for another version of the paper matrix.
+        """
+        return self.fresh_ann_index(self.paper_matrix)
+
+    def fresh_ann_index(self, paper_matrix):
+        if not settings.USE_ANN_INDEX:
+            return None
+        index = self._ann_index_reference.reference
+        if index is None or not index.is_fresh(paper_matrix.get('version')):
+            return None
+        return index
+
+    @property
+    def lexical_index(self):
+        """
+        The sparse BM25 matrix of the paper matrix. Returns None if the re-ranker is disabled, the index is not
+        available or stale.
+        """
+        return self.fresh_lexical_index(self.paper_matrix)
+
+    def fresh_lexical_index(self, paper_matrix):
+        if not settings.USE_LEXICAL_RERANKER:
+            return None
+        index = self._lexical_index_reference.reference
+        if index is None or not index.is_fresh(paper_matrix.get('version')):
+            return None
+        return index
+
+    def query_scores(self, query: str, top: int = None, paper_matrix=None):
+        """
+        Computes the similarity of the query to the papers.
+        :param query: The query.
+        :param top: Optional. If set, only the candidates of an approximate top-k search are scored. Falls back to
+        scoring all papers if no up to date ANN index is available.
+        :param paper_matrix: Optional. The paper matrix dict the rows refer to, defaults to the loaded matrix. A
+        request passes the same matrix to all calls, the loaded one may be replaced in the meantime.
+        :return: Tuple of the scored matrix rows (None if all rows were scored) and a numpy array of their scores.
+        """
+        paper_matrix = paper_matrix or self.paper_matrix
+        index = self.fresh_ann_index(paper_matrix) if top else None
+
+        if index is None:
+            if self._query_batcher is not None:
+                # concurrent queries are encoded and scored together
+                with stage_timer('query_batch'):
+                    return None, self._query_batcher.submit((query, paper_matrix))
+            with stage_timer('query_encoding'):
+                embedding = self._vectorizer.vectorize_query(query)
+            with stage_timer('similarity_scoring'):
+                return None, self._vectorizer.similarity_scores(embedding, paper_matrix=paper_matrix)
+
+        with stage_timer('query_encoding'):
+            embedding = self._vectorizer.vectorize_query(query)
+
+        with stage_timer('ann_candidates'):
+            rows = index.candidates(self._vectorizer.ann_query_vector(embedding, paper_matrix=paper_matrix),
+                                    n_probe=settings.ANN_INDEX_N_PROBE)
+        with stage_timer('similarity_scoring'):
+            return rows, self._vectorizer.similarity_scores(embedding, rows=rows, paper_matrix=paper_matrix)
+
+    def _scores_of_queries(self, queries, paper_matrix):
+        embeddings = self._vectorizer.vectorize_queries(queries)
+        scores = np.ascontiguousarray(self._vectorizer.similarity_scores_many(embeddings,
+                                                                              paper_matrix=paper_matrix).T)
+        return list(scores)
+
+    def _batch_query_scores(self, items):
+        """
+        Scores a batch of (query, paper matrix) items, each query is scored against the matrix it was submitted with.
+        """
+        matrices = dict()
+        for position, (query, paper_matrix) in enumerate(items):
+            matrices.setdefault(id(paper_matrix), (paper_matrix, []))[1].append(position)
+
+        results = [None] * len(items)
+        for paper_matrix, positions in matrices.values():
+            scores = self._scores_of_queries([items[position][0] for position in positions], paper_matrix)
+            for position, query_scores in zip(positions, scores):
+                results[position] = query_scores
+        return results
+
+    def top_matches(self, queries, top: int):
+        """
+        Finds the best matching papers of several queries with one forward pass and one matrix product.
+        :param queries: List of queries.
+        :param top: Number of papers per query.
+        :return: List with a list of (doi, score) tuples per query, sorted by descending score.
+        """
+        if len(queries) == 0:
+            return []
+
+        paper_matrix = self.paper_matrix
+        scores = self._scores_of_queries(queries, paper_matrix)
+        index_arr = paper_matrix['index_arr']
+        top = min(top, len(index_arr))
+        matches = []
+        for query_scores in scores:
+            best = np.argpartition(query_scores, len(query_scores) - top)[-top:]
+            best = best[np.argsort(query_scores[best])[::-1]]
+            matches.append([(index_arr[row], score) for row, score in zip(best.tolist(), query_scores[best].tolist())])
+        return matches
+
+    def query(self, query: str, top: int = None):
+        paper_matrix = self.paper_matrix
+        rows, scores = self.query_scores(query, top=top, paper_matrix=paper_matrix)
+        if rows is None:
+            rows = np.arange(len(scores))
+        return list(zip(self.dois(rows, paper_matrix=paper_matrix), scores.tolist()))
+
+    def row_mask(self, dois, paper_matrix=None):
+        """
+        Converts dois into a boolean mask over the rows of the paper matrix. Dois that are not part of the matrix
+        are ignored.
+        :param dois: Iterable of dois.
+        :param paper_matrix: Optional. The paper matrix dict, defaults to the loaded matrix.
+        :return: Numpy boolean array.
+        """
+        paper_matrix = paper_matrix or self._vectorizer.paper_matrix
+        id_map = paper_matrix['id_map']
+        mask = np.zeros(len(paper_matrix['index_arr']), dtype=bool)
+        mask[[id_map[doi] for doi in dois if doi in id_map]] = True
+        return mask
+
+    def dois(self, rows, paper_matrix=None):
+        index_arr = (paper_matrix or self._vectorizer.paper_matrix)['index_arr']
+        return [index_arr[row] for row in rows.tolist()]
 
     def is_ready(self):
         try:
@@ -1,4 +1,7 @@
-import heapq
+import joblib
+import numpy as np
+from django.conf import settings
+from collabovid_store.auto_update_reference import AutoUpdateReference
 from src.analyze.vectorizer.exceptions import *
 
 
@@ -13,14 +16,56 @@ class SimilarPaperFinder:
 class EmbeddingSimilarPaperFinder(SimilarPaperFinder):
     def __init__(self, vectorizer):
         self._vectorizer = vectorizer
+        self._neighbor_graph_reference = AutoUpdateReference(base_path=settings.PAPER_MATRIX_BASE_DIR,
+                                                             key=vectorizer.neighbor_graph_file_name,
+                                                             load_function=joblib.load, background=True)
+
+    @property
+    def neighbor_graph(self):
+        """
+        The precomputed neighbors of all papers. Returns None if the graph is not available or was built for
+        another version of the paper matrix.
+        """
+        return self._fresh_neighbor_graph(self._vectorizer.paper_matrix)
+
+    def _fresh_neighbor_graph(self, paper_matrix):
+        graph = self._neighbor_graph_reference.reference
+        if graph is None or not graph.is_fresh(paper_matrix.get('version')):
+            return None
+        return graph
 
     def similar(self, doi: str, top: int = None):
-        indices, scores = self._vectorizer.similar_to_paper(doi)
-        results = list(zip(indices, scores))
-        if top is None:
-            top = len(results) - 1
-        results = heapq.nlargest(top, results, key=lambda x: x[1])
-        return results
+        paper_matrix = self._vectorizer.paper_matrix
+        graph = self._fresh_neighbor_graph(paper_matrix)
+        if graph is not None and top is not None and top <= graph.k and doi in graph.id_map:
+            return graph.similar(doi, top=top)
+        return self.similar_to_many([doi], top=top, paper_matrix=paper_matrix)
+
+    def similar_to_many(self, dois, top: int = None, paper_matrix=None):
+        """
+        Finds the papers with the highest summed similarity to the given papers. The given papers themselves are
+        excluded from the result.
+        :param dois: The dois of the papers.
+        :param top: Optional. Number of papers to return, all papers are returned if not set.
+        :param paper_matrix: Optional. The paper matrix dict, defaults to the loaded matrix.
+        :return: List of (doi, score) tuples, sorted by descending score.
+        """
+        paper_matrix = paper_matrix or self._vectorizer.paper_matrix
+        rows, scores = self._vectorizer.similar_to_papers(dois, paper_matrix=paper_matrix)
+        if len(rows) == 0:
+            return []
+
+        scores[rows] = -np.inf
+        candidate_count = len(scores) - len(np.unique(rows))
+        top = candidate_count if top is None else min(top, candidate_count)
+        if top <= 0:
+            return []
+
+        best = np.argpartition(scores, len(scores) - top)[-top:]
+        best = best[np.argsort(scores[best])[::-1]]
+
+        index_arr = paper_matrix['index_arr']
+        return [(index_arr[row], score) for row, score in zip(best.tolist(), scores[best].tolist())]
 
     def is_ready(self):
         try:
@@ -0,0 +1,24 @@
+from tasks.definitions import Runnable, register_task
+from . import get_vectorizer, get_used_vectorizers
+
+
+@register_task
+class CompactPaperMatrix(Runnable):
+
+    @staticmethod
+    def task_name():
+        return "compact-paper-matrix"
+
+    def __init__(self, vectorizer: str = '', *args, **kwargs):
+        super(CompactPaperMatrix, self).__init__(*args, **kwargs)
+        self._vectorizer = vectorizer
+
+    def run(self):
+        self.log("Compaction started")
+        vectorizer_names = [self._vectorizer] if self._vectorizer else get_used_vectorizers()
+
+        for vectorizer_name in self.progress(vectorizer_names):
+            self.log(f'Compacting {vectorizer_name}')
+            get_vectorizer(vectorizer_name).compact_paper_matrix()
+
+        self.log("Compaction finished")
@@ -0,0 +1,170 @@
+import json
+import os
+
+import torch
+import torch.nn as nn
+
+EAGER_BACKEND = 'eager'
+QUANTIZED_TORCHSCRIPT_BACKEND = 'quantized-torchscript'
+
+TOKEN_KEYS = ['input_ids', 'token_type_ids', 'attention_mask']
+
+
+def quantize_dynamic(model):
+    """
+    Replaces the linear layers of the model by dynamically int8 quantised linear layers.
+    :param model: The model in evaluation mode.
+    :return: The quantised model.
+    """
+    return torch.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def relative_error(expected, actual):
+    """
+    Maximum relative L2 error of the rows of actual compared to expected.
+    """
+    expected, actual = expected.float(), actual.float()
+    errors = torch.norm(actual - expected, dim=-1) / torch.clamp(torch.norm(expected, dim=-1), min=1e-9)
+    return errors.max().item()
+
+
+class _TraceableEmbeddingModel(nn.Module):
+    """
+    The embedding model receives a feature dict, which cannot be traced. This module passes the tensors explicitly.
+    """
+
+    def __init__(self, model):
+        super(_TraceableEmbeddingModel, self).__init__()
+        self.model = model
+
+    def forward(self, input_ids, token_type_ids, attention_mask):
+        return self.model({'input_ids': input_ids, 'token_type_ids': token_type_ids,
+                           'attention_mask': attention_mask})
+
+
+class EagerBackend:
+    """
+    Runs the PyTorch model as it is.
+    """
+    name = EAGER_BACKEND
+
+    def __init__(self, model):
+        self._model = model
+
+    def __call__(self, features):
+        return self._model(features)
+
+
+class QuantizedTorchScriptBackend:
+    """
+    Runs a TorchScript graph of the dynamically int8 quantised embedding model. The graph is exported once into the
+    model directory, together with the result of the parity check against the eager model.
+    """
+    name = QUANTIZED_TORCHSCRIPT_BACKEND
+    TRACED_MODEL_FILE = 'quantized_traced.pt'
+    PARITY_FILE = 'quantized_traced_parity.json'
+
+    def __init__(self, traced_model):
+        self._traced_model = traced_model
+
+    def __call__(self, features):
+        return self._traced_model(*[features[key] for key in TOKEN_KEYS])
+
+    @staticmethod
+    def _parity_inputs(example_features):
+        """
+        The inputs of the parity check. The embedding pipeline runs the graph with batches of varying size that are
+        trimmed to their longest window, so the padded examples are checked together with trimmed batches.
+        :param example_features: Tokenized example inputs, padded to the maximum length.
+        :return: List of feature dicts.
+        """
+        batch_size, max_length = example_features['input_ids'].shape
+        longest = int(example_features['attention_mask'].sum(dim=1).max())
+        inputs = []
+        for length in sorted({max_length, longest, min(64, max_length), min(16, max_length)}):
+            for size in sorted({1, batch_size}):
+                inputs.append({key: example_features[key][:size, :length].contiguous() for key in TOKEN_KEYS})
+        return inputs
+
+    @staticmethod
+    def export(model, model_path, example_features, tolerance):
+        """
+        Quantises and traces the model and checks that its outputs match the eager model for several batch sizes
+        and sequence lengths.
+        :param model: The eager model in evaluation mode.
+        :param model_path: Directory the graph and the parity result are written to.
+        :param example_features: Tokenized example inputs, used for tracing and for the parity check.
+        :param tolerance: Maximum relative L2 error of the quantised embeddings.
+        :return: The backend or None if the parity check failed.
+        """
+        example_inputs = tuple(example_features[key] for key in TOKEN_KEYS)
+        parity_inputs = QuantizedTorchScriptBackend._parity_inputs(example_features)
+        with torch.no_grad():
+            traced_model = torch.jit.trace(_TraceableEmbeddingModel(quantize_dynamic(model)), example_inputs,
+                                           check_trace=False)
+            errors = [relative_error(model(dict(features)), traced_model(*[features[key] for key in TOKEN_KEYS]))
+                      for features in parity_inputs]
+        error = max(errors)
+
+        parity = {'relative_error': error, 'tolerance': tolerance, 'passed': error <= tolerance,
+                  'shapes': [list(features['input_ids'].shape) for features in parity_inputs]}
+        with open(os.path.join(model_path, QuantizedTorchScriptBackend.PARITY_FILE), 'w') as f:
+            json.dump(parity, f)
+
+        print(f'Quantised model has a relative error of {error:.4f} on {len(errors)} input shapes '
+              f'(tolerance {tolerance})')
+        if not parity['passed']:
+            return None
+
+        torch.jit.save(traced_model, os.path.join(model_path, QuantizedTorchScriptBackend.TRACED_MODEL_FILE))
+        return QuantizedTorchScriptBackend(traced_model)
+
+    @staticmethod
+    def load(model_path):
+        """
+        Loads a previously exported graph.
+        :param model_path: The model directory.
+        :return: The backend or None if no graph was exported or it did not pass the parity check.
+        """
+        traced_model_path = os.path.join(model_path, QuantizedTorchScriptBackend.TRACED_MODEL_FILE)
+        parity_path = os.path.join(model_path, QuantizedTorchScriptBackend.PARITY_FILE)
+        if not os.path.exists(traced_model_path) or not os.path.exists(parity_path):
+            return None
+
+        with open(parity_path, 'r') as f:
+            parity = json.load(f)
+        if not parity['passed'] or 'shapes' not in parity:
+            # graphs exported before trimmed batches were checked are exported again
+            return None
+        if os.path.getmtime(traced_model_path) < os.path.getmtime(os.path.join(model_path, 'pytorch_model.bin')):
+            # the model was updated after the export
+            return None
+
+        return QuantizedTorchScriptBackend(torch.jit.load(traced_model_path, map_location='cpu'))
+
+
+def get_inference_backend(name, model, model_path, example_features, tolerance=0.05):
+    """
+    Creates the inference backend for an embedding model. Falls back to the eager model if the quantised graph
+    cannot be created or does not match the eager model.
+    :param name: Name of the backend.
+    :param model: The eager model in evaluation mode.
+    :param model_path: The model directory.
+    :param example_features: Tokenized example inputs that are used for exporting the graph.
+    :param tolerance: Maximum relative L2 error of the quantised embeddings.
+    :return: The backend.
+    """
+    if name == QUANTIZED_TORCHSCRIPT_BACKEND:
+        try:
+            backend = QuantizedTorchScriptBackend.load(model_path)
+            if backend is None:
+                backend = QuantizedTorchScriptBackend.export(model, model_path, example_features, tolerance)
+            if backend is not None:
+                return backend
+            print("Quantised model did not pass the parity check, using eager model")
+        except (RuntimeError, OSError) as e:
+            print("Could not create quantised model, using eager model:", e)
+    elif name != EAGER_BACKEND:
+        raise ValueError("Unknown inference backend: " + name)
+
+    return EagerBackend(model)
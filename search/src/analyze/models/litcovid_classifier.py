@@ -5,6 +5,7 @@ from transformers import (
 import torch.nn.functional
 from src.analyze.models.longformer import LongformerForSequenceClassification
 from src.analyze.models.utils import batch_iterator
+from src.analyze.models.inference_backend import quantize_dynamic
 import torch
 
 # the 8 litcovid categories
@@ -14,11 +15,14 @@ categories = ['general', 'mechanism', 'transmission', 'diagnosis', 'treatment',
 
 class LitcovidMultiLabelClassifier():
 
-    def __init__(self, model_path_or_name, device='cuda'):
+    def __init__(self, model_path_or_name, device='cuda', quantize=False, parity_tolerance=0.05):
         """
         Creates a new LitcovidMultiLabelClassifier from a given model path or name.
         :param model_path_or_name: A model name or the path to the saved model
         :param device: which device to use. For example 'cpu' or 'cuda'
+        :param quantize: Whether the linear layers should be dynamically quantised to int8. Only supported on cpu.
+        :param parity_tolerance: Maximum difference of the probabilities of the quantised and the original model
+        on the first batch. The original model is used if the difference is larger.
         """
         self.tokenizer = AutoTokenizer.from_pretrained(model_path_or_name)
         self.config = LongformerConfig.from_pretrained(model_path_or_name, num_labels=len(categories))
@@ -31,6 +35,31 @@ class LitcovidMultiLabelClassifier():
         self.model.to(device)
         self.model.eval()
 
+        self.quantized_model = None
+        self.parity_tolerance = parity_tolerance
+        if quantize and device == 'cpu':
+            self.quantized_model = quantize_dynamic(self.model)
+
+    def _probabilities(self, model, tokens):
+        logits = model(**tokens)[0]
+        return torch.nn.functional.sigmoid(logits).detach().cpu().numpy()
+
+    def _check_parity(self, tokens):
+        """
+        Compares the quantised model with the original model on the given tokens. If they do not match, the
+        quantised model is discarded.
+        :return: The probabilities of the original model.
+        """
+        probabilities = self._probabilities(self.model, tokens)
+        difference = abs(self._probabilities(self.quantized_model, tokens) - probabilities).max()
+        if difference <= self.parity_tolerance:
+            print(f'Using quantised classifier, maximum probability difference {difference:.4f}')
+            self.model = self.quantized_model
+        else:
+            print(f'Quantised classifier differs by {difference:.4f}, using original classifier')
+        self.quantized_model = None
+        return probabilities
+
     def _tokenize(self, inputs):
         """
         tokenize the input texts
@@ -56,7 +85,9 @@ class LitcovidMultiLabelClassifier():
             input = [(paper.title, paper.data.abstract) for paper in papers]
             tokens = self._tokenize(input)
             with torch.no_grad():
-                logits = self.model(**tokens)[0]
-                probabilities = torch.nn.functional.sigmoid(logits).detach().cpu().numpy()
+                if self.quantized_model is not None:
+                    probabilities = self._check_parity(tokens)
+                else:
+                    probabilities = self._probabilities(self.model, tokens)
                 for paper, distribution in zip(papers, probabilities):
                     yield paper, {categories[idx]: prob.item() for idx, prob in enumerate(distribution)}
@@ -1,6 +1,6 @@
 from tasks.definitions import Runnable, register_task
 from . import get_similar_paper_finder
-from data.models import Paper, Topic
+from data.models import Paper, PaperSimilarities, Topic
 from collections import defaultdict
 
 
@@ -29,9 +29,16 @@ class NearestNeighborTopicAssignment(Runnable):
             if paper.topic:
                 paper_topic_dict[paper.doi] = paper.topic.pk
 
+        # the similar papers are precomputed by the neighbor graph, papers without stored neighbors are computed
+        stored_similar_papers = dict(PaperSimilarities.objects.filter(
+            paper__topic__isnull=True, matrix_version__isnull=False).values_list('paper_id', 'similar_papers'))
+
         for paper in self.progress(papers):
             if not paper.topic:
-                similar_papers = similar_paper_finder.similar(doi=paper.doi, top=self._n_neighbors)
+                if len(stored_similar_papers.get(paper.doi, [])) >= self._n_neighbors:
+                    similar_papers = stored_similar_papers[paper.doi][:self._n_neighbors]
+                else:
+                    similar_papers = similar_paper_finder.similar(doi=paper.doi, top=self._n_neighbors)
                 topic_occurrences = defaultdict(float)
                 for doi, score in similar_papers:
                     if doi in paper_topic_dict:
@@ -1,7 +1,8 @@
 from tasks.definitions import Runnable, register_task
-from . import get_vectorizer, get_used_vectorizers
+from . import get_vectorizer, get_used_vectorizers, SIMILAR_VECTORIZER
 import time
-from data.models import Paper
+from django.db import transaction
+from data.models import Paper, PaperSimilarities
 
 
 def wait_until(condition, interval=0.1, timeout=10):
@@ -46,7 +47,10 @@ class SetupVectorizer(Runnable):
                     if not success:
                         raise RuntimeError("Could not load models")
 
-            vectorizer.preprocess(force_recompute=self._force_recompute)
+            graph = vectorizer.preprocess(force_recompute=self._force_recompute,
+                                          neighbor_graph=vectorizer_name == SIMILAR_VECTORIZER)
+            if graph is not None:
+                self._store_similar_papers(graph)
 
             # cleanup models
             if not model_loaded:
@@ -55,3 +59,24 @@ class SetupVectorizer(Runnable):
         Paper.objects.all().update(vectorized=True)
 
         self.log("Preprocessing finished")
+
+    def _store_similar_papers(self, graph, batch_size=2000):
+        """
+        Writes the neighbors of all papers whose neighbors changed or that have no stored similar papers yet to
+        the database.
+        """
+        stored_dois = set(PaperSimilarities.objects.filter(matrix_version__isnull=False)
+                          .values_list('paper_id', flat=True))
+        changed_dois = set(graph.changed_dois)
+        dois = [doi for doi in graph.index_arr if doi in changed_dois or doi not in stored_dois]
+
+        self.log(f"Storing similar papers of {len(dois)} papers")
+        for i in range(0, len(dois), batch_size):
+            batch = dois[i:i + batch_size]
+            with transaction.atomic():
+                PaperSimilarities.objects.filter(paper_id__in=batch).delete()
+                PaperSimilarities.objects.bulk_create([
+                    PaperSimilarities(paper_id=doi, matrix_version=graph.matrix_version,
+                                      similar_papers=[[similar_doi, score] for similar_doi, score in graph.similar(doi)])
+                    for doi in batch
+                ])
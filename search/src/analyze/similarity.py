@@ -4,9 +4,22 @@ import scipy.spatial.distance as dist
 
 
 class SimilarityComputer():
+    # Whether the similarity can be computed from squared euclidean distances, see from_squared_distances
+    SUPPORTS_SQUARED_DISTANCES = False
+
     def similarities(self, vectors, vec):
         raise NotImplementedError
 
+    def from_squared_distances(self, squared_distances):
+        raise NotImplementedError
+
+    def pairwise_similarities(self, vectors, queries):
+        """
+        Computes the similarities of all vectors to all queries.
+        :return: Numpy array of shape (number of vectors, number of queries).
+        """
+        return np.stack([np.asarray(self.similarities(vectors, query)) for query in queries], axis=1)
+
 
 class JensonShannonSimilarity(SimilarityComputer):
     def similarities(self, vectors, vec):
@@ -20,6 +33,30 @@ class CosineSimilarity(SimilarityComputer):
 
 
 class EuclideanSimilarity(SimilarityComputer):
+    SUPPORTS_SQUARED_DISTANCES = True
+
     def similarities(self, vectors, vec):
-        scores = 1 - dist.cdist(vectors, np.array([vec]), metric='euclidean')
-        return scores[:,0]
+        return self.from_squared_distances(self.squared_distances(vectors, np.asarray(vec)[np.newaxis, :])[:, 0])
+
+    def from_squared_distances(self, squared_distances):
+        return 1 - np.sqrt(np.maximum(squared_distances, 0))
+
+    def pairwise_similarities(self, vectors, queries):
+        return self.from_squared_distances(self.squared_distances(vectors, queries))
+
+    @staticmethod
+    def squared_distances(vectors, queries, block_size=4096):
+        """
+        Computes the squared distances by expanding them to ||v||^2 - 2 v.q + ||q||^2, which avoids the float64 copy
+        of the whole (memory mapped) matrix cdist would create. The rows are converted to float64 blockwise, such
+        that the distances of near-identical vectors do not vanish through cancellation.
+        :return: Numpy array of shape (number of vectors, number of queries).
+        """
+        queries = np.asarray(queries, dtype=np.float64)
+        query_norms = np.einsum('ij,ij->i', queries, queries)
+        squared_distances = np.empty((len(vectors), len(queries)))
+        for start in range(0, len(vectors), block_size):
+            block = np.asarray(vectors[start:start + block_size], dtype=np.float64)
+            squared_distances[start:start + block_size] = np.einsum('ij,ij->i', block, block)[:, np.newaxis] - \
+                2 * block.dot(queries.T) + query_norms[np.newaxis, :]
+        return np.maximum(squared_distances, 0)
@@ -0,0 +1,244 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+import joblib
+import numpy as np
+import torch
+from django.test import SimpleTestCase, TestCase, override_settings
+from transformers import BertTokenizer, BertTokenizerFast
+
+from data.models import DataSource, Paper, PaperData, PaperHost
+from src.analyze.similarity import EuclideanSimilarity
+from src.analyze.vectorizer import PaperVectorizer
+from src.analyze.vectorizer.paper_vectorizer import model_files_digest
+from src.analyze.vectorizer.utils.matrix_segments import MatrixSegments, SegmentedEmbeddings
+from src.analyze.vectorizer.utils.query_embedding_cache import QueryEmbeddingCache
+from src.analyze.vectorizer.utils.sliding_window_tokenizer import SlidingWindowTokenizer
+
+
+class MatrixSegmentsTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'matrix.pkl')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip_with_tombstones(self):
+        base = np.arange(2 * 4 * 3, dtype=np.float32).reshape((2, 4, 3))
+        base_file = MatrixSegments.write_segment(self.directory, 'matrix', base)
+        segments = MatrixSegments(version='v1', embedding_keys=['title', 'abstract'],
+                                  segments=[{'file': base_file, 'dois': ['a', 'b', 'c', 'd'], 'hashes': None}],
+                                  deleted=[])
+        segments.write(self.path)
+
+        delta = -np.arange(2 * 2 * 3, dtype=np.float32).reshape((2, 2, 3))
+        delta_file = MatrixSegments.write_segment(self.directory, 'matrix', delta)
+        segments = MatrixSegments.read(self.path)
+        # b is updated by the delta, c is deleted and e is new
+        segments.append(delta_file, ['b', 'e'], ['c'], version='v2')
+        segments.write(self.path)
+
+        segments = MatrixSegments.read(self.path)
+        self.assertEqual(segments.version, 'v2')
+        self.assertEqual(segments.file_names, [base_file, delta_file])
+        self.assertEqual(segments.dois, ['a', 'd', 'b', 'e'])
+
+        paper_matrix = segments.load(self.directory)
+        self.assertEqual(paper_matrix['index_arr'], ['a', 'd', 'b', 'e'])
+        self.assertEqual(paper_matrix['id_map'], {'a': 0, 'd': 1, 'b': 2, 'e': 3})
+        for i, key in enumerate(['title', 'abstract']):
+            expected = np.concatenate([base[i][[0, 3]], delta[i]])
+            self.assertIsInstance(paper_matrix[key], SegmentedEmbeddings)
+            np.testing.assert_array_equal(np.asarray(paper_matrix[key]), expected)
+            np.testing.assert_array_equal(paper_matrix[key][[3, 0, 2]], expected[[3, 0, 2]])
+            np.testing.assert_array_equal(paper_matrix[key].map_rows(lambda block: block.sum(axis=1)),
+                                          expected.sum(axis=1))
+
+    def test_single_base_segment_is_memory_mapped(self):
+        base = np.ones((1, 3, 2), dtype=np.float32)
+        base_file = MatrixSegments.write_segment(self.directory, 'matrix', base)
+        MatrixSegments(version='v1', embedding_keys=['matrix'],
+                       segments=[{'file': base_file, 'dois': ['a', 'b', 'c']}], deleted=[]).write(self.path)
+
+        paper_matrix = MatrixSegments.read(self.path).load(self.directory)
+        self.assertIsInstance(paper_matrix['matrix'], np.memmap)
+
+    def test_unreferenced_files(self):
+        segments = MatrixSegments(version='v1', embedding_keys=['matrix'],
+                                  segments=[{'file': 'matrix_0123456789ab.npy', 'dois': []}], deleted=[])
+        file_names = ['matrix_0123456789ab.npy', 'matrix_ba9876543210.npy', 'matrix_ann.pkl', 'other_0123456789ab.npy']
+        self.assertEqual(segments.unreferenced_files(file_names, 'matrix'), ['matrix_ba9876543210.npy'])
+
+
+class _CountingVectorizer(PaperVectorizer):
+    """
+    Embeds the length of the title and records the embedded papers.
+    """
+
+    def __init__(self, fingerprint=None):
+        super(_CountingVectorizer, self).__init__(matrix_file_name='counting.pkl',
+                                                  similarity_computer=EuclideanSimilarity())
+        self.fingerprint = fingerprint
+        self.embedded_dois = []
+
+    def model_fingerprint(self):
+        return self.fingerprint
+
+    def paper_texts(self, paper):
+        return [paper.title]
+
+    def _compute_paper_matrix_contents(self, papers):
+        self.embedded_dois.extend(paper.doi for paper in papers)
+        return {'matrix': np.array([[len(paper.title), 1] for paper in papers], dtype=np.float32)}
+
+
+class LegacyPaperMatrixTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = override_settings(PAPER_MATRIX_BASE_DIR=self.directory)
+        self.settings_override.enable()
+
+        host = PaperHost.objects.create(name='host')
+        for doi, title, vectorized in [('10.1/a', 'first paper', True), ('10.1/b', 'second paper', True),
+                                       ('10.1/c', 'new paper', False)]:
+            Paper.objects.create(doi=doi, title=title, host=host, data=PaperData.objects.create(abstract=''),
+                                 data_source_value=DataSource.ARXIV, vectorized=vectorized)
+
+        self.legacy_matrix = np.array([[1, 2], [3, 4]], dtype=np.float32)
+        joblib.dump({'matrix': self.legacy_matrix, 'index_arr': ['10.1/a', '10.1/b'],
+                     'id_map': {'10.1/a': 0, '10.1/b': 1}, 'version': 'legacy'},
+                    os.path.join(self.directory, 'counting.pkl'))
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory)
+
+    def test_legacy_matrix_is_updated_incrementally(self):
+        vectorizer = _CountingVectorizer()
+        segments, segment_files, changed_dois = vectorizer.update_paper_matrix()
+
+        self.assertEqual(vectorizer.embedded_dois, ['10.1/c'])
+        self.assertEqual(changed_dois, ['10.1/c'])
+        self.assertEqual(len(segments.segments), 2)
+        self.assertEqual(segment_files, segments.file_names)
+
+        paper_matrix = MatrixSegments.read(os.path.join(self.directory, 'counting.pkl')).load(self.directory)
+        self.assertEqual(paper_matrix['index_arr'], ['10.1/a', '10.1/b', '10.1/c'])
+        np.testing.assert_array_equal(np.asarray(paper_matrix['matrix']),
+                                      np.array([[1, 2], [3, 4], [len('new paper'), 1]], dtype=np.float32))
+
+
+class PaperMatrixUpdateTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = override_settings(PAPER_MATRIX_BASE_DIR=self.directory)
+        self.settings_override.enable()
+
+        host = PaperHost.objects.create(name='host')
+        for doi, title in [('10.1/a', 'first paper'), ('10.1/b', 'second paper')]:
+            Paper.objects.create(doi=doi, title=title, host=host, data=PaperData.objects.create(abstract=''),
+                                 data_source_value=DataSource.ARXIV)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory)
+
+    def test_only_papers_with_changed_texts_are_reported(self):
+        _, _, changed_dois = _CountingVectorizer(fingerprint='counting').update_paper_matrix()
+        self.assertIsNone(changed_dois)
+        Paper.objects.update(vectorized=True)
+
+        # the title of a changes, b is only marked as updated
+        Paper.objects.filter(doi='10.1/a').update(title='first paper, revised', vectorized=False)
+        Paper.objects.filter(doi='10.1/b').update(vectorized=False)
+
+        vectorizer = _CountingVectorizer(fingerprint='counting')
+        _, _, changed_dois = vectorizer.update_paper_matrix()
+        self.assertEqual(vectorizer.embedded_dois, ['10.1/a'])
+        self.assertEqual(changed_dois, ['10.1/a'])
+
+    @override_settings(USE_QUANTIZED_EMBEDDINGS=True, USE_ANN_INDEX=False, USE_LEXICAL_RERANKER=False,
+                       PUSH_PAPER_MATRIX=False)
+    def test_artifacts_are_only_rebuilt_for_new_versions(self):
+        vectorizer = _CountingVectorizer(fingerprint='counting')
+        with mock.patch.object(vectorizer, 'build_quantized_embeddings',
+                               wraps=vectorizer.build_quantized_embeddings) as build:
+            vectorizer.preprocess()
+            vectorizer.preprocess()
+            self.assertEqual(build.call_count, 1)
+
+            Paper.objects.filter(doi='10.1/a').update(title='first paper, revised', vectorized=False)
+            vectorizer.preprocess()
+            self.assertEqual(build.call_count, 2)
+
+
+class SlidingWindowTokenizerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        vocab_file = os.path.join(self.directory, 'vocab.txt')
+        # whole words only, such that tokenizing the overflowing tokens again does not split them
+        self.words = [f'word{i}' for i in range(100)]
+        with open(vocab_file, 'w') as f:
+            f.write('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + self.words))
+        self.slow_tokenizer = BertTokenizer(vocab_file)
+        self.fast_tokenizer = BertTokenizerFast(vocab_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_batch_and_sequential_windows_are_equal(self):
+        # a single window, exactly one full window, two, three and more than max_windows windows
+        texts = [' '.join(self.words[:length]) for length in [5, 14, 15, 30, 100]]
+        sequential, sequential_index = SlidingWindowTokenizer(self.slow_tokenizer, max_length=16, overlap=4,
+                                                              max_windows=3)._tokenize_sequential(texts)
+        batch, batch_index = SlidingWindowTokenizer(self.fast_tokenizer, max_length=16, overlap=4,
+                                                    max_windows=3)._tokenize_batch(texts)
+
+        self.assertEqual(sequential_index, [1, 2, 4, 7, 10])
+        self.assertEqual(batch_index, sequential_index)
+        for key in ['input_ids', 'token_type_ids', 'attention_mask']:
+            self.assertTrue(torch.equal(batch[key], sequential[key]), key)
+
+
+class QueryEmbeddingCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_embeddings_are_keyed_by_model_fingerprint(self):
+        cache = QueryEmbeddingCache()
+        cache.put('model:old', 'Covid  Vaccine', [1, 2])
+
+        np.testing.assert_array_equal(cache.get('model:old', 'covid vaccine'), [1, 2])
+        self.assertIsNone(cache.get('model:new', 'covid vaccine'))
+
+    def test_persisted_embeddings_of_other_weights_are_not_used(self):
+        model_path = os.path.join(self.directory, 'model')
+        os.makedirs(model_path)
+        with open(os.path.join(model_path, 'pytorch_model.bin'), 'wb') as f:
+            f.write(b'old weights')
+        old_fingerprint = 'model:' + model_files_digest(model_path)
+
+        file_path = os.path.join(self.directory, 'cache', 'query_embeddings.pkl')
+        cache = QueryEmbeddingCache(file_path=file_path, persist_interval=3600)
+        cache.put(old_fingerprint, 'covid', [1, 2])
+        cache.save()
+
+        with open(os.path.join(model_path, 'pytorch_model.bin'), 'wb') as f:
+            f.write(b'new weights')
+        new_fingerprint = 'model:' + model_files_digest(model_path)
+        self.assertNotEqual(new_fingerprint, old_fingerprint)
+
+        restored = QueryEmbeddingCache(file_path=file_path, persist_interval=3600)
+        self.assertIsNone(restored.get(new_fingerprint, 'covid'))
+        np.testing.assert_array_equal(restored.get(old_fingerprint, 'covid'), [1, 2])
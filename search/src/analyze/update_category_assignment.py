@@ -24,7 +24,8 @@ class UpdateCategoryAssignment(Runnable):
 
         self.log("Loading classifier")
         classifier = LitcovidMultiLabelClassifier(os.path.join(settings.MODELS_BASE_DIR, "litcovid_longformer_base"),
-                                                  device='cpu')
+                                                  device='cpu', quantize=settings.QUANTIZE_CATEGORY_CLASSIFIER,
+                                                  parity_tolerance=settings.INFERENCE_PARITY_TOLERANCE)
         self.log("Loaded classifier. Retrieving papers...")
 
         if self._force_recompute:
@@ -1,6 +1,7 @@
 from .paper_vectorizer import PaperVectorizer
 from .sentence_vectorizer import TitleSentenceVectorizer
 from .transformer_paper_vectorizer import TransformerPaperVectorizer
+from django.conf import settings
 
 vectorizers = dict()
 
@@ -13,15 +14,18 @@ def get_vectorizer(type) -> PaperVectorizer:
     elif type == 'transformer-paper-oubiobert-512':
         vectorizers[type] = TransformerPaperVectorizer(matrix_file_name='transformer_paper_oubiobert_512.pkl',
                                                        transformer_model_name='transformer_paper_oubiobert_512',
-                                                       transformer_model_type='bert')
+                                                       transformer_model_type='bert',
+                                                       inference_backend=settings.INFERENCE_BACKEND)
     elif type == 'transformer-paper-sensitive-512':
         vectorizers[type] = TransformerPaperVectorizer(matrix_file_name='transformer_paper_sensitive_512.pkl',
                                                        transformer_model_name='transformer_paper_sensitive_512',
-                                                       transformer_model_type='bert')
+                                                       transformer_model_type='bert',
+                                                       inference_backend=settings.INFERENCE_BACKEND)
     elif type == 'transformer-paper-no-locations':
         vectorizers[type] = TransformerPaperVectorizer(matrix_file_name='transformer_paper_no_locations.pkl',
                                                        transformer_model_name='transformer_paper_no_locations',
-                                                       transformer_model_type='bert')
+                                                       transformer_model_type='bert',
+                                                       inference_backend=settings.INFERENCE_BACKEND)
     else:
         raise ValueError("Unknown type")
     return vectorizers[type]
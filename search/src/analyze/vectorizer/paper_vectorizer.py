@@ -6,22 +6,90 @@ from data.models import Paper
 import numpy as np
 from collabovid_store.stores import PaperMatrixStore, refresh_local_timestamps
 from collabovid_store.s3_utils import S3BucketClient
+from .utils.ann_index import IVFIndex
+from .utils.neighbor_graph import NeighborGraph
+from .utils.quantization import QuantizedEmbeddings
+from .utils.matrix_segments import MatrixSegments, map_rows
+from .utils.lexical_index import LexicalIndex
 import os
+import uuid
+import hashlib
+import threading
+
+# Keys of the paper matrix dict that do not contain embeddings
+PAPER_MATRIX_METADATA_KEYS = ['index_arr', 'id_map', 'version']
 
 
 def load_paper_matrix(x):
-    return joblib.load(x)
+    segments = MatrixSegments.read(x)
+    if segments is None:
+        return joblib.load(x)
+
+    try:
+        return segments.load(os.path.dirname(x))
+    except (ValueError, OSError) as e:
+        raise CouldNotLoadPaperMatrix("Could not load segments of {}: {}".format(x, e))
+
+
+def model_files_digest(model_path):
+    """
+    Computes a digest of the weights of a model.
+    :param model_path: The model directory, all pytorch_model.bin files below it are considered.
+    :return: Hex digest.
+    """
+    digest = hashlib.sha1()
+    for root, directories, files in sorted(os.walk(model_path)):
+        directories.sort()
+        if 'pytorch_model.bin' in files:
+            digest.update(os.path.relpath(root, model_path).encode('utf-8'))
+            with open(os.path.join(root, 'pytorch_model.bin'), 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+def dump_paper_matrix(paper_matrix, embedding_keys, path, hashes=None, model=None):
+    """
+    Writes the embeddings of the paper matrix as a single base segment next to the given path and the manifest
+    (dois, version and segments) to the path itself.
+    :param paper_matrix: The paper matrix dict.
+    :param embedding_keys: The keys of the embeddings, all embeddings need to have the same dimension.
+    :param path: Path of the paper matrix file.
+    :param hashes: The text hashes of the rows.
+    :param model: Fingerprint of the model that computed the embeddings.
+    :return: The segments of the written matrix.
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    embeddings = np.stack([np.asarray(paper_matrix[key], dtype=np.float32) for key in embedding_keys])
+    segment_file = MatrixSegments.write_segment(os.path.dirname(path), stem, embeddings)
+
+    segments = MatrixSegments(version=paper_matrix['version'], embedding_keys=embedding_keys,
+                              segments=[{'file': segment_file, 'dois': list(paper_matrix['index_arr']),
+                                         'hashes': list(hashes) if hashes is not None else None}],
+                              deleted=[], model=model)
+    segments.write(path)
+    return segments
 
 
 class PaperVectorizer:
 
     def __init__(self, matrix_file_name, similarity_computer, *args, **kwargs):
         self.matrix_file_name = matrix_file_name
+        self.ann_index_file_name = matrix_file_name.replace('.pkl', '_ann.pkl')
+        self.neighbor_graph_file_name = matrix_file_name.replace('.pkl', '_knn.pkl')
+        self.quantized_file_name = matrix_file_name.replace('.pkl', '_int8.pkl')
+        self.lexical_file_name = matrix_file_name.replace('.pkl', '_lexical.pkl')
         self._similarity_computer = similarity_computer
         self._paper_matrix_reference = AutoUpdateReference(base_path=settings.PAPER_MATRIX_BASE_DIR,
-                                                           key=matrix_file_name, load_function=load_paper_matrix)
+                                                           key=matrix_file_name, load_function=load_paper_matrix,
+                                                           background=True)
+        self._quantized_reference = AutoUpdateReference(base_path=settings.PAPER_MATRIX_BASE_DIR,
+                                                        key=self.quantized_file_name,
+                                                        load_function=lambda path: joblib.load(path, mmap_mode='r'),
+                                                        background=True)
         self._is_initializing = False
         self._is_initialized = False
+        self._initialize_lock = threading.Lock()
 
     def vectorize_query(self, query: str):
         """
@@ -31,12 +99,24 @@ class PaperVectorizer:
         """
         raise NotImplementedError()
 
+    def vectorize_queries(self, queries):
+        """
+        Vectorizes several queries at once.
+        :param queries: List of query strings.
+        :return: Numpy array with one row per query.
+        """
+        return np.stack([self.vectorize_query(query) for query in queries])
+
     def initialize_models(self):
-        if not self._is_initializing:
-            self._is_initializing = True
-            self._load_models()
-            self._is_initialized = True
-            self._is_initializing = False
+        # concurrent callers wait until the models are loaded instead of returning early
+        with self._initialize_lock:
+            if not self._is_initialized:
+                self._is_initializing = True
+                try:
+                    self._load_models()
+                    self._is_initialized = True
+                finally:
+                    self._is_initializing = False
 
     def cleanup_models(self):
         self._is_initialized = False
@@ -57,30 +137,266 @@ class PaperVectorizer:
     def _compute_paper_matrix_contents(self, papers):
         raise NotImplementedError()
 
+    def paper_texts(self, paper):
+        """
+        The normalised texts of a paper that its embeddings are computed from.
+        :param paper: The paper.
+        :return: List of strings.
+        """
+        raise NotImplementedError()
+
+    def text_hash(self, paper):
+        digest = hashlib.blake2b(digest_size=16)
+        for text in self.paper_texts(paper):
+            digest.update(text.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def model_fingerprint(self):
+        """
+        Identifies the model that computes the embeddings of papers. Embeddings of unchanged texts are only reused
+        if they were computed by the same model.
+        :return: The fingerprint or None if embeddings should not be reused.
+        """
+        return None
+
     def matching_to_query(self, query: str):
         embedding = self.vectorize_query(query)
         return self._compute_similarity_scores(embedding)
 
     def similar_to_paper(self, doi: str):
-        matrix = self.paper_matrix['matrix']
-        matrix_index = self.paper_matrix['id_map'][doi]
-        dois, scores = self._compute_similarity_scores(matrix[matrix_index])
+        paper_matrix = self.paper_matrix
+        matrix_index = paper_matrix['id_map'][doi]
+        _, scores = self.similar_to_papers([doi], paper_matrix=paper_matrix)
+        scores = scores.tolist()
         del scores[matrix_index]
-        dois = dois[:matrix_index] + dois[matrix_index + 1:]
+        dois = paper_matrix['index_arr'][:matrix_index] + paper_matrix['index_arr'][matrix_index + 1:]
         return dois, scores
 
-    def preprocess(self, force_recompute=False):
-        paper_matrix = self.compute_paper_matrix(force_recompute=force_recompute)
+    def similar_to_papers(self, dois, paper_matrix=None):
+        """
+        Computes the similarity of all papers to each of the given papers in one pass and sums them up.
+        :param dois: The dois of the papers. Dois that are not part of the matrix are ignored.
+        :param paper_matrix: Optional. The paper matrix dict, defaults to the loaded matrix.
+        :return: Tuple of the matrix rows of the given papers and a numpy array with the summed score of every row.
+        """
+        paper_matrix = paper_matrix or self.paper_matrix
+        rows = self.matrix_rows(dois, paper_matrix=paper_matrix)
+        quantized = self.fresh_quantized_embeddings(paper_matrix)
+        if quantized is None or len(rows) == 0:
+            return rows, self.paper_similarities(rows, paper_matrix=paper_matrix).sum(axis=1)
+
+        scores = self.paper_similarities(rows, paper_matrix=paper_matrix, quantized=quantized).sum(axis=1)
+        candidates = self._rerank_candidates(scores)
+        scores[candidates] = self.paper_similarities(rows, paper_matrix=paper_matrix,
+                                                     candidates=candidates).sum(axis=1)
+        return rows, scores
+
+    def query_similarity_terms(self):
+        """
+        The similarity of a query to a paper is the weighted sum of the similarities to the paper's embeddings.
+        :return: List of (weight, embedding key) tuples.
+        """
+        return [(1.0, 'matrix')]
+
+    def paper_similarity_terms(self):
+        """
+        The similarity of two papers is the weighted sum of the similarities between embeddings of the papers.
+        :return: List of (weight, embedding key of the compared paper, embedding key of the query paper) tuples.
+        """
+        return [(1.0, 'matrix', 'matrix')]
+
+    def paper_similarities(self, rows, paper_matrix=None, candidates=None, quantized=None):
+        """
+        Computes the similarity of all papers to the papers of the given rows.
+        :param rows: Matrix rows of the papers.
+        :param paper_matrix: Optional. The paper matrix dict, defaults to the loaded matrix.
+        :param candidates: Optional. Restricts the computation to the given matrix rows.
+        :param quantized: Optional. Quantised embeddings that are scanned instead of the matrix.
+        :return: Numpy array of shape (number of papers or candidates, number of rows).
+        """
+        paper_matrix = paper_matrix or self.paper_matrix
+        scores = 0
+        for weight, vector_key, query_key in self.paper_similarity_terms():
+            queries = paper_matrix[query_key][rows]
+            if quantized is not None:
+                similarities = self._similarity_computer.from_squared_distances(
+                    quantized.squared_distances(vector_key, queries))
+            else:
+                vectors = paper_matrix[vector_key]
+                if candidates is not None:
+                    vectors = vectors[candidates]
+                similarities = map_rows(vectors, lambda block: self._similarity_computer.pairwise_similarities(
+                    block, queries))
+            scores = scores + weight * similarities
+        return scores
+
+    def matrix_rows(self, dois, paper_matrix=None):
+        id_map = (paper_matrix or self.paper_matrix)['id_map']
+        return np.array([id_map[doi] for doi in dois if doi in id_map], dtype=np.int64)
+
+    def embedding_keys(self, paper_matrix):
+        return [key for key in paper_matrix.keys() if key not in PAPER_MATRIX_METADATA_KEYS]
+
+    def ann_vectors(self, paper_matrix):
+        """
+        The vectors the ANN index is built from. All embeddings of a paper are concatenated such that the
+        squared distance to a query is the sum of the squared distances of the single embeddings.
+        :param paper_matrix: The paper matrix dict.
+        :return: Matrix with one row per paper.
+        """
+        return np.hstack([paper_matrix[key] for key in self.embedding_keys(paper_matrix)])
+
+    def ann_query_vector(self, embedding_vec, paper_matrix=None):
+        return np.concatenate([embedding_vec] * len(self.embedding_keys(paper_matrix or self.paper_matrix)))
+
+    def build_ann_index(self, paper_matrix):
+        print("Building ANN index")
+        index = IVFIndex.build(self.ann_vectors(paper_matrix), matrix_version=paper_matrix['version'])
+        path = os.path.join(settings.PAPER_MATRIX_BASE_DIR, self.ann_index_file_name)
+        joblib.dump(index, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        print(f'ANN index has {index.n_lists} lists for {index.size} papers')
+
+    def build_lexical_index(self, paper_matrix):
+        print("Building lexical index")
+        texts = {doi: (title, abstract) for doi, title, abstract in
+                 Paper.objects.values_list('doi', 'title', 'data__abstract').iterator()}
+        rows = [texts.get(doi, ('', '')) for doi in paper_matrix['index_arr']]
+
+        abstracts = [abstract or '' for _, abstract in rows] if settings.LEXICAL_INCLUDE_ABSTRACTS else None
+        index = LexicalIndex.build([title or '' for title, _ in rows], abstracts=abstracts,
+                                   matrix_version=paper_matrix['version'])
+        path = os.path.join(settings.PAPER_MATRIX_BASE_DIR, self.lexical_file_name)
+        joblib.dump(index, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        print(f'Lexical index has {index.weights.shape[1]} terms for {index.size} papers')
+
+    def build_neighbor_graph(self, paper_matrix, force_recompute=False, changed_dois=None, base_version=None):
+        """
+        Computes the most similar papers of every paper. The graph of the previous matrix is updated incrementally
+        unless a recomputation is forced or the graph was not built for the matrix the changes are based on.
+        :param paper_matrix: The paper matrix dict.
+        :param force_recompute: If True, the graph is computed from scratch.
+        :param changed_dois: Dois of the papers whose embeddings changed since the base version, None if unknown.
+        :param base_version: The version of the paper matrix before the changes.
+        :return: The graph.
+        """
+        path = os.path.join(settings.PAPER_MATRIX_BASE_DIR, self.neighbor_graph_file_name)
+
+        previous = None
+        if not force_recompute and os.path.exists(path):
+            previous = joblib.load(path)
+            if previous.is_fresh(paper_matrix['version']):
+                print("Neighbor graph is up to date")
+                previous.changed_dois = []
+                return previous
+            if changed_dois is None or not previous.is_fresh(base_version):
+                print("Neighbor graph is outdated, it is computed from scratch")
+                previous = None
+
+        print("Building neighbor graph")
+        graph = NeighborGraph.build(lambda rows: self.paper_similarities(rows, paper_matrix=paper_matrix),
+                                    index_arr=paper_matrix['index_arr'], k=settings.NEIGHBOR_GRAPH_SIZE,
+                                    matrix_version=paper_matrix['version'], previous=previous,
+                                    dirty_dois=set(changed_dois or []))
+        joblib.dump(graph, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        print(f'Neighbor graph changed for {len(graph.changed_dois)} of {len(graph.index_arr)} papers')
+        return graph
+
+    def build_quantized_embeddings(self, paper_matrix):
+        print("Quantising embeddings")
+        quantized = QuantizedEmbeddings.quantize(paper_matrix, self.embedding_keys(paper_matrix))
+        path = os.path.join(settings.PAPER_MATRIX_BASE_DIR, self.quantized_file_name)
+        joblib.dump(quantized, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    def _artifact_is_fresh(self, file_name, matrix_version):
+        """
+        :param file_name: The file name of the artifact.
+        :param matrix_version: The version of the paper matrix.
+        :return: True if the artifact exists and was built for the given version of the paper matrix.
+        """
+        path = os.path.join(settings.PAPER_MATRIX_BASE_DIR, file_name)
+        return os.path.exists(path) and joblib.load(path, mmap_mode='r').is_fresh(matrix_version)
+
+    @property
+    def quantized_embeddings(self):
+        """
+        The int8 quantised embeddings of the loaded paper matrix. Returns None if they are disabled, not supported
+        by the similarity, not available or stale.
+        """
+        return self.fresh_quantized_embeddings(self.paper_matrix)
 
-        # Write out matrix
-        joblib.dump(paper_matrix, os.path.join(settings.PAPER_MATRIX_BASE_DIR, self.matrix_file_name))
-        refresh_local_timestamps(settings.PAPER_MATRIX_BASE_DIR, [self.matrix_file_name])
+    def fresh_quantized_embeddings(self, paper_matrix):
+        """
+        The int8 quantised embeddings if they were built for the given paper matrix, otherwise None.
+        """
+        if not settings.USE_QUANTIZED_EMBEDDINGS or not self._similarity_computer.SUPPORTS_SQUARED_DISTANCES:
+            return None
+        quantized = self._quantized_reference.reference
+        if quantized is None or not quantized.is_fresh(paper_matrix.get('version')):
+            return None
+        return quantized
+
+    def preprocess(self, force_recompute=False, neighbor_graph=False):
+        """
+        Computes the paper matrix and its artifacts and pushes them to the remote store. The artifacts are only
+        rebuilt if the version of the paper matrix changed or they were not built for it.
+        :param force_recompute: If True, all embeddings are recomputed.
+        :param neighbor_graph: If True, the most similar papers of every paper are computed.
+        :return: The neighbor graph if it was computed, otherwise None.
+        """
+        existing = MatrixSegments.read(os.path.join(settings.PAPER_MATRIX_BASE_DIR, self.matrix_file_name))
+        base_version = existing.version if existing is not None else None
+
+        segments, segment_files, changed_dois = self.update_paper_matrix(force_recompute=force_recompute)
+        if segments is None:
+            print("No papers to vectorize")
+            return None
+
+        if segments.delta_count >= settings.PAPER_MATRIX_MAX_DELTA_SEGMENTS:
+            print(f'Paper matrix has {segments.delta_count} delta segments, it should be compacted')
+
+        paper_matrix = segments.load(settings.PAPER_MATRIX_BASE_DIR)
+        file_names = segment_files + [self.matrix_file_name]
+
+        artifacts = []
+        if settings.USE_ANN_INDEX:
+            artifacts.append((self.ann_index_file_name, self.build_ann_index))
+        if settings.USE_QUANTIZED_EMBEDDINGS and self._similarity_computer.SUPPORTS_SQUARED_DISTANCES:
+            artifacts.append((self.quantized_file_name, self.build_quantized_embeddings))
+        if settings.USE_LEXICAL_RERANKER:
+            artifacts.append((self.lexical_file_name, self.build_lexical_index))
+
+        for file_name, build in artifacts:
+            # artifacts of an unchanged matrix are neither rebuilt nor pushed again
+            if segments.version == base_version and self._artifact_is_fresh(file_name, segments.version):
+                print(f'{file_name} is up to date')
+                continue
+            build(paper_matrix)
+            file_names.append(file_name)
+
+        graph = None
+        if neighbor_graph:
+            graph = self.build_neighbor_graph(paper_matrix, force_recompute=force_recompute,
+                                              changed_dois=changed_dois, base_version=base_version)
+            file_names.append(self.neighbor_graph_file_name)
+
+        refresh_local_timestamps(settings.PAPER_MATRIX_BASE_DIR, file_names)
         if settings.PUSH_PAPER_MATRIX:
-            self._update_remote_paper_matrix()
+            self._update_remote_paper_matrix(file_names)
             print("Paper matrix exported completed")
         else:
             print("Not pushing matrix")
 
+        if force_recompute:
+            # the rebuilt matrix has a new base segment
+            self._remove_unreferenced_segments(segments)
+
+        return graph
+
     @property
     def paper_matrix(self):
         matrix = self._paper_matrix_reference.reference
@@ -89,12 +405,75 @@ class PaperVectorizer:
                 "Could not initialize with paper matrix file {}".format(self.matrix_file_name))
         return matrix
 
+    def similarity_scores(self, embedding_vec, rows=None, paper_matrix=None):
+        """
+        Computes the similarity of the given embedding to the papers of the matrix. If quantised embeddings are
+        available, all papers are scored on them and the best candidates are re-ranked with the exact embeddings.
+        :param embedding_vec: The embedding.
+        :param rows: Optional. Restricts the computation to the given matrix rows.
+        :param paper_matrix: Optional. The paper matrix dict, defaults to the loaded matrix.
+        :return: Numpy array of scores, aligned with the rows if given.
+        """
+        paper_matrix = paper_matrix or self.paper_matrix
+        quantized = self.fresh_quantized_embeddings(paper_matrix) if rows is None else None
+        if quantized is not None:
+            scores = 0
+            for weight, key in self.query_similarity_terms():
+                scores = scores + weight * self._similarity_computer.from_squared_distances(
+                    quantized.squared_distances(key, embedding_vec))
+            candidates = self._rerank_candidates(scores)
+            scores[candidates] = self.similarity_scores(embedding_vec, rows=candidates, paper_matrix=paper_matrix)
+            return scores
+
+        scores = 0
+        for weight, key in self.query_similarity_terms():
+            matrix = paper_matrix[key]
+            if rows is not None:
+                matrix = matrix[rows]
+            scores = scores + weight * map_rows(matrix, lambda block: np.asarray(
+                self._similarity_computer.similarities(block, embedding_vec)))
+        return scores
+
+    def similarity_scores_many(self, embeddings, paper_matrix=None):
+        """
+        Computes the similarity of several embeddings to all papers of the matrix with one matrix product.
+        :param embeddings: Matrix with one embedding per row.
+        :param paper_matrix: Optional. The paper matrix dict, defaults to the loaded matrix.
+        :return: Numpy array of shape (number of papers, number of embeddings).
+        """
+        paper_matrix = paper_matrix or self.paper_matrix
+        quantized = self.fresh_quantized_embeddings(paper_matrix)
+        scores = 0
+        for weight, key in self.query_similarity_terms():
+            if quantized is not None:
+                similarities = self._similarity_computer.from_squared_distances(
+                    quantized.squared_distances(key, embeddings))
+            else:
+                similarities = map_rows(paper_matrix[key], lambda block: (
+                    self._similarity_computer.pairwise_similarities(block, embeddings)))
+            scores = scores + weight * similarities
+
+        if quantized is not None:
+            for i, embedding_vec in enumerate(embeddings):
+                candidates = self._rerank_candidates(scores[:, i])
+                scores[candidates, i] = self.similarity_scores(embedding_vec, rows=candidates,
+                                                               paper_matrix=paper_matrix)
+        return scores
+
+    def _rerank_candidates(self, approximate_scores):
+        """
+        Selects the rows with the best approximate scores that are recomputed exactly.
+        """
+        count = min(settings.QUANTIZED_RERANK_SIZE, len(approximate_scores))
+        return np.sort(np.argpartition(approximate_scores, len(approximate_scores) - count)[-count:])
+
     def _compute_similarity_scores(self, embedding_vec):
-        matrix = self.paper_matrix['matrix']
-        similarity_scores = self._similarity_computer.similarities(matrix, embedding_vec)
-        return self.paper_matrix['index_arr'], similarity_scores
+        paper_matrix = self.paper_matrix
+        similarity_scores = self.similarity_scores(embedding_vec, paper_matrix=paper_matrix).tolist()
+        return paper_matrix['index_arr'], similarity_scores
 
-    def _update_remote_paper_matrix(self):
+    @staticmethod
+    def _paper_matrix_store():
         aws_access_key = settings.AWS_ACCESS_KEY_ID
         aws_secret_access_key = settings.AWS_SECRET_ACCESS_KEY
         bucket = settings.AWS_STORAGE_BUCKET_NAME
@@ -102,101 +481,182 @@ class PaperVectorizer:
         s3_bucket_client = S3BucketClient(aws_access_key=aws_access_key,
                                           aws_secret_access_key=aws_secret_access_key,
                                           endpoint_url=endpoint_url, bucket=bucket)
-        paper_matrix_store = PaperMatrixStore(s3_bucket_client)
-        paper_matrix_store.update_remote(settings.PAPER_MATRIX_BASE_DIR,
-                                         [self.matrix_file_name.replace('.pkl', '')])
-
-    def compute_paper_matrix(self, force_recompute=False):
-        old_paper_matrix = self.paper_matrix
-
-        if old_paper_matrix:
-            print("Current paper matrix has size ", len(old_paper_matrix['index_arr']), "with",
-                  Paper.objects.all().count(), "in database")
-
-        # all papers
-        papers = Paper.objects.all()
-
-        id_map = {}
-        if old_paper_matrix and not force_recompute:
-            # delete papers from matrix that are not any more in the db
-            dois = {paper.doi for paper in papers}
-            indices_to_delete = []
-            for idx, doi in enumerate(old_paper_matrix['index_arr']):
-                if doi not in dois:
-                    indices_to_delete.append(idx)
-
-            print(f'Deleting {len(indices_to_delete)} Papers from matrix')
-
-            # delete from matrix
-            for key in old_paper_matrix.keys():
-                if key not in ['index_arr', 'id_map']:
-                    old_paper_matrix[key] = np.delete(old_paper_matrix[key], indices_to_delete, axis=0)
-
-            # delete from index array
-            for idx in reversed(indices_to_delete):
-                del old_paper_matrix['index_arr'][idx]
-
-            # initialize the id_map with saved values if possible
-            for idx, doi in enumerate(old_paper_matrix['index_arr']):
-                id_map[doi] = idx
-
-            old_paper_matrix['id_map'] = id_map
-
-        # determines if a paper needs an update
-        def needs_update(paper):
-            return force_recompute or not paper.vectorized
-
-        # papers that need to be recomputed
-        filtered_papers = []
-
-        # represents the index where the paper should be inserted in the final matrix
-        new_matrix_idx = len(id_map)
-        newly_added = 0
-        updated = 0
-        for p in papers:
-            if p.doi not in id_map:
-                # paper was not in existing matrix, it needs recomputation and we will append the result
-                id_map[p.doi] = new_matrix_idx
-                filtered_papers.append(p)
-                new_matrix_idx += 1
-                newly_added += 1
-            elif needs_update(p):
-                # paper is in existing matrix, so just mark it for recomputing. An index is already saved in the id_map.
-                filtered_papers.append(p)
-                updated += 1
-
-        print(f'Newly added papers: {newly_added}')
-        print(f'Paper that need an update: {updated}')
-
-        if len(filtered_papers) > 0:
-            # construct index array based on id map
-            index_arr = [''] * len(id_map)
-            for doi, idx in id_map.items():
-                index_arr[idx] = doi
-            paper_matrix = {
-                'id_map': id_map,
-                'index_arr': index_arr,
-            }
-
-            # for every new embedding matrix that is computed, we extend the old one
-            for key, computed_matrix in self._compute_paper_matrix_contents(filtered_papers).items():
-                # dimension of newly computed values
-                matrix = np.zeros((newly_added, computed_matrix.shape[1]))
-
-                print("Matrix", matrix.shape)
-                print("Computed Matrix", computed_matrix.shape)
-
-                if old_paper_matrix and not force_recompute:
-                    # extend old matrix with dimensions of newly computed values
-                    matrix = np.append(old_paper_matrix[key], matrix, axis=0)
-
-                for i, paper in enumerate(filtered_papers):
-                    # get the matrix index for the computed value from the id map
-                    matrix_idx = id_map[paper.doi]
-                    # replace it with the new computed value
-                    matrix[matrix_idx] = computed_matrix[i]
-                paper_matrix[key] = matrix
-
-            return paper_matrix
+        return PaperMatrixStore(s3_bucket_client)
+
+    def _update_remote_paper_matrix(self, file_names):
+        self._paper_matrix_store().update_remote(settings.PAPER_MATRIX_BASE_DIR, file_names)
+
+    def _remove_unreferenced_segments(self, segments):
+        """
+        Deletes the segment files that the manifest does not reference anymore, locally and, if the matrix is
+        pushed, remotely. Search pods remove them when they sync. Must not run concurrently with an update of the
+        paper matrix, whose new segment is not referenced before its manifest is written.
+        :param segments: The segments of the paper matrix.
+        """
+        directory = settings.PAPER_MATRIX_BASE_DIR
+        stem = os.path.splitext(self.matrix_file_name)[0]
+
+        for file_name in segments.unreferenced_files(os.listdir(directory), stem):
+            try:
+                # processes that still map the file keep their copy
+                os.remove(os.path.join(directory, file_name))
+            except OSError:
+                pass
+
+        if settings.PUSH_PAPER_MATRIX:
+            paper_matrix_store = self._paper_matrix_store()
+            unreferenced = segments.unreferenced_files(paper_matrix_store.remote_keys(), stem)
+            if len(unreferenced) > 0:
+                paper_matrix_store.delete_remote(unreferenced)
+
+    def _embed_papers(self, papers, hashes, embedding_keys=None, cache=None):
+        """
+        Computes the embeddings of the papers, embeddings of texts that are found in the cache are reused.
+        :param papers: The papers.
+        :param hashes: The text hashes of the papers.
+        :param embedding_keys: The keys of the embeddings, taken from the computed contents if None.
+        :param cache: Segments of a paper matrix that was computed by the same model.
+        :return: Tuple of the embedding keys and the embeddings of shape (number of keys, number of papers,
+        dimension).
+        """
+        if cache is not None:
+            found, cached = cache.lookup(settings.PAPER_MATRIX_BASE_DIR, hashes)
+            embedding_keys = cache.embedding_keys
+        else:
+            found, cached = np.zeros(len(papers), dtype=bool), None
+
+        missing = [paper for paper, is_found in zip(papers, found) if not is_found]
+        print(f'Reusing {found.sum()} cached embeddings, computing {len(missing)} embeddings')
+
+        computed = None
+        if len(missing) > 0:
+            contents = self._compute_paper_matrix_contents(missing)
+            embedding_keys = embedding_keys or list(contents.keys())
+            computed = np.stack([np.asarray(contents[key], dtype=np.float32) for key in embedding_keys])
+
+        if computed is None:
+            return embedding_keys, cached
+        if cached is None:
+            return embedding_keys, computed
+
+        embeddings = np.empty((len(embedding_keys), len(papers), computed.shape[2]), dtype=np.float32)
+        embeddings[:, found] = cached
+        embeddings[:, ~found] = computed
+        return embedding_keys, embeddings
+
+    def update_paper_matrix(self, force_recompute=False):
+        """
+        Computes the embeddings of new and updated papers and appends them to the paper matrix as a new segment.
+        Deleted papers are marked by tombstones. If no matrix exists or a recomputation is forced, a new base
+        segment with all papers is written. Embeddings of texts that the matrix already contains are reused if the
+        model did not change, updated papers whose text did not change keep their rows. A matrix that was pickled as
+        a whole is converted into a base segment first.
+        :param force_recompute: If True, the matrix is rebuilt and all embeddings of changed texts are recomputed.
+        :return: Tuple of the segments of the paper matrix (None if there are no papers), the file names of the
+        written segments and the dois of the papers whose embeddings changed, None if the matrix was rebuilt.
+        """
+        directory = settings.PAPER_MATRIX_BASE_DIR
+        path = os.path.join(directory, self.matrix_file_name)
+        stem = os.path.splitext(self.matrix_file_name)[0]
+
+        model = self.model_fingerprint()
+        existing = MatrixSegments.read(path)
+        converted_files = []
+        if existing is None and not force_recompute and os.path.exists(path):
+            existing = self._convert_legacy_paper_matrix(path)
+            converted_files = existing.file_names
+        cache = existing if existing is not None and model is not None and existing.model == model else None
+
+        segments = None if force_recompute else existing
+        vectorized = dict(Paper.objects.values_list('doi', 'vectorized'))
+
+        if segments is None:
+            papers = list(Paper.objects.select_related('data').all())
+            if len(papers) == 0:
+                return None, [], None
+            print(f'Computing paper matrix with {len(papers)} papers')
+
+            hashes = [self.text_hash(paper) for paper in papers]
+            embedding_keys, embeddings = self._embed_papers(papers, hashes, cache=cache)
+            paper_matrix = {key: embeddings[i] for i, key in enumerate(embedding_keys)}
+            paper_matrix['index_arr'] = [paper.doi for paper in papers]
+            paper_matrix['version'] = uuid.uuid4().hex
+            segments = dump_paper_matrix(paper_matrix, embedding_keys, path, hashes=hashes, model=model)
+            return segments, segments.file_names, None
+
+        live_dois = set(segments.dois)
+        print("Current paper matrix has size ", len(live_dois), "with", len(vectorized), "in database")
+
+        deleted_dois = [doi for doi in live_dois if doi not in vectorized]
+        new_dois = [doi for doi in vectorized if doi not in live_dois]
+        updated_dois = [doi for doi, is_vectorized in vectorized.items() if doi in live_dois and not is_vectorized]
+
+        papers = list(Paper.objects.select_related('data').filter(pk__in=new_dois + updated_dois))
+        hashes = [self.text_hash(paper) for paper in papers]
+
+        live_hashes = segments.live_hashes() if cache is not None else None
+        if live_hashes is not None:
+            # updated papers whose text did not change, e.g. only their metadata was updated, keep their rows
+            changed = [live_hashes.get(paper.doi) != text_hash for paper, text_hash in zip(papers, hashes)]
+            print(f'Text of {len(papers) - sum(changed)} papers did not change')
+            papers = [paper for paper, is_changed in zip(papers, changed) if is_changed]
+            hashes = [text_hash for text_hash, is_changed in zip(hashes, changed) if is_changed]
+
+        print(f'Deleting {len(deleted_dois)} Papers from matrix')
+        print(f'Newly added papers: {len(new_dois)}')
+        print(f'Paper that need an update: {len(updated_dois)}')
+
+        if len(deleted_dois) == 0 and len(papers) == 0:
+            return segments, converted_files, []
+
+        segment_files = converted_files
+        if len(papers) > 0:
+            _, embeddings = self._embed_papers(papers, hashes, embedding_keys=segments.embedding_keys, cache=cache)
+            segment_files.append(MatrixSegments.write_segment(directory, stem, embeddings))
+            segments.append(segment_files[-1], [paper.doi for paper in papers], deleted_dois,
+                            version=uuid.uuid4().hex, hashes=hashes if segments.has_hashes else None)
         else:
-            return old_paper_matrix
+            segments.append(None, [], deleted_dois, version=uuid.uuid4().hex)
+
+        segments.write(path)
+        return segments, segment_files, [paper.doi for paper in papers]
+
+    def _convert_legacy_paper_matrix(self, path):
+        """
+        Converts a paper matrix that was pickled as a whole into a base segment and a manifest, such that it is
+        updated incrementally instead of being recomputed. The rows and the version do not change, such that all
+        artifacts stay valid. The matrix has no text hashes, so its embeddings are not reused by hash.
+        :param path: Path of the paper matrix file.
+        :return: The segments of the converted matrix.
+        """
+        print(f'Converting {self.matrix_file_name} into a base segment')
+        paper_matrix = load_paper_matrix(path)
+        return dump_paper_matrix(paper_matrix, self.embedding_keys(paper_matrix), path)
+
+    def compact_paper_matrix(self):
+        """
+        Merges all segments of the paper matrix into a new base segment and removes the tombstones. The rows and
+        the version of the matrix do not change, such that all artifacts stay valid. The superseded segments are
+        deleted afterwards.
+        """
+        directory = settings.PAPER_MATRIX_BASE_DIR
+        path = os.path.join(directory, self.matrix_file_name)
+        segments = MatrixSegments.read(path)
+
+        if segments is None or (segments.delta_count == 0 and len(segments.deleted) == 0):
+            print(f'{self.matrix_file_name} does not need compaction')
+            return
+
+        print(f'Compacting {len(segments.segments)} segments with {len(segments.deleted)} tombstones')
+        paper_matrix = segments.load(directory)
+        hashes = segments.live_hashes()
+        compacted = dump_paper_matrix(paper_matrix, segments.embedding_keys, path,
+                                      hashes=[hashes[doi] for doi in paper_matrix['index_arr']] if hashes else None,
+                                      model=segments.model)
+
+        file_names = compacted.file_names + [self.matrix_file_name]
+        refresh_local_timestamps(directory, file_names)
+        if settings.PUSH_PAPER_MATRIX:
+            self._update_remote_paper_matrix(file_names)
+
+        self._remove_unreferenced_segments(compacted)
@@ -4,6 +4,7 @@ import os
 
 from src.analyze.similarity import CosineSimilarity
 from . import PaperVectorizer
+from .paper_vectorizer import model_files_digest
 from django.conf import settings
 from .exceptions import CouldNotLoadModel
 
@@ -30,6 +31,13 @@ class TitleSentenceVectorizer(PaperVectorizer):
     def vectorize_query(self, query: str):
         return self.model.encode([query])[0]
 
+    def model_fingerprint(self):
+        sentence_transformer_path = os.path.join(settings.MODELS_BASE_DIR, settings.SENTENCE_TRANSFORMER_MODEL_NAME)
+        return settings.SENTENCE_TRANSFORMER_MODEL_NAME + ':' + model_files_digest(sentence_transformer_path)
+
+    def paper_texts(self, paper):
+        return [paper.title]
+
     def _compute_paper_matrix_contents(self, papers):
         matrix = np.array(self.model.encode([paper.title for paper in papers], batch_size=32, show_progress_bar=True))
         return {'matrix': matrix}
@@ -1,20 +1,52 @@
 import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import torch
 from transformers import AutoTokenizer
 import numpy as np
 from src.analyze.similarity import EuclideanSimilarity
-from src.analyze.models.utils import batch_iterator
 from src.analyze.models.paper_embedding_model import PaperEmbeddingModel
+from src.analyze.models.inference_backend import get_inference_backend, EagerBackend, \
+    QuantizedTorchScriptBackend, EAGER_BACKEND, QUANTIZED_TORCHSCRIPT_BACKEND
 from . import PaperVectorizer
+from .paper_vectorizer import model_files_digest
 from django.conf import settings
 from .exceptions import CouldNotLoadModel
 from tqdm import tqdm
 from .utils.sliding_window_tokenizer import SlidingWindowTokenizer
+from .utils.query_embedding_cache import get_query_embedding_cache
+from .utils.embedding_pipeline import EmbeddingPipeline, available_cores
+
+
+def load_worker_model(model_path, model_type, backend_name):
+    """
+    Loads the embedding model in a worker process of the embedding pipeline. The graph of the quantised backend
+    has already been exported by the parent process.
+    :param model_path: The model directory.
+    :param model_type: The type of the transformer model.
+    :param backend_name: Name of the inference backend of the parent process.
+    :return: The backend.
+    """
+    if backend_name == QUANTIZED_TORCHSCRIPT_BACKEND:
+        backend = QuantizedTorchScriptBackend.load(model_path)
+        if backend is not None:
+            return backend
+    model = PaperEmbeddingModel(model_path=model_path, model_type=model_type)
+    model.eval()
+    return EagerBackend(model)
 
 
 class TransformerPaperVectorizer(PaperVectorizer):
+    # Inputs for exporting and checking the parity of the inference backend
+    EXAMPLE_TEXTS = ['sars-cov-2 transmission in households and schools',
+                     'efficacy of remdesivir for the treatment of hospitalized patients with severe covid-19',
+                     'we estimate the basic reproduction number of the outbreak in wuhan from the reported cases '
+                     'and find that the epidemic doubled every few days before travel restrictions were imposed.']
+
     def __init__(self, matrix_file_name, device='cpu', transformer_model_name='transformer_paper_oubiobert_512',
-                 transformer_model_type='bert', max_token_length=512, batch_size=8, *args, **kwargs):
+                 transformer_model_type='bert', max_token_length=512, batch_size=8, inference_backend=EAGER_BACKEND,
+                 *args, **kwargs):
         super(TransformerPaperVectorizer, self).__init__(matrix_file_name=matrix_file_name,
                                                          similarity_computer=EuclideanSimilarity(), *args, **kwargs)
 
@@ -23,9 +55,18 @@ class TransformerPaperVectorizer(PaperVectorizer):
         self._title_importance = 0.5
         self._batch_size = batch_size
         self._model = None
+        self._model_fingerprint = None
 
         self._transformer_model_name = transformer_model_name
         self._transformer_model_type = transformer_model_type
+        self._inference_backend = inference_backend
+
+    @property
+    def _model_key(self):
+        """
+        Identifies the model and the inference backend that compute the embeddings.
+        """
+        return self._transformer_model_name + ':' + self._model.name
 
     def extract_paper_matrix(self, dois=None):
         """
@@ -42,28 +83,98 @@ class TransformerPaperVectorizer(PaperVectorizer):
 
         return matrix
 
+    @property
+    def _snapshot_path(self):
+        if not settings.STARTUP_SNAPSHOT_DIR:
+            return None
+        return os.path.join(settings.STARTUP_SNAPSHOT_DIR, self._transformer_model_name + '.pt')
+
+    def _load_embedding_model(self, model_path):
+        """
+        Loads the eager model. If snapshots are enabled, the initialized model is restored from its snapshot, which
+        skips constructing and initializing the model before its weights are loaded.
+        """
+        snapshot_path = self._snapshot_path
+        weights_path = os.path.join(model_path, 'pytorch_model.bin')
+        if snapshot_path and os.path.exists(snapshot_path) and \
+                os.path.getmtime(snapshot_path) >= os.path.getmtime(weights_path):
+            try:
+                model = torch.load(snapshot_path, map_location='cpu')
+                print(f'Restored {self._transformer_model_name} from snapshot')
+                return model
+            except (RuntimeError, OSError, EOFError, AttributeError, pickle.UnpicklingError) as e:
+                print("Could not restore model snapshot:", e)
+
+        model = PaperEmbeddingModel(model_path=model_path, model_type=self._transformer_model_type)
+        if snapshot_path:
+            try:
+                os.makedirs(settings.STARTUP_SNAPSHOT_DIR, exist_ok=True)
+                torch.save(model, snapshot_path + '.tmp')
+                os.replace(snapshot_path + '.tmp', snapshot_path)
+            except OSError as e:
+                print("Could not write model snapshot:", e)
+        return model
+
     def _load_models(self):
         model_path = os.path.join(settings.MODELS_BASE_DIR, self._transformer_model_name)
         if not os.path.exists(model_path):
             raise CouldNotLoadModel("Could not load model from {}".format(model_path))
-        self._model = PaperEmbeddingModel(model_path=model_path, model_type=self._transformer_model_type)
-        self._tokenizer = AutoTokenizer.from_pretrained(model_path)
+
+        # the tokenizer is loaded and the weights are digested while the model is loaded
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            tokenizer = executor.submit(AutoTokenizer.from_pretrained, model_path, use_fast=True)
+            weights_digest = executor.submit(model_files_digest, model_path)
+            model = self._load_embedding_model(model_path)
+            self._tokenizer = tokenizer.result()
+            weights_digest = weights_digest.result()
         self._sliding_window_tokenizer = SlidingWindowTokenizer(tokenizer=self._tokenizer,
                                                                 device=self._device,
                                                                 max_length=512,
                                                                 overlap=64)
-        self._model.to(self._device)
-        self._model.eval()
+        model.to(self._device)
+        model.eval()
+
+        example_features, _ = self._sliding_window_tokenizer.tokenize(TransformerPaperVectorizer.EXAMPLE_TEXTS)
+        self._model = get_inference_backend(self._inference_backend, model, model_path, example_features,
+                                            tolerance=settings.INFERENCE_PARITY_TOLERANCE)
+        print(f'Using {self._model.name} inference backend for {self._transformer_model_name}')
+        self._model_fingerprint = self._model_key + ':' + weights_digest
 
     def _unload_models(self):
         self._model = None
         self._tokenizer = None
+        self._model_fingerprint = None
+
+    def model_fingerprint(self):
+        if self._model_fingerprint is None:
+            model_path = os.path.join(settings.MODELS_BASE_DIR, self._transformer_model_name)
+            self._model_fingerprint = self._model_key + ':' + model_files_digest(model_path)
+        return self._model_fingerprint
+
+    def paper_texts(self, paper):
+        return [paper.title.lower(), paper.data.abstract.lower()]
 
     def vectorize_query(self, query: str):
-        tokens, _ = self._sliding_window_tokenizer.tokenize([query.lower()])
-        with torch.no_grad():
-            embedding = self._model(tokens)[0].detach().cpu().numpy()
-        return embedding
+        return self.vectorize_queries([query])[0]
+
+    def vectorize_queries(self, queries):
+        # cached embeddings of other weights, e.g. from a persisted cache, are not used after a model update
+        model = self.model_fingerprint()
+        query_embedding_cache = get_query_embedding_cache()
+        embeddings = [query_embedding_cache.get(model, query) for query in queries]
+
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if len(missing) > 0:
+            # all queries are encoded in one padded forward pass, each query is represented by its first window
+            tokens, end_index_array = self._sliding_window_tokenizer.tokenize([queries[i].lower() for i in missing])
+            first_windows = [0] + end_index_array[:-1]
+            with torch.no_grad():
+                computed = self._generate_embeddings(tokens)[first_windows].detach().cpu().numpy()
+            for i, embedding in zip(missing, computed):
+                query_embedding_cache.put(model, queries[i], embedding)
+                embeddings[i] = embedding
+
+        return np.stack(embeddings)
 
     def _generate_embeddings(self, features):
         new_features = []
@@ -86,49 +197,55 @@ class TransformerPaperVectorizer(PaperVectorizer):
             i = end_index
         return torch.stack(result)
 
+    def _embedding_workers(self):
+        if self._device != 'cpu':
+            return 1
+        if settings.EMBEDDING_WORKERS > 0:
+            return settings.EMBEDDING_WORKERS
+        return max(1, available_cores() // settings.EMBEDDING_THREADS_PER_WORKER)
+
     def _compute_paper_matrix_contents(self, papers):
+        num_papers = len(papers)
+        paper_texts = [self.paper_texts(paper) for paper in papers]
+        texts = [title for title, _ in paper_texts] + [abstract for _, abstract in paper_texts]
         title_matrix = None
         abstract_matrix = None
-        for paper_batch in tqdm(batch_iterator(papers, batch_size=self._batch_size)):
-            title_tokens, title_index_array = self._sliding_window_tokenizer.tokenize(
-                [paper.title.lower() for paper in paper_batch])
-            abstract_tokens, abstracts_index_array = self._sliding_window_tokenizer.tokenize(
-                [paper.data.abstract.lower() for paper in paper_batch])
-            with torch.no_grad():
-                title_embeddings, abstract_embeddings = [
-                    self._pool_embeddings(self._generate_embeddings(features), end_index_array).detach().cpu().numpy()
-                    for features, end_index_array in
-                    [(title_tokens, title_index_array), (abstract_tokens, abstracts_index_array)]]
-
-            title_matrix = np.concatenate((title_matrix, title_embeddings),
-                                          axis=0) if title_matrix is not None else title_embeddings
-            abstract_matrix = np.concatenate((abstract_matrix, abstract_embeddings),
-                                             axis=0) if abstract_matrix is not None else abstract_embeddings
+
+        num_workers = self._embedding_workers()
+        print(f'Computing embeddings with {num_workers} worker processes')
+
+        model_path = os.path.join(settings.MODELS_BASE_DIR, self._transformer_model_name)
+        with EmbeddingPipeline(self._model, max_batch_tokens=self._batch_size * self._max_token_length,
+                               num_workers=num_workers, device=self._device,
+                               load_worker_model=partial(load_worker_model, model_path, self._transformer_model_type,
+                                                         self._model.name)) as pipeline:
+            for start in tqdm(range(0, num_papers, settings.EMBEDDING_CHUNK_SIZE)):
+                end = min(start + settings.EMBEDDING_CHUNK_SIZE, num_papers)
+                # titles and abstracts are embedded together, such that short abstracts share batches with titles
+                tokens, end_index_array = self._sliding_window_tokenizer.tokenize(
+                    texts[start:end] + texts[num_papers + start:num_papers + end])
+                embeddings = pipeline.embed(tokens)
+
+                if title_matrix is None:
+                    title_matrix = np.empty((num_papers, embeddings.shape[1]), dtype=np.float32)
+                    abstract_matrix = np.empty((num_papers, embeddings.shape[1]), dtype=np.float32)
+
+                # mean of the windows of every text
+                start_index_array = [0] + end_index_array[:-1]
+                window_counts = np.diff([0] + end_index_array)[:, np.newaxis]
+                pooled = np.add.reduceat(embeddings, start_index_array, axis=0) / window_counts
+
+                title_matrix[start:end] = pooled[:end - start]
+                abstract_matrix[start:end] = pooled[end - start:]
+
         return {
             'title': title_matrix,
             'abstract': abstract_matrix
         }
 
-    def similar_to_paper(self, doi: str):
-        matrix_index = self.paper_matrix['id_map'][doi]
-
-        title_matrix = self.paper_matrix['title']
-        abstract_matrix = self.paper_matrix['abstract']
-        title_similarity_scores = self._similarity_computer.similarities(title_matrix, abstract_matrix[matrix_index])
-        abstract_similarity_scores = self._similarity_computer.similarities(abstract_matrix, title_matrix[matrix_index])
-
-        combined_scores = 0.5 * title_similarity_scores + 0.5 * abstract_similarity_scores
-
-        scores = combined_scores.tolist()
-        del scores[matrix_index]
-        dois = self.paper_matrix['index_arr'][:matrix_index] + self.paper_matrix['index_arr'][matrix_index + 1:]
-        return dois, scores
-
-    def _compute_similarity_scores(self, embedding_vec):
-        title_matrix = self.paper_matrix['title']
-        title_similarity_scores = self._similarity_computer.similarities(title_matrix, embedding_vec)
-        abstract_matrix = self.paper_matrix['abstract']
-        abstract_similarity_scores = self._similarity_computer.similarities(abstract_matrix, embedding_vec)
-        combined_scores = self._title_importance * title_similarity_scores + (
-                1 - self._title_importance) * abstract_similarity_scores
-        return self.paper_matrix['index_arr'], combined_scores.tolist()
+    def query_similarity_terms(self):
+        return [(self._title_importance, 'title'), (1 - self._title_importance, 'abstract')]
+
+    def paper_similarity_terms(self):
+        # titles are compared to abstracts and vice versa
+        return [(0.5, 'title', 'abstract'), (0.5, 'abstract', 'title')]
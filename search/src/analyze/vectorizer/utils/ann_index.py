@@ -0,0 +1,75 @@
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+
+
+class IVFIndex:
+    """
+    Inverted file index for approximate nearest neighbour search. The paper vectors are clustered with k-means and
+    each vector is stored in the list of its closest centroid. A query only scans the lists of the n_probe closest
+    centroids instead of the complete matrix.
+    """
+
+    def __init__(self, centroids, list_offsets, list_rows, size, matrix_version=None, n_probe=32):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        self.size = size
+        self.matrix_version = matrix_version
+        self.n_probe = n_probe
+
+    @property
+    def n_lists(self):
+        return self.centroids.shape[0]
+
+    @staticmethod
+    def build(vectors, n_lists=None, matrix_version=None, random_state=0):
+        """
+        Clusters the given vectors and creates the inverted lists.
+        :param vectors: Matrix with one row per paper.
+        :param n_lists: Number of inverted lists. Defaults to 4 * sqrt(number of vectors).
+        :param matrix_version: Version of the paper matrix the vectors were taken from.
+        :param random_state: Random state of the clustering.
+        :return: The index.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        size = vectors.shape[0]
+
+        if n_lists is None:
+            n_lists = int(4 * np.sqrt(size))
+        n_lists = max(1, min(n_lists, size))
+
+        kmeans = MiniBatchKMeans(n_clusters=n_lists, batch_size=max(1024, 4 * n_lists),
+                                 random_state=random_state).fit(vectors)
+
+        assignments = kmeans.labels_
+        counts = np.bincount(assignments, minlength=n_lists)
+
+        return IVFIndex(centroids=kmeans.cluster_centers_.astype(np.float32),
+                        list_offsets=np.concatenate(([0], np.cumsum(counts))).astype(np.int64),
+                        list_rows=np.argsort(assignments, kind='stable').astype(np.int64),
+                        size=size,
+                        matrix_version=matrix_version)
+
+    def is_fresh(self, matrix_version):
+        """
+        The index is only valid for the paper matrix it was built from.
+        :param matrix_version: Version of the currently loaded paper matrix.
+        :return: True if the index can be used for the given matrix.
+        """
+        return self.matrix_version is not None and self.matrix_version == matrix_version
+
+    def candidates(self, query_vec, n_probe=None):
+        """
+        Computes the matrix rows that are stored in the lists of the closest centroids.
+        :param query_vec: The query vector.
+        :param n_probe: Number of lists to scan.
+        :return: Sorted numpy array of candidate rows.
+        """
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+
+        distances = np.sum((self.centroids - np.asarray(query_vec, dtype=np.float32)) ** 2, axis=1)
+        closest_lists = np.argpartition(distances, n_probe - 1)[:n_probe]
+
+        rows = np.concatenate([self.list_rows[self.list_offsets[i]:self.list_offsets[i + 1]] for i in closest_lists])
+        rows.sort()
+        return rows
@@ -0,0 +1,121 @@
+import multiprocessing
+import os
+
+import django
+import numpy as np
+import torch
+
+TOKEN_KEYS = ['input_ids', 'token_type_ids', 'attention_mask']
+
+# Model of a worker process, it is loaded with the first batch
+_worker_model = None
+
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _embed_batch(task):
+    global _worker_model
+    load_model, num_threads, batch = task
+    if _worker_model is None:
+        torch.set_num_threads(num_threads)
+        _worker_model = load_model()
+    with torch.no_grad():
+        features = {key: torch.from_numpy(value) for key, value in batch.items()}
+        return _worker_model(features).detach().cpu().numpy()
+
+
+class EmbeddingPipeline:
+    """
+    Computes the embeddings of sliding windows. The windows are sorted by their number of tokens and grouped into
+    batches with a fixed token budget, each batch is only padded to its longest window. The batches are distributed
+    over a pool of worker processes and the embeddings are written into a preallocated array.
+
+    The workers are spawned instead of forked, because forking a process that already ran torch inference copies
+    its thread pools in an undefined state, which can deadlock the workers. Every worker loads its own model.
+    """
+
+    def __init__(self, model, max_batch_tokens, num_workers=1, device='cpu', load_worker_model=None):
+        """
+        :param model: Callable that maps a feature dict to the embeddings of the windows.
+        :param max_batch_tokens: Maximum number of tokens (including padding) of a batch.
+        :param num_workers: Number of worker processes, the model is run in process if it is 1.
+        :param device: Device of the model when it is run in process.
+        :param load_worker_model: Picklable function that loads the model in a worker process, required if there
+        is more than one worker.
+        """
+        if num_workers > 1 and load_worker_model is None:
+            raise ValueError("Worker processes need a function that loads the model")
+
+        self._model = model
+        self._max_batch_tokens = max_batch_tokens
+        self._num_workers = num_workers
+        self._device = device
+        self._load_worker_model = load_worker_model
+        self._num_threads = max(1, available_cores() // num_workers)
+        self._pool = None
+
+    def __enter__(self):
+        if self._num_workers > 1:
+            # the Django apps are set up before the first batch, whose function imports the vectorizer modules
+            self._pool = multiprocessing.get_context('spawn').Pool(self._num_workers, initializer=django.setup)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def batches(self, lengths):
+        """
+        Groups the windows into batches of similar length.
+        :param lengths: Number of tokens of every window.
+        :return: List of index arrays, one per batch.
+        """
+        order = np.argsort(lengths, kind='stable')
+        batches = []
+        start = 0
+        while start < len(order):
+            end = start + 1
+            # the lengths are ascending, so the last window of a batch determines its padded length
+            while end < len(order) and (end - start + 1) * lengths[order[end]] <= self._max_batch_tokens:
+                end += 1
+            batches.append(order[start:end])
+            start = end
+        return batches
+
+    def _embed_in_process(self, batch):
+        with torch.no_grad():
+            features = {key: torch.from_numpy(value).to(self._device) for key, value in batch.items()}
+            return self._model(features).detach().cpu().numpy()
+
+    def embed(self, features):
+        """
+        Computes the embedding of every window.
+        :param features: Dict of token tensors of shape (number of windows, max length).
+        :return: Float32 array of shape (number of windows, dimension).
+        """
+        arrays = {key: features[key].cpu().numpy() for key in TOKEN_KEYS}
+        lengths = arrays['attention_mask'].sum(axis=1)
+
+        batch_indices = self.batches(lengths)
+        batches = [{key: arrays[key][indices, :lengths[indices[-1]]] for key in TOKEN_KEYS}
+                   for indices in batch_indices]
+
+        if self._pool is not None:
+            results = self._pool.imap(_embed_batch, [(self._load_worker_model, self._num_threads, batch)
+                                                     for batch in batches])
+        else:
+            results = map(self._embed_in_process, batches)
+
+        embeddings = None
+        for indices, result in zip(batch_indices, results):
+            if embeddings is None:
+                embeddings = np.empty((len(lengths), result.shape[1]), dtype=np.float32)
+            embeddings[indices] = result
+        return embeddings
@@ -0,0 +1,96 @@
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer
+
+
+class LexicalIndex:
+    """
+    Sparse BM25 matrix over the titles (and optionally the abstracts) of the papers, aligned row for row with the
+    paper matrix. It is used to boost semantic search results that contain the words of the query.
+    """
+
+    def __init__(self, analyzer_vectorizer, weights, titles, matrix_version=None):
+        self._analyzer_vectorizer = analyzer_vectorizer
+        self.weights = weights
+        self.titles = titles
+        self.matrix_version = matrix_version
+
+    @property
+    def size(self):
+        return self.weights.shape[0]
+
+    @staticmethod
+    def normalize(text):
+        return ' '.join(text.lower().split())
+
+    @staticmethod
+    def build(titles, abstracts=None, abstract_weight=0.3, matrix_version=None, k1=1.2, b=0.75):
+        """
+        Computes the BM25 weight of every term in every paper.
+        :param titles: The titles in the order of the paper matrix rows.
+        :param abstracts: Optional. The abstracts in the same order, their terms count abstract_weight times.
+        :param abstract_weight: Weight of a term occurrence in the abstract compared to the title.
+        :param matrix_version: Version of the paper matrix the rows are aligned with.
+        :param k1: BM25 term frequency saturation.
+        :param b: BM25 length normalization.
+        :return: The index.
+        """
+        analyzer_vectorizer = CountVectorizer(lowercase=True, stop_words='english', dtype=np.float32)
+        if abstracts is not None:
+            analyzer_vectorizer.fit(list(titles) + list(abstracts))
+            counts = analyzer_vectorizer.transform(titles) + abstract_weight * analyzer_vectorizer.transform(abstracts)
+        else:
+            counts = analyzer_vectorizer.fit_transform(titles)
+        counts = sp.csr_matrix(counts, dtype=np.float32)
+
+        size = counts.shape[0]
+        document_frequency = np.bincount(counts.indices, minlength=counts.shape[1])
+        idf = np.log(1 + (size - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+
+        lengths = np.asarray(counts.sum(axis=1)).ravel()
+        length_norm = k1 * (1 - b + b * lengths / max(lengths.mean(), 1e-9))
+
+        # BM25 weight of every non zero entry, the rows of the csr matrix are expanded to match its data array
+        weights = counts.copy()
+        row_norm = np.repeat(length_norm, np.diff(counts.indptr))
+        weights.data = idf[counts.indices] * counts.data * (k1 + 1) / (counts.data + row_norm)
+
+        return LexicalIndex(analyzer_vectorizer, weights.astype(np.float32),
+                            [LexicalIndex.normalize(title) for title in titles], matrix_version=matrix_version)
+
+    def query_vector(self, query):
+        """
+        :param query: The query.
+        :return: Dense vector with a one for every known term of the query.
+        """
+        vector = np.zeros(self.weights.shape[1], dtype=np.float32)
+        vocabulary = self._analyzer_vectorizer.vocabulary_
+        for term in self._analyzer_vectorizer.build_analyzer()(query):
+            if term in vocabulary:
+                vector[vocabulary[term]] = 1.0
+        return vector
+
+    def scores(self, query, rows):
+        """
+        Computes the lexical score of the query for the given rows. Titles that contain the query as a phrase get
+        an additional bonus.
+        :param query: The query.
+        :param rows: Numpy array of paper matrix rows.
+        :return: Numpy array with the score of every row.
+        """
+        scores = self.weights[rows] @ self.query_vector(query)
+
+        phrase = LexicalIndex.normalize(query)
+        if phrase:
+            phrase_bonus = scores.max() if scores.max() > 0 else 1.0
+            scores = scores + phrase_bonus * np.array([phrase in self.titles[row] for row in rows.tolist()],
+                                                      dtype=np.float32)
+        return scores
+
+    def is_fresh(self, matrix_version):
+        """
+        The index is only valid for the paper matrix it was built from.
+        :param matrix_version: Version of the currently loaded paper matrix.
+        :return: True if the index can be used for the given matrix.
+        """
+        return self.matrix_version is not None and self.matrix_version == matrix_version
@@ -0,0 +1,296 @@
+import os
+import re
+import uuid
+from collections import defaultdict
+
+import joblib
+import numpy as np
+
+
+class SegmentedEmbeddings:
+    """
+    Embeddings of one key that are spread over several row blocks. The base segment stays memory mapped, such that
+    all processes share one copy through the page cache, only its live rows are used. The rows of the delta
+    segments are held in memory. Indexing rows returns a numpy array, numpy functions and operators convert the
+    embeddings to one matrix. Scans over all rows should use map_rows, which does not copy the base segment.
+    """
+
+    def __init__(self, blocks):
+        """
+        :param blocks: List of (array, live rows) tuples, the live rows are None if all rows of the array are live.
+        """
+        self._blocks = blocks
+        self._offsets = np.cumsum([0] + [len(array) if live is None else len(live) for array, live in blocks])
+        self.shape = (int(self._offsets[-1]), blocks[0][0].shape[1])
+        self.dtype = blocks[0][0].dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _rows(self, rows):
+        if isinstance(rows, slice):
+            return np.arange(len(self))[rows]
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            return np.flatnonzero(rows)
+        return np.where(rows < 0, rows + len(self), rows).astype(np.int64, copy=False)
+
+    def __getitem__(self, item):
+        columns = None
+        if isinstance(item, tuple):
+            item, columns = item[0], item[1:]
+
+        rows = self._rows(item)
+        flat_rows = np.atleast_1d(rows)
+        result = np.empty((len(flat_rows), self.shape[1]), dtype=self.dtype)
+        block_ids = np.searchsorted(self._offsets, flat_rows, side='right') - 1
+        for block_id in np.unique(block_ids):
+            array, live = self._blocks[block_id]
+            selected = block_ids == block_id
+            local_rows = flat_rows[selected] - self._offsets[block_id]
+            result[selected] = array[local_rows if live is None else live[local_rows]]
+
+        if rows.ndim == 0:
+            result = result[0]
+        if columns:
+            result = result[(slice(None),) * (rows.ndim > 0) + columns]
+        return result
+
+    def map_rows(self, function):
+        """
+        Applies a row-wise function to the embeddings without copying the memory mapped base segment.
+        :param function: Function that maps a matrix to an array with one entry (or row) per matrix row.
+        :return: The concatenated results of the live rows.
+        """
+        results = []
+        for array, live in self._blocks:
+            result = np.asarray(function(array))
+            results.append(result if live is None else result[live])
+        return np.concatenate(results)
+
+    def __array__(self, dtype=None, copy=None):
+        matrix = self[:]
+        return matrix if dtype is None else matrix.astype(dtype, copy=False)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = tuple(np.asarray(x) if isinstance(x, SegmentedEmbeddings) else x for x in inputs)
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+
+def map_rows(matrix, function):
+    """
+    Applies a row-wise function to a matrix of the paper matrix dict, see SegmentedEmbeddings.map_rows.
+    """
+    if isinstance(matrix, SegmentedEmbeddings):
+        return matrix.map_rows(function)
+    return function(matrix)
+
+
+class MatrixSegments:
+    """
+    Append-only layout of a paper matrix. The embeddings are stored in segments, each a float32 .npy block of shape
+    (number of embedding keys, number of papers, dimension) with the dois of its rows. The first segment is the
+    base segment, every update appends a small delta segment. A paper is represented by the newest segment that
+    contains it, unless it was deleted afterwards (tombstone). Compaction merges all segments into a new base.
+
+    Segments may store the hash of the text every row was computed from. Together with the fingerprint of the model,
+    the segments then serve as embedding cache, such that texts that did not change are not embedded again.
+
+    The manifest is stored in the paper matrix file itself:
+    {'version', 'embedding_keys', 'model', 'segments': [{'file', 'dois', 'hashes'}], 'deleted': [dois]}
+    """
+
+    def __init__(self, version, embedding_keys, segments, deleted, model=None):
+        self.version = version
+        self.embedding_keys = embedding_keys
+        self.segments = segments
+        self.deleted = set(deleted)
+        self.model = model
+
+    @staticmethod
+    def read(path):
+        """
+        Reads the manifest of a paper matrix file.
+        :param path: Path of the paper matrix file.
+        :return: The segments or None if the file does not exist or has no segments.
+        """
+        if not os.path.exists(path):
+            return None
+        manifest = joblib.load(path)
+
+        if 'segments' in manifest:
+            return MatrixSegments(version=manifest['version'], embedding_keys=manifest['embedding_keys'],
+                                  segments=manifest['segments'], deleted=manifest['deleted'],
+                                  model=manifest.get('model'))
+        if 'embeddings_file' in manifest:
+            # single embeddings file, written before segments were introduced
+            return MatrixSegments(version=manifest['version'], embedding_keys=manifest['embedding_keys'],
+                                  segments=[{'file': manifest['embeddings_file'], 'dois': manifest['index_arr']}],
+                                  deleted=[])
+        return None
+
+    def write(self, path):
+        joblib.dump({
+            'version': self.version,
+            'embedding_keys': self.embedding_keys,
+            'model': self.model,
+            'segments': self.segments,
+            'deleted': sorted(self.deleted)
+        }, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    @property
+    def file_names(self):
+        return [segment['file'] for segment in self.segments]
+
+    @property
+    def delta_count(self):
+        return len(self.segments) - 1
+
+    def _live_rows(self):
+        """
+        Computes for every segment the rows that represent a paper.
+        :return: List with a boolean mask per segment.
+        """
+        newest_segment = dict()
+        for i, segment in enumerate(self.segments):
+            for doi in segment['dois']:
+                newest_segment[doi] = i
+
+        return [np.array([newest_segment[doi] == i and doi not in self.deleted for doi in segment['dois']],
+                         dtype=bool) for i, segment in enumerate(self.segments)]
+
+    def _live_values(self, live_rows, field):
+        values = []
+        for segment, live in zip(self.segments, live_rows):
+            values.extend(value for value, is_live in zip(segment[field], live) if is_live)
+        return values
+
+    @property
+    def dois(self):
+        return self._live_values(self._live_rows(), 'dois')
+
+    @property
+    def has_hashes(self):
+        return all(segment.get('hashes') is not None for segment in self.segments)
+
+    def live_hashes(self):
+        """
+        :return: Dict that maps the doi of every paper to the text hash of its row, None if a segment has no hashes.
+        """
+        if not self.has_hashes:
+            return None
+        live_rows = self._live_rows()
+        return dict(zip(self._live_values(live_rows, 'dois'), self._live_values(live_rows, 'hashes')))
+
+    def lookup(self, directory, hashes):
+        """
+        Looks up embeddings by the hash of their text. All rows are considered, including rows of papers that were
+        updated or deleted afterwards.
+        :param directory: The directory of the segment files.
+        :param hashes: The text hashes.
+        :return: Tuple of a boolean array that marks the hashes that were found and their embeddings of shape
+        (number of embedding keys, number of found hashes, dimension), None if no hash was found.
+        """
+        locations = dict()
+        for i, segment in enumerate(self.segments):
+            for row, text_hash in enumerate(segment.get('hashes') or []):
+                locations[text_hash] = (i, row)
+
+        found = np.array([text_hash in locations for text_hash in hashes], dtype=bool)
+        rows_by_segment = defaultdict(lambda: ([], []))
+        for position, text_hash in enumerate(text_hash for text_hash in hashes if text_hash in locations):
+            i, row = locations[text_hash]
+            rows_by_segment[i][0].append(position)
+            rows_by_segment[i][1].append(row)
+
+        embeddings = None
+        for i, (positions, rows) in rows_by_segment.items():
+            block = np.load(os.path.join(directory, self.segments[i]['file']), mmap_mode='r')
+            if embeddings is None:
+                embeddings = np.empty((block.shape[0], found.sum(), block.shape[2]), dtype=np.float32)
+            embeddings[:, positions] = block[:, rows]
+        return found, embeddings
+
+    def unreferenced_files(self, file_names, stem):
+        """
+        Selects the segment files of the paper matrix that the manifest does not reference anymore, i.e. segments
+        that were superseded by a compaction or a rebuild.
+        :param file_names: The file names to select from.
+        :param stem: Name of the paper matrix file without extension.
+        :return: List of file names.
+        """
+        pattern = re.compile(r'^' + re.escape(stem) + r'_[0-9a-f]{12}\.npy$')
+        referenced = set(self.file_names)
+        return [file_name for file_name in file_names if pattern.match(file_name) and file_name not in referenced]
+
+    def load(self, directory):
+        """
+        Assembles the paper matrix dict from the segments. The embeddings of the base segment stay memory mapped,
+        such that all processes share one copy through the page cache. If there are delta segments or tombstones,
+        only the live rows of the delta segments are copied into memory and the embeddings of every key are
+        SegmentedEmbeddings.
+        :param directory: The directory of the segment files.
+        :return: The paper matrix dict.
+        """
+        blocks = []
+        for segment in self.segments:
+            embeddings = np.load(os.path.join(directory, segment['file']), mmap_mode='r')
+            if embeddings.shape[1] != len(segment['dois']):
+                raise ValueError("Segment {} does not match its dois".format(segment['file']))
+            blocks.append(embeddings)
+
+        live_rows = self._live_rows()
+        index_arr = self._live_values(live_rows, 'dois')
+
+        paper_matrix = {
+            'version': self.version,
+            'index_arr': index_arr,
+            'id_map': {doi: idx for idx, doi in enumerate(index_arr)}
+        }
+
+        base_live = None if live_rows[0].all() else np.flatnonzero(live_rows[0])
+        for i, key in enumerate(self.embedding_keys):
+            if len(blocks) == 1 and base_live is None:
+                paper_matrix[key] = blocks[0][i]
+                continue
+
+            key_blocks = [(blocks[0][i], base_live)]
+            if len(blocks) > 1:
+                deltas = np.concatenate([block[i][live] for block, live in zip(blocks[1:], live_rows[1:])])
+                key_blocks.append((deltas, None))
+            paper_matrix[key] = SegmentedEmbeddings(key_blocks)
+
+        return paper_matrix
+
+    @staticmethod
+    def write_segment(directory, stem, embeddings):
+        """
+        Writes a new segment file.
+        :param directory: The directory.
+        :param stem: Name of the paper matrix file without extension.
+        :param embeddings: Float32 array of shape (number of embedding keys, number of papers, dimension).
+        :return: The file name of the segment.
+        """
+        file_name = f'{stem}_{uuid.uuid4().hex[:12]}.npy'
+        path = os.path.join(directory, file_name)
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, np.asarray(embeddings, dtype=np.float32))
+        os.replace(path + '.tmp', path)
+        return file_name
+
+    def append(self, segment_file, dois, deleted_dois, version, hashes=None):
+        """
+        Appends a delta segment and marks the given papers as deleted.
+        :param segment_file: File name of the segment, None if only papers were deleted.
+        :param dois: The dois of the segment rows.
+        :param deleted_dois: Dois of deleted papers.
+        :param version: The new version of the paper matrix.
+        :param hashes: The text hashes of the segment rows.
+        """
+        if segment_file is not None:
+            self.segments.append({'file': segment_file, 'dois': list(dois),
+                                  'hashes': list(hashes) if hashes is not None else None})
+        self.deleted.update(deleted_dois)
+        self.deleted.difference_update(dois)
+        self.version = version
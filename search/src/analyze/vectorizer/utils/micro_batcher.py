@@ -0,0 +1,85 @@
+import threading
+import time
+from queue import Queue, Empty
+
+
+class _Request:
+    def __init__(self, item):
+        self.item = item
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """
+    Coalesces items that are submitted concurrently into batches. The first item of a batch waits at most
+    max_wait seconds for further items, then the batch function is called once for all of them. Each caller
+    receives the result for its item.
+    """
+
+    def __init__(self, batch_function, max_batch_size=32, max_wait=0.005):
+        """
+        :param batch_function: Function that receives a list of items and returns a list of results in the same
+        order.
+        :param max_batch_size: Maximum number of items per batch.
+        :param max_wait: Maximum time in seconds that is waited for further items.
+        """
+        self._batch_function = batch_function
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait
+        self._queue = Queue()
+
+        self.batches = 0
+        self.items = 0
+
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, item):
+        """
+        Adds the item to the next batch and waits for its result.
+        :param item: The item.
+        :return: The result of the batch function for the item.
+        """
+        request = _Request(item)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _collect(self):
+        requests = [self._queue.get()]
+        deadline = time.monotonic() + self._max_wait
+        while len(requests) < self._max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                requests.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+        return requests
+
+    def _run(self):
+        while True:
+            requests = self._collect()
+            try:
+                results = self._batch_function([request.item for request in requests])
+                for request, result in zip(requests, results):
+                    request.result = result
+            except Exception as e:
+                for request in requests:
+                    request.error = e
+            finally:
+                self.batches += 1
+                self.items += len(requests)
+                for request in requests:
+                    request.done.set()
+
+    def statistics(self):
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'average_batch_size': self.items / self.batches if self.batches > 0 else 0.0
+        }
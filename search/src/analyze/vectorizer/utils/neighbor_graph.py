@@ -0,0 +1,141 @@
+import numpy as np
+
+
+class NeighborGraph:
+    """
+    Stores the k most similar papers of every paper of a paper matrix. The neighbor rows refer to the index array
+    of the graph, i.e. to the rows of the paper matrix the graph was built from.
+    """
+
+    def __init__(self, index_arr, neighbors, scores, matrix_version, changed_dois=None):
+        self.index_arr = index_arr
+        self.neighbors = neighbors
+        self.scores = scores
+        self.matrix_version = matrix_version
+        self.changed_dois = changed_dois if changed_dois is not None else list(index_arr)
+        self._id_map = None
+
+    @property
+    def k(self):
+        return self.neighbors.shape[1]
+
+    @property
+    def id_map(self):
+        if self._id_map is None:
+            self._id_map = {doi: idx for idx, doi in enumerate(self.index_arr)}
+        return self._id_map
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_id_map'] = None
+        return state
+
+    def is_fresh(self, matrix_version):
+        return self.matrix_version is not None and self.matrix_version == matrix_version
+
+    def similar(self, doi: str, top: int = None):
+        """
+        Returns the precomputed neighbors of a paper.
+        :param doi: The doi of the paper.
+        :param top: Optional. Number of neighbors, at most k.
+        :return: List of (doi, score) tuples, sorted by descending score.
+        """
+        row = self.id_map[doi]
+        top = self.k if top is None else min(top, self.k)
+        return [(self.index_arr[neighbor], score) for neighbor, score in
+                zip(self.neighbors[row, :top].tolist(), self.scores[row, :top].tolist()) if neighbor >= 0]
+
+    @staticmethod
+    def _top_k(candidate_rows, candidate_scores, k):
+        """
+        Selects the k best candidates of every row, sorted by descending score.
+        """
+        if candidate_scores.shape[1] > k:
+            best = np.argpartition(-candidate_scores, k - 1, axis=1)[:, :k]
+            candidate_rows = np.take_along_axis(candidate_rows, best, axis=1)
+            candidate_scores = np.take_along_axis(candidate_scores, best, axis=1)
+        order = np.argsort(-candidate_scores, axis=1)
+        return np.take_along_axis(candidate_rows, order, axis=1), np.take_along_axis(candidate_scores, order, axis=1)
+
+    @staticmethod
+    def build(paper_similarities, index_arr, k, matrix_version, previous=None, dirty_dois=(), block_size=256):
+        """
+        Computes the neighbor graph. If a previous graph is given, only papers that are new, were updated or lost
+        one of their neighbors are recomputed. All other papers keep their neighbors, which are merged with the
+        new and updated papers.
+        :param paper_similarities: Function that receives matrix rows and returns the similarity of all papers to
+        these rows as a (number of papers, number of rows) array. The similarity needs to be symmetric.
+        :param index_arr: The dois of the matrix rows.
+        :param k: Number of neighbors per paper.
+        :param matrix_version: The version of the paper matrix.
+        :param previous: Optional. The graph that was built for the previous version of the paper matrix.
+        :param dirty_dois: Dois of papers whose embeddings were recomputed.
+        :param block_size: Number of papers that are compared to all papers at once.
+        :return: The graph.
+        """
+        size = len(index_arr)
+        k = max(0, min(k, size - 1))
+        neighbors = np.full((size, k), -1, dtype=np.int32)
+        scores = np.full((size, k), -np.inf, dtype=np.float32)
+
+        if k == 0:
+            return NeighborGraph(index_arr=list(index_arr), neighbors=neighbors, scores=scores,
+                                 matrix_version=matrix_version)
+
+        id_map = {doi: idx for idx, doi in enumerate(index_arr)}
+        dirty = np.zeros(size, dtype=bool)
+        dirty[[id_map[doi] for doi in dirty_dois if doi in id_map]] = True
+
+        if previous is None or previous.k < k:
+            fresh = np.ones(size, dtype=bool)
+            recompute = fresh
+        else:
+            previous_rows = np.array([id_map.get(doi, -1) for doi in previous.index_arr], dtype=np.int64)
+            carried = previous_rows >= 0
+            current_rows = previous_rows[carried]
+
+            # papers that are new or were updated have new embeddings
+            fresh = np.ones(size, dtype=bool)
+            fresh[current_rows] = False
+            fresh |= dirty
+
+            # neighbors of the previous graph in terms of the current rows, -1 if the neighbor was deleted
+            previous_neighbors = previous.neighbors[carried, :k]
+            mapped_neighbors = np.where(previous_neighbors >= 0, previous_rows[previous_neighbors], -1)
+
+            # papers that lost a neighbor or whose neighbor changed cannot be merged incrementally
+            invalid = (mapped_neighbors < 0) | dirty[np.maximum(mapped_neighbors, 0)]
+            recompute = fresh.copy()
+            recompute[current_rows[invalid.any(axis=1)]] = True
+
+            neighbors[current_rows] = mapped_neighbors
+            scores[current_rows] = previous.scores[carried, :k]
+
+        recompute_rows = np.flatnonzero(recompute)
+        merge_rows = np.flatnonzero(~recompute)
+
+        for start in range(0, len(recompute_rows), block_size):
+            block = recompute_rows[start:start + block_size]
+            block_scores = paper_similarities(block).T.astype(np.float32)
+            block_scores[np.arange(len(block)), block] = -np.inf
+            candidates = np.broadcast_to(np.arange(size, dtype=np.int32), block_scores.shape)
+            neighbors[block], scores[block] = NeighborGraph._top_k(candidates, block_scores, k)
+
+        changed = recompute.copy()
+
+        if len(merge_rows) > 0:
+            # the similarity is symmetric, so the scores of the new papers are reused for all other papers
+            previous_merge_neighbors = neighbors[merge_rows].copy()
+            fresh_rows = np.flatnonzero(fresh)
+            for start in range(0, len(fresh_rows), block_size):
+                block = fresh_rows[start:start + block_size]
+                block_scores = paper_similarities(block)[merge_rows].astype(np.float32)
+                candidates = np.concatenate(
+                    (neighbors[merge_rows], np.broadcast_to(block.astype(np.int32), block_scores.shape)), axis=1)
+                candidate_scores = np.concatenate((scores[merge_rows], block_scores), axis=1)
+                neighbors[merge_rows], scores[merge_rows] = NeighborGraph._top_k(candidates, candidate_scores, k)
+            changed[merge_rows] = (neighbors[merge_rows] != previous_merge_neighbors).any(axis=1)
+
+        return NeighborGraph(index_arr=list(index_arr), neighbors=neighbors, scores=scores,
+                             matrix_version=matrix_version,
+                             changed_dois=[index_arr[row] for row in np.flatnonzero(changed).tolist()])
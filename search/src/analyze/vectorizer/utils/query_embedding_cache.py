@@ -0,0 +1,137 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import joblib
+import numpy as np
+from django.conf import settings
+
+
+class QueryEmbeddingCache:
+    """
+    Bounded LRU cache for query embeddings, keyed by the fingerprint of the model and the normalized query. Entries
+    expire after a given time to live. If a file path is given, the cache is restored from and periodically written
+    to disk, such that a restarted service starts with the embeddings of popular queries.
+    """
+
+    def __init__(self, max_size=10000, ttl=None, file_path=None, persist_interval=300):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._file_path = file_path
+        self._persist_interval = persist_interval
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._modified = False
+
+        self.hits = 0
+        self.misses = 0
+
+        if self._file_path:
+            self.load()
+            threading.Thread(target=self._persist_loop, daemon=True).start()
+
+    @staticmethod
+    def normalize(query: str):
+        return ' '.join(query.lower().split())
+
+    def _is_expired(self, created_at):
+        return self._ttl is not None and time.time() - created_at > self._ttl
+
+    def get(self, model: str, query: str):
+        """
+        Returns the cached embedding or None.
+        :param model: Fingerprint of the model that computed the embedding, including a digest of its weights.
+        :param query: The query.
+        :return: The embedding or None if it is not cached.
+        """
+        key = (model, QueryEmbeddingCache.normalize(query))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_expired(entry[0]):
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, model: str, query: str, embedding):
+        embedding = np.array(embedding, dtype=np.float32)
+        embedding.setflags(write=False)
+
+        key = (model, QueryEmbeddingCache.normalize(query))
+        with self._lock:
+            self._entries[key] = (time.time(), embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+            self._modified = True
+
+    def statistics(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self._max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests > 0 else 0.0
+            }
+
+    def load(self):
+        if not os.path.exists(self._file_path):
+            return
+        try:
+            entries = joblib.load(self._file_path)
+        except Exception as e:
+            print("Could not load query embedding cache:", e)
+            return
+
+        with self._lock:
+            for key, (created_at, embedding) in entries:
+                if not self._is_expired(created_at):
+                    self._entries[key] = (created_at, embedding)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+        print(f'Loaded {len(self._entries)} query embeddings from {self._file_path}')
+
+    def save(self):
+        with self._lock:
+            entries = list(self._entries.items())
+            self._modified = False
+
+        os.makedirs(os.path.dirname(self._file_path), exist_ok=True)
+        joblib.dump(entries, self._file_path + '.tmp')
+        os.replace(self._file_path + '.tmp', self._file_path)
+
+    def _persist_loop(self):
+        while True:
+            time.sleep(self._persist_interval)
+            if self._modified:
+                try:
+                    self.save()
+                except OSError as e:
+                    print("Could not persist query embedding cache:", e)
+
+
+query_embedding_cache = None
+query_embedding_cache_lock = threading.Lock()
+
+
+def get_query_embedding_cache():
+    global query_embedding_cache
+    with query_embedding_cache_lock:
+        if query_embedding_cache is None:
+            file_path = None
+            if settings.QUERY_EMBEDDING_CACHE_DIR:
+                file_path = os.path.join(settings.QUERY_EMBEDDING_CACHE_DIR, 'query_embeddings.pkl')
+            query_embedding_cache = QueryEmbeddingCache(max_size=settings.QUERY_EMBEDDING_CACHE_SIZE,
+                                                        ttl=settings.QUERY_EMBEDDING_CACHE_TTL,
+                                                        file_path=file_path)
+    return query_embedding_cache
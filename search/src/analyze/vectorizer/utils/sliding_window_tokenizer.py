@@ -1,3 +1,4 @@
+import numpy as np
 import torch
 
 
@@ -11,7 +12,38 @@ class SlidingWindowTokenizer():
         self._max_windows = max_windows
 
     def tokenize(self, texts):
-        tokenizer_args = dict(pad_to_max_length=True, truncation=True, add_special_tokens=True,
+        """
+        Splits the texts into overlapping windows of at most max_length tokens, at most max_windows per text.
+        :param texts: List of strings.
+        :return: Tuple of the features of all windows and the index array, i.e. the end index of the windows of
+        each text.
+        """
+        if getattr(self._tokenizer, 'is_fast', False):
+            return self._tokenize_batch(texts)
+        return self._tokenize_sequential(texts)
+
+    def _tokenize_batch(self, texts):
+        """
+        Tokenizes all texts at once using the native overflow support of fast tokenizers.
+        """
+        tokens = self._tokenizer(list(texts), padding='max_length', truncation=True, add_special_tokens=True,
+                                 max_length=self._max_length, return_overflowing_tokens=True,
+                                 return_tensors='pt', stride=self._overlap)
+
+        # some versions of the tokenizers return the mapping with a batch dimension
+        sample_mapping = tokens['overflow_to_sample_mapping'].numpy().reshape(-1)
+
+        # the windows of a text are consecutive, only the first max_windows windows of each text are used
+        first_windows = np.searchsorted(sample_mapping, sample_mapping)
+        keep = torch.from_numpy(np.arange(len(sample_mapping)) - first_windows < self._max_windows)
+
+        result = {key: tokens[key][keep].to(self._device)
+                  for key in ['input_ids', 'token_type_ids', 'attention_mask']}
+        index_array = np.cumsum(np.bincount(sample_mapping[keep.numpy()], minlength=len(texts))).tolist()
+        return result, index_array
+
+    def _tokenize_sequential(self, texts):
+        tokenizer_args = dict(pad_to_max_length=True, truncation='only_first', add_special_tokens=True,
                               max_length=self._max_length, return_overflowing_tokens=True,
                               return_tensors='pt',
                               stride=self._overlap)
@@ -0,0 +1,151 @@
+import hashlib
+import os
+import uuid
+from datetime import date, timedelta
+
+import numpy as np
+from django.db import transaction
+
+from collabovid_store.stores import refresh_local_timestamps
+from data.models import Paper, PaperData, PaperHost, Category, CategoryMembership, Journal, Author, \
+    AuthorPaperMembership, AltmetricData, DataSource
+from src.analyze.similarity import EuclideanSimilarity
+from src.analyze.vectorizer import PaperVectorizer
+from src.analyze.vectorizer.paper_vectorizer import dump_paper_matrix
+
+BENCHMARK_DOI_PREFIX = '10.0000/benchmark.'
+BENCHMARK_NAME_PREFIX = 'Benchmark'
+
+WORDS = ['coronavirus', 'transmission', 'vaccine', 'antibody', 'mortality', 'lockdown', 'mask', 'children',
+         'hospital', 'ventilation', 'remdesivir', 'hydroxychloroquine', 'cytokine', 'spike', 'protein', 'receptor',
+         'ace2', 'serology', 'testing', 'contact', 'tracing', 'incubation', 'period', 'reproduction', 'number',
+         'household', 'school', 'elderly', 'diabetes', 'obesity', 'smoking', 'symptoms', 'anosmia', 'fever',
+         'pneumonia', 'thrombosis', 'kidney', 'cardiac', 'mental', 'health', 'unemployment', 'mobility', 'genome',
+         'mutation', 'phylogenetic', 'model', 'forecast', 'intensive', 'care', 'outcome', 'cohort', 'trial']
+
+
+class SyntheticVectorizer(PaperVectorizer):
+    """
+    Vectorizer without a model. Queries are mapped to pseudo random unit vectors that depend on the query only, such
+    that the search runs on the synthetic paper matrix without loading a transformer.
+    """
+
+    def __init__(self, matrix_file_name, dimension):
+        super(SyntheticVectorizer, self).__init__(matrix_file_name=matrix_file_name,
+                                                  similarity_computer=EuclideanSimilarity())
+        self._dimension = dimension
+        self._is_initialized = True
+
+    def vectorize_query(self, query: str):
+        seed = int(hashlib.md5(query.lower().encode('utf-8')).hexdigest()[:8], 16)
+        vector = np.random.RandomState(seed).normal(size=self._dimension).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+
+class SyntheticCorpus:
+    """
+    Generates papers with authors, categories, journals and altmetric scores in the database and a matching paper
+    matrix of clustered random embeddings. All generated objects are marked by a prefix, such that they can be
+    removed afterwards.
+    """
+
+    def __init__(self, size, dimension=768, n_clusters=64, seed=0):
+        self.size = size
+        self.dimension = dimension
+        self.n_clusters = n_clusters
+        self._random = np.random.RandomState(seed)
+
+        self.n_authors = max(10, size // 2)
+        self.n_categories = 12
+        self.n_journals = max(5, size // 1000)
+        self.n_hosts = 4
+
+    @property
+    def dois(self):
+        return [f'{BENCHMARK_DOI_PREFIX}{i}' for i in range(self.size)]
+
+    def title(self):
+        return ' '.join(self._random.choice(WORDS, size=self._random.randint(5, 14))).capitalize()
+
+    def generate(self, batch_size=5000):
+        """
+        Writes the corpus to the database.
+        """
+        with transaction.atomic():
+            PaperHost.objects.bulk_create([PaperHost(name=f'{BENCHMARK_NAME_PREFIX} Host {i}')
+                                           for i in range(self.n_hosts)])
+            Category.objects.bulk_create([Category(name=f'{BENCHMARK_NAME_PREFIX} Category {i}', description='',
+                                                   model_identifier=f'benchmark-{i}')
+                                          for i in range(self.n_categories)])
+            Journal.objects.bulk_create([Journal(name=f'{BENCHMARK_NAME_PREFIX} Journal {i}')
+                                         for i in range(self.n_journals)])
+        hosts, categories, journals = [list(model.objects.filter(name__startswith=BENCHMARK_NAME_PREFIX))
+                                       for model in [PaperHost, Category, Journal]]
+
+        for start in range(0, self.n_authors, batch_size):
+            Author.objects.bulk_create([Author(first_name=f'{BENCHMARK_NAME_PREFIX}', last_name=f'Author {i}')
+                                        for i in range(start, min(start + batch_size, self.n_authors))])
+        author_ids = list(Author.objects.filter(first_name=BENCHMARK_NAME_PREFIX).values_list('pk', flat=True))
+
+        first_day = date(2020, 1, 1)
+        dois = self.dois
+        for start in range(0, self.size, batch_size):
+            batch = dois[start:start + batch_size]
+            with transaction.atomic():
+                data = PaperData.objects.bulk_create([PaperData(abstract=' '.join([self.title()] * 8))
+                                                      for _ in batch])
+                altmetric = AltmetricData.objects.bulk_create([
+                    AltmetricData(**{key: float(value) for key, value in
+                                     zip(['score', 'score_d', 'score_w', 'score_1m', 'score_3m', 'score_6m', 'score_y'],
+                                         self._random.exponential(20, size=7))})
+                    for _ in batch])
+                papers = Paper.objects.bulk_create([
+                    Paper(doi=doi, title=self.title(), data=paper_data, altmetric_data=altmetric_data,
+                          host=hosts[self._random.randint(len(hosts))], data_source_value=DataSource.MEDBIORXIV,
+                          is_preprint=self._random.rand() < 0.6, vectorized=True,
+                          journal=journals[self._random.randint(len(journals))] if self._random.rand() < 0.5 else None,
+                          published_at=first_day + timedelta(days=int(self._random.randint(400))))
+                    for doi, paper_data, altmetric_data in zip(batch, data, altmetric)])
+                CategoryMembership.objects.bulk_create([
+                    CategoryMembership(paper=paper, category=categories[category], score=float(self._random.rand()))
+                    for paper in papers
+                    for category in self._random.choice(len(categories), size=2, replace=False)])
+                AuthorPaperMembership.objects.bulk_create([
+                    AuthorPaperMembership(paper=paper, author_id=author_ids[author], rank=rank)
+                    for paper in papers
+                    for rank, author in enumerate(self._random.randint(len(author_ids), size=3))])
+            print(f'Generated {min(start + batch_size, self.size)} of {self.size} papers')
+
+    def write_paper_matrix(self, directory, matrix_file_name, chunk_size=50000):
+        """
+        Writes clustered random unit vectors as paper matrix.
+        :return: The paper matrix dict.
+        """
+        os.makedirs(directory, exist_ok=True)
+        centers = self._random.normal(size=(self.n_clusters, self.dimension)).astype(np.float32)
+        matrix = np.empty((self.size, self.dimension), dtype=np.float32)
+        for start in range(0, self.size, chunk_size):
+            end = min(start + chunk_size, self.size)
+            vectors = centers[self._random.randint(self.n_clusters, size=end - start)] + \
+                0.5 * self._random.normal(size=(end - start, self.dimension)).astype(np.float32)
+            matrix[start:end] = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+        paper_matrix = {'matrix': matrix, 'index_arr': self.dois, 'version': uuid.uuid4().hex}
+        segments = dump_paper_matrix(paper_matrix, ['matrix'], os.path.join(directory, matrix_file_name))
+        refresh_local_timestamps(directory, segments.file_names + [matrix_file_name])
+        return paper_matrix
+
+    @staticmethod
+    def delete():
+        """
+        Removes all generated objects from the database.
+        """
+        papers = Paper.objects.filter(doi__startswith=BENCHMARK_DOI_PREFIX)
+        data_ids = list(papers.values_list('data_id', flat=True))
+        altmetric_ids = list(papers.values_list('altmetric_data_id', flat=True))
+        papers.delete()
+        PaperData.objects.filter(pk__in=data_ids).delete()
+        AltmetricData.objects.filter(pk__in=altmetric_ids).delete()
+        Author.objects.filter(first_name=BENCHMARK_NAME_PREFIX).delete()
+        for model in [PaperHost, Category, Journal]:
+            model.objects.filter(name__startswith=BENCHMARK_NAME_PREFIX).delete()
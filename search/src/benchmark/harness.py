@@ -0,0 +1,176 @@
+import itertools
+import platform
+import resource
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.test import RequestFactory
+
+from data.models import PaperHost, Category, Author
+from src.search.search_engine import SearchEngine
+from src.search.virtual_paginator import VirtualPaginator
+from .corpus import WORDS, BENCHMARK_NAME_PREFIX
+
+TABS = ['combined', 'keyword']
+SORTS = ['top', 'newest', 'popularity', 'trending_w']
+PAGES = [1, 5]
+
+
+def percentile(latencies, q):
+    return float(np.percentile(latencies, q)) if len(latencies) > 0 else None
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if platform.system() == 'Darwin' else peak / 1024
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+
+    def measure(self, function, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        except Exception as e:
+            self.errors += 1
+            print("Benchmark request failed:", e)
+            return None
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+    def summary(self, wall_time):
+        latencies = np.array(self.latencies) * 1000
+        return {
+            'count': len(self.latencies),
+            'errors': self.errors,
+            'mean_ms': float(latencies.mean()) if len(latencies) > 0 else None,
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'throughput': len(self.latencies) / wall_time if wall_time > 0 else None
+        }
+
+
+class SearchBenchmark:
+    """
+    Drives the search engine, the paginator and the similar api over a matrix of form variants and reports the
+    latency percentiles, throughput and peak memory of every scenario.
+    """
+
+    def __init__(self, dois, iterations=5, concurrency=1, seed=0):
+        self._dois = dois
+        self._iterations = iterations
+        self._concurrency = concurrency
+        self._random = np.random.RandomState(seed)
+
+        self._host_ids = list(PaperHost.objects.filter(name__startswith=BENCHMARK_NAME_PREFIX)
+                              .values_list('pk', flat=True))
+        self._category_ids = list(Category.objects.filter(name__startswith=BENCHMARK_NAME_PREFIX)
+                                  .values_list('pk', flat=True))
+        self._author_ids = list(Author.objects.filter(first_name=BENCHMARK_NAME_PREFIX)
+                                .values_list('pk', flat=True)[:1000])
+
+    def query(self):
+        return ' '.join(self._random.choice(WORDS, size=self._random.randint(1, 5)))
+
+    def filters(self):
+        """
+        :return: Dict of filter variants, each a dict of form fields.
+        """
+        return {
+            'none': {},
+            'category': {'categories': [int(self._random.choice(self._category_ids))]},
+            'date_range': {'published_at_start': '2020-03-01', 'published_at_end': '2020-06-30'},
+            'host_preprints': {'paper_hosts': [int(self._random.choice(self._host_ids))],
+                               'article_type': 'preprints'},
+            'author': {'authors': [int(self._random.choice(self._author_ids))], 'authors_connection': 'one'}
+        }
+
+    @staticmethod
+    def form(query, tab, sorted_by, page, filters):
+        form = {
+            'query': query, 'tab': tab, 'sorted_by': sorted_by, 'page': page, 'result_type': 'papers',
+            'categories': [], 'published_at_start': None, 'published_at_end': None, 'authors': [],
+            'authors_connection': 'one', 'journals': [], 'locations': [], 'topics': [], 'paper_hosts': [],
+            'article_type': 'all'
+        }
+        form.update(filters)
+        return form
+
+    def _run(self, recorder, function, arguments):
+        start = time.perf_counter()
+        if self._concurrency > 1:
+            with ThreadPoolExecutor(max_workers=self._concurrency) as executor:
+                list(executor.map(lambda args: recorder.measure(function, *args), arguments))
+        else:
+            for args in arguments:
+                recorder.measure(function, *args)
+        return time.perf_counter() - start
+
+    @staticmethod
+    def _search(form):
+        return VirtualPaginator.sort_results(SearchEngine(form).search(), form)
+
+    @staticmethod
+    def _page(form):
+        return VirtualPaginator(SearchBenchmark._search(form), form).get_page()
+
+    @staticmethod
+    def _similar(request):
+        from api.views import similar
+        response = similar(request)
+        if response.status_code != 200:
+            raise RuntimeError(f'Similar api returned {response.status_code}')
+        return response
+
+    def run(self):
+        """
+        Runs all scenarios.
+        :return: List of result dicts, one per scenario and stage.
+        """
+        results = []
+        filters = self.filters()
+        for tab, (filter_name, filter_fields), sorted_by, page in itertools.product(TABS, filters.items(), SORTS,
+                                                                                    PAGES):
+            forms = [SearchBenchmark.form(self.query(), tab, sorted_by, page, filter_fields)
+                     for _ in range(self._iterations)]
+            scenario = {'tab': tab, 'filter': filter_name, 'sorted_by': sorted_by, 'page': page}
+
+            # the first page of a search includes the search itself, the other pages only the pagination
+            stages = [('search', SearchBenchmark._search), ('page', SearchBenchmark._page)] if page == 1 else \
+                [('page', SearchBenchmark._page)]
+            for stage, function in stages:
+                recorder = LatencyRecorder()
+                wall_time = self._run(recorder, function, [(form,) for form in forms])
+                results.append({'scenario': scenario, 'stage': stage, **recorder.summary(wall_time)})
+                p50 = results[-1]['p50_ms']
+                print(f'{stage} {scenario}: p50 {p50:.1f}ms' if p50 is not None else f'{stage} {scenario}: no requests')
+
+        factory = RequestFactory()
+        for limit in [10, 50]:
+            for n_dois in [1, 5]:
+                requests = [(factory.get('/similar', {'dois': list(self._random.choice(self._dois, size=n_dois)),
+                                                      'limit': limit}),)
+                            for _ in range(self._iterations)]
+                recorder = LatencyRecorder()
+                wall_time = self._run(recorder, SearchBenchmark._similar, requests)
+                results.append({'scenario': {'dois': n_dois, 'limit': limit}, 'stage': 'similar',
+                                **recorder.summary(wall_time)})
+        return results
+
+    def report(self, corpus, results):
+        return {
+            'corpus': {'size': corpus.size, 'dimension': corpus.dimension, 'authors': corpus.n_authors},
+            'settings': {'iterations': self._iterations, 'concurrency': self._concurrency,
+                         'elasticsearch': settings.USING_ELASTICSEARCH, 'filter_index': settings.USE_FILTER_INDEX,
+                         'ann_index': settings.USE_ANN_INDEX,
+                         'quantized_embeddings': settings.USE_QUANTIZED_EMBEDDINGS},
+            'peak_rss_mb': peak_rss_mb(),
+            'results': results
+        }
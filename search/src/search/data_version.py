@@ -0,0 +1,50 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Count, Max
+
+from data.models import Paper
+
+
+class DataVersion:
+    """
+    Counter that is increased whenever the papers in the database changed, i.e. papers were added or deleted, or
+    the latest update or altmetric timestamp changed. The database is checked at most every interval seconds.
+    """
+
+    def __init__(self, interval=30):
+        self._interval = interval
+        self._version = 0
+        self._fingerprint = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is None or now - self._checked_at >= self._interval:
+                fingerprint = Paper.objects.aggregate(count=Count('doi'), updated_at=Max('updated_at'),
+                                                      last_altmetric_update=Max('last_altmetric_update'))
+                if fingerprint != self._fingerprint:
+                    self._fingerprint = fingerprint
+                    self._version += 1
+                self._checked_at = now
+            return self._version
+
+    def increase(self):
+        with self._lock:
+            self._version += 1
+
+
+data_version = None
+data_version_lock = threading.Lock()
+
+
+def get_data_version():
+    global data_version
+    with data_version_lock:
+        if data_version is None:
+            data_version = DataVersion(interval=settings.DATA_VERSION_INTERVAL)
+    return data_version
@@ -1,6 +1,8 @@
 from data.documents import PaperDocument, AuthorDocument
 
-from elasticsearch_dsl import Q as QEs
+from django.conf import settings
+from collabovid_metrics import stage_timer
+from elasticsearch_dsl import Q as QEs, MultiSearch
 
 from typing import List
 import re
@@ -92,32 +94,52 @@ class ElasticsearchRequestHelper:
 
         return search.source(excludes=['*'])
 
+    @staticmethod
+    def _execute_all(searches):
+        """
+        Executes the given searches in a single _msearch request.
+        :param searches: List of searches.
+        :return: List of responses in the same order.
+        """
+        multi_search = MultiSearch()
+        for search in searches:
+            multi_search = multi_search.add(search)
+        with stage_timer('elasticsearch'):
+            return multi_search.execute()
+
     @staticmethod
     def enhance_results(score_table: dict, query: str):
         """
         Used for enhancing existing search results, i.e. potentially reordering them.
         We want to use reordering when we show semantic search results, because papers with
-        exact matchings in the keywords are most likely more similar to the query.
+        exact matchings in the keywords are most likely more similar to the query. Only the best
+        ELASTICSEARCH_RESCORE_WINDOW results are reordered.
         :param score_table: The doi scores.
         :param query: The query
         :return:
         """
+        if len(score_table) == 0:
+            return
+
+        window = sorted(score_table.keys(), key=lambda doi: score_table[doi],
+                        reverse=True)[:settings.ELASTICSEARCH_RESCORE_WINDOW]
 
         should_match = []
         must_match = []
 
-        must_match.append(ElasticsearchRequestHelper._get_ids_match(list(score_table.keys())))
+        must_match.append(ElasticsearchRequestHelper._get_ids_match(window))
         should_match.append(ElasticsearchRequestHelper._get_title_exact_match(query) |
                             ElasticsearchRequestHelper._get_title_match(
                                 query=ElasticsearchQueryHelper.remove_common_words(query)))
 
         search = ElasticsearchRequestHelper._build_search_request(must_match, should_match)
-
-        total = search.count()
-        search = search[0:total]
-        results = search.execute()
+        search = search[0:len(window)]
+        with stage_timer('elasticsearch'):
+            results = search.execute()
 
         max_score = results.hits.max_score
+        if not max_score:
+            return
 
         for i, paper in enumerate(results):
             score = round(paper.meta.score / max_score, 2)
@@ -146,23 +168,15 @@ class ElasticsearchRequestHelper:
                             | ElasticsearchRequestHelper._get_doi_match(query))
 
         search = ElasticsearchRequestHelper._build_search_request(must_match, should_match)
-        total = search.count()
-        search = search[0:total]
-        results = search.execute()
+        search = search[0:settings.ELASTICSEARCH_MAX_HITS]
+        with stage_timer('elasticsearch'):
+            results = search.execute()
 
         for i, paper in enumerate(results):
             score_table[paper.meta.id] = paper.meta.score
 
     @staticmethod
-    def find_authors(authors: List, query: str, excluded_author_ids: List, max_author_count: int = 8):
-        """
-        Finds author names in a given query and adds them (highlighted) to the given list.
-        :param authors: The author list, where authors should be appended.
-        :param query: The query.
-        :param excluded_author_ids: Author ids that should be excluded, e.g. authors that were already filtered
-        :param max_author_count: Maximum amount of authors to add.
-        :return:
-        """
+    def _build_authors_request(query: str, excluded_author_ids: List, max_author_count: int):
         search = AuthorDocument.search()
         search = search.query(QEs('bool',
                                   should=[QEs('match', full_name={
@@ -170,24 +184,32 @@ class ElasticsearchRequestHelper:
                                   must_not=[QEs('ids', values=excluded_author_ids)])) \
             .highlight('full_name', number_of_fragments=0, fragment_size=0)
 
-        search = search[0:max_author_count]
-        results = search.execute()
+        return search[0:max_author_count]
 
+    @staticmethod
+    def _add_authors(authors: List, results):
         for result in results:
             if hasattr(result.meta, 'highlight'):
                 if hasattr(result.meta.highlight, 'full_name'):
                     authors.append({'pk': result.meta.id, 'full_name': result.meta.highlight.full_name[0]})
 
     @staticmethod
-    def highlights(page: dict, query: str, ids: List[str]):
+    def find_authors(authors: List, query: str, excluded_author_ids: List, max_author_count: int = 8):
         """
-        Highlights matching keywords in a given set of dois. If necessary, the highlights
-        are added to the given page dict.
-        :param page: The page dict which stores all additional highlighting information for each doi.
+        Finds author names in a given query and adds them (highlighted) to the given list.
+        :param authors: The author list, where authors should be appended.
         :param query: The query.
-        :param ids: The set of ids that are visible on the given page.
+        :param excluded_author_ids: Author ids that should be excluded, e.g. authors that were already filtered
+        :param max_author_count: Maximum amount of authors to add.
         :return:
         """
+        search = ElasticsearchRequestHelper._build_authors_request(query, excluded_author_ids, max_author_count)
+        with stage_timer('elasticsearch'):
+            results = search.execute()
+        ElasticsearchRequestHelper._add_authors(authors, results)
+
+    @staticmethod
+    def _build_highlights_request(query: str, ids: List[str]):
         should_match = []
         must_match = []
 
@@ -204,11 +226,10 @@ class ElasticsearchRequestHelper:
         search = ElasticsearchRequestHelper._build_search_request(must_match, should_match).highlight(
             'title', 'abstract', 'authors.full_name', number_of_fragments=0, fragment_size=0)
 
-        total = search.count()
-        search = search[0:total]
-
-        results = search.execute()
+        return search[0:len(ids) if ids else settings.ELASTICSEARCH_MAX_HITS]
 
+    @staticmethod
+    def _add_highlights(page: dict, results):
         for result in results:
             if hasattr(result.meta, 'highlight'):
                 if hasattr(result.meta.highlight, 'title'):
@@ -218,3 +239,38 @@ class ElasticsearchRequestHelper:
                 if hasattr(result.meta.highlight, 'authors.full_name'):
                     page[result.meta.id]['authors.full_name'] = [str(name) for name in
                                                                  result.meta.highlight['authors.full_name']]
+
+    @staticmethod
+    def highlights(page: dict, query: str, ids: List[str]):
+        """
+        Highlights matching keywords in a given set of dois. If necessary, the highlights
+        are added to the given page dict.
+        :param page: The page dict which stores all additional highlighting information for each doi.
+        :param query: The query.
+        :param ids: The set of ids that are visible on the given page.
+        :return:
+        """
+        search = ElasticsearchRequestHelper._build_highlights_request(query, ids)
+        with stage_timer('elasticsearch'):
+            results = search.execute()
+        ElasticsearchRequestHelper._add_highlights(page, results)
+
+    @staticmethod
+    def highlights_and_authors(page: dict, authors: List, query: str, ids: List[str], excluded_author_ids: List,
+                               max_author_count: int = 8):
+        """
+        Combines highlights and find_authors in a single request.
+        :param page: The page dict which stores all additional highlighting information for each doi.
+        :param authors: The author list, where authors should be appended.
+        :param query: The query.
+        :param ids: The set of ids that are visible on the given page.
+        :param excluded_author_ids: Author ids that should be excluded, e.g. authors that were already filtered
+        :param max_author_count: Maximum amount of authors to add.
+        :return:
+        """
+        highlights_results, authors_results = ElasticsearchRequestHelper._execute_all([
+            ElasticsearchRequestHelper._build_highlights_request(query, ids),
+            ElasticsearchRequestHelper._build_authors_request(query, excluded_author_ids, max_author_count)
+        ])
+        ElasticsearchRequestHelper._add_highlights(page, highlights_results)
+        ElasticsearchRequestHelper._add_authors(authors, authors_results)
@@ -0,0 +1,411 @@
+import threading
+from datetime import date
+
+import numpy as np
+from django.conf import settings
+
+from data.models import Paper, PaperHost, Category, Topic, AuthorPaperMembership, CategoryMembership, \
+    GeoLocationMembership, GeoCity
+from src.search.data_version import get_data_version
+
+# Papers published before are not part of the publication histogram of the statistics
+STATISTICS_START_DATE = np.datetime64('2020-01-01', 'D')
+
+# Sorts that are precomputed as rank arrays and the altmetric score they order by
+SCORE_SORTS = {
+    'popularity': 'altmetric_data__score',
+    'trending_d': 'altmetric_data__score_d',
+    'trending_w': 'altmetric_data__score_w',
+    'trending_1m': 'altmetric_data__score_1m',
+    'trending_3m': 'altmetric_data__score_3m',
+    'trending_6m': 'altmetric_data__score_6m',
+    'trending_y': 'altmetric_data__score_y',
+}
+
+
+class FilterIndex:
+    """
+    Columnar in-memory index of the filterable paper attributes. The first rows are aligned with the rows of the
+    paper matrix, papers that are not part of the matrix yet are appended. Filters are evaluated to boolean masks
+    over these rows.
+    """
+
+    def __init__(self, dois, matrix_size, matrix_version, data_version, exists, host, is_preprint, published_at,
+                 journal, topic, category_masks, location_postings, country_cities, author_postings, host_names,
+                 categories, topic_names, sort_ranks):
+        self.dois = dois
+        self.rows = {doi: row for row, doi in enumerate(dois)}
+        self.matrix_size = matrix_size
+        self.matrix_version = matrix_version
+        self.data_version = data_version
+        self.exists = exists
+        self.host = host
+        self.is_preprint = is_preprint
+        self.published_at = published_at
+        self.journal = journal
+        self.topic = topic
+        self.category_masks = category_masks
+        self.location_postings = location_postings
+        self.country_cities = country_cities
+        self.author_postings = author_postings
+        self.host_names = host_names
+        self.categories = categories
+        self.topic_names = topic_names
+        self.sort_ranks = sort_ranks
+
+        # the author memberships as columns, used to count the distinct authors of a set of rows
+        if len(author_postings) > 0:
+            self.author_rows = np.concatenate(list(author_postings.values()))
+            self.author_ids = np.repeat(np.array(list(author_postings.keys()), dtype=np.int64),
+                                        [len(rows) for rows in author_postings.values()])
+        else:
+            self.author_rows = np.zeros(0, dtype=np.int32)
+            self.author_ids = np.zeros(0, dtype=np.int64)
+
+    @property
+    def size(self):
+        return len(self.dois)
+
+    @staticmethod
+    def _postings(pairs, id_map):
+        """
+        Groups (key, doi) pairs into sorted arrays of rows per key.
+        """
+        pairs = [(key, id_map[doi]) for key, doi in pairs if doi in id_map]
+        if len(pairs) == 0:
+            return dict()
+
+        keys, rows = (np.array(column, dtype=np.int64) for column in zip(*pairs))
+        order = np.lexsort((rows, keys))
+        keys, rows = keys[order], rows[order]
+        unique_keys, starts = np.unique(keys, return_index=True)
+        return {key: np.unique(key_rows).astype(np.int32)
+                for key, key_rows in zip(unique_keys.tolist(), np.split(rows, starts[1:]))}
+
+    @staticmethod
+    def _ranks(*keys):
+        """
+        Computes the position of every row in the ascending order of the given keys, the last key is the primary one.
+        """
+        ranks = np.empty(len(keys[0]), dtype=np.int32)
+        ranks[np.lexsort(keys)] = np.arange(len(keys[0]), dtype=np.int32)
+        return ranks
+
+    @staticmethod
+    def _sort_ranks(id_map, size, published_at):
+        """
+        Loads the sort keys of all papers and computes a rank array per sort, mirroring the ordering of the
+        database in VirtualPaginator.sort_results.
+        """
+        created_at = np.full(size, np.nan)
+        scores = {sort: np.full(size, np.nan) for sort in SCORE_SORTS.keys()}
+
+        papers = list(Paper.objects.values_list('doi', 'created_at', *SCORE_SORTS.values()))
+        if len(papers) > 0:
+            doi_column, created_column, *score_columns = zip(*papers)
+            rows = np.array([id_map[doi] for doi in doi_column], dtype=np.int64)
+            created_at[rows] = [np.nan if value is None else value.timestamp() for value in created_column]
+            for sort, score_column in zip(SCORE_SORTS.keys(), score_columns):
+                scores[sort][rows] = [np.nan if value is None else value for value in score_column]
+
+        # descending orders are ascending orders of the negated keys, missing values are sorted like in
+        # postgres: first for the published date, last for the explicit nulls_last of the scores
+        published_days = published_at.astype(np.float64)
+        published_days[np.isnat(published_at)] = np.inf
+        created_at[np.isnan(created_at)] = np.inf
+
+        sort_ranks = {'newest': FilterIndex._ranks(-created_at, -published_days)}
+        for sort, score in scores.items():
+            score[np.isnan(score)] = -np.inf
+            sort_ranks[sort] = FilterIndex._ranks(-score)
+        return sort_ranks
+
+    @staticmethod
+    def build(matrix_index_arr, matrix_version, data_version):
+        """
+        Loads the filterable attributes of all papers from the database.
+        :param matrix_index_arr: The dois of the paper matrix rows.
+        :param matrix_version: The version of the paper matrix.
+        :param data_version: The data version at the time the index is built.
+        :return: The index.
+        """
+        dois = list(matrix_index_arr)
+        id_map = {doi: idx for idx, doi in enumerate(dois)}
+        matrix_size = len(dois)
+
+        papers = list(Paper.objects.values_list('doi', 'host_id', 'is_preprint', 'published_at', 'journal_id',
+                                                'topic_id'))
+        for paper in papers:
+            if paper[0] not in id_map:
+                id_map[paper[0]] = len(dois)
+                dois.append(paper[0])
+
+        size = len(dois)
+        exists = np.zeros(size, dtype=bool)
+        host = np.full(size, -1, dtype=np.int32)
+        is_preprint = np.zeros(size, dtype=bool)
+        published_at = np.full(size, np.datetime64('NaT'), dtype='datetime64[D]')
+        journal = np.full(size, -1, dtype=np.int32)
+        topic = np.full(size, -1, dtype=np.int32)
+
+        if len(papers) > 0:
+            doi_column, host_column, preprint_column, published_column, journal_column, topic_column = zip(*papers)
+            rows = np.array([id_map[doi] for doi in doi_column], dtype=np.int64)
+            exists[rows] = True
+            host[rows] = host_column
+            is_preprint[rows] = preprint_column
+            published_at[rows] = [np.datetime64(value) if value else np.datetime64('NaT') for value in
+                                  published_column]
+            journal[rows] = [-1 if value is None else value for value in journal_column]
+            topic[rows] = [-1 if value is None else value for value in topic_column]
+
+        category_masks = dict()
+        for category, category_rows in FilterIndex._postings(
+                CategoryMembership.objects.values_list('category_id', 'paper_id'), id_map).items():
+            category_masks[category] = np.zeros(size, dtype=bool)
+            category_masks[category][category_rows] = True
+
+        country_cities = dict()
+        for city, country in GeoCity.objects.values_list('pk', 'country_id'):
+            country_cities.setdefault(country, []).append(city)
+
+        return FilterIndex(dois=dois, matrix_size=matrix_size, matrix_version=matrix_version,
+                           data_version=data_version, exists=exists, host=host, is_preprint=is_preprint,
+                           published_at=published_at, journal=journal, topic=topic, category_masks=category_masks,
+                           location_postings=FilterIndex._postings(
+                               GeoLocationMembership.objects.values_list('location_id', 'paper_id'), id_map),
+                           country_cities=country_cities,
+                           author_postings=FilterIndex._postings(
+                               AuthorPaperMembership.objects.values_list('author_id', 'paper_id'), id_map),
+                           host_names=dict(PaperHost.objects.values_list('pk', 'name')),
+                           categories={pk: (name, color) for pk, name, color in
+                                       Category.objects.values_list('pk', 'name', 'color')},
+                           topic_names=dict(Topic.objects.values_list('pk', 'name')),
+                           sort_ranks=FilterIndex._sort_ranks(id_map, size, published_at))
+
+    def _postings_mask(self, postings, ids):
+        mask = np.zeros(self.size, dtype=bool)
+        for key in ids:
+            if key in postings:
+                mask[postings[key]] = True
+        return mask
+
+    @staticmethod
+    def _date(value):
+        if isinstance(value, date):
+            return np.datetime64(value, 'D')
+        return np.datetime64(str(value)[:10], 'D')
+
+    def filter(self, form):
+        """
+        Evaluates the filters of the search form, see SearchEngine.filter_papers.
+        :param form: The search form.
+        :return: Tuple of a flag that indicates whether any filter was applied and the boolean mask of the matching
+        rows.
+        """
+        mask = self.exists.copy()
+        filtered = False
+
+        if form['paper_hosts']:
+            mask &= np.isin(self.host, form['paper_hosts'])
+            filtered = True
+
+        if form['article_type'] == 'reviewed':
+            mask &= ~self.is_preprint
+            filtered = True
+        elif form['article_type'] == 'preprints':
+            mask &= self.is_preprint
+            filtered = True
+
+        if form['categories']:
+            category_mask = np.zeros(self.size, dtype=bool)
+            for category in form['categories']:
+                if category in self.category_masks:
+                    category_mask |= self.category_masks[category]
+            mask &= category_mask
+            filtered = True
+
+        if form['locations']:
+            # countries include all of their cities
+            location_ids = set(form['locations'])
+            for location in form['locations']:
+                location_ids.update(self.country_cities.get(location, []))
+            mask &= self._postings_mask(self.location_postings, location_ids)
+            filtered = True
+
+        if form['journals']:
+            mask &= np.isin(self.journal, form['journals'])
+            filtered = True
+
+        if form['topics']:
+            mask &= np.isin(self.topic, form['topics'])
+            filtered = True
+
+        if form['authors']:
+            if form['authors_connection'] == 'all':
+                for author in form['authors']:
+                    if author in self.author_postings:
+                        author_mask = np.zeros(self.size, dtype=bool)
+                        author_mask[self.author_postings[author]] = True
+                        mask &= author_mask
+            else:
+                mask &= self._postings_mask(self.author_postings, form['authors'])
+            filtered = True
+
+        if form['published_at_start']:
+            mask &= self.published_at >= FilterIndex._date(form['published_at_start'])
+            filtered = True
+
+        if form['published_at_end']:
+            mask &= self.published_at <= FilterIndex._date(form['published_at_end'])
+            filtered = True
+
+        return filtered, mask
+
+    def matrix_mask(self, mask):
+        """
+        Restricts a mask to the rows of the paper matrix.
+        """
+        return mask[:self.matrix_size]
+
+    def dois_of(self, mask):
+        return [self.dois[row] for row in np.flatnonzero(mask).tolist()]
+
+    def mask_of(self, dois):
+        """
+        Computes the mask of the rows of the given dois, unknown dois are ignored.
+        """
+        mask = np.zeros(self.size, dtype=bool)
+        mask[[self.rows[doi] for doi in dois if doi in self.rows]] = True
+        return mask
+
+    def sort(self, dois, sorted_by):
+        """
+        Orders the given dois by one of the precomputed sorts. Like the database ordering, dois of papers that do not
+        exist are dropped.
+        :param dois: The dois.
+        :param sorted_by: The sort, 'newest' or one of SCORE_SORTS.
+        :return: List of the sorted dois or None if a doi is unknown to the index, e.g. a paper that was added after
+        the index was built.
+        """
+        rows = [self.rows.get(doi) for doi in dois]
+        if None in rows:
+            return None
+
+        rows = np.array(rows, dtype=np.int64)
+        rows = rows[self.exists[rows]]
+        rows = rows[np.argsort(self.sort_ranks[sorted_by][rows], kind='stable')]
+        return [self.dois[row] for row in rows.tolist()]
+
+    @staticmethod
+    def _value_counts(values):
+        values, counts = np.unique(values[values >= 0], return_counts=True)
+        return zip(values.tolist(), counts.tolist())
+
+    def statistics(self, mask):
+        """
+        Aggregates the statistics of the given rows, the same numbers collabovid_statistics.PaperStatistics computes
+        from the database.
+        :param mask: The boolean mask of the rows.
+        :return: Dict with the paper, author and host counts and the data of the publication histogram, the host,
+        category and topic distributions.
+        """
+        mask = mask & self.exists
+        rows = np.flatnonzero(mask)
+
+        published_at = self.published_at[rows]
+        # comparisons with NaT are always false, papers without a date are dropped here
+        days = published_at[published_at > STATISTICS_START_DATE].astype(np.int64)
+        # monday of the iso week, the epoch was a thursday
+        weeks, added = np.unique(days - (days + 3) % 7, return_counts=True)
+
+        paper_hosts = {self.host_names.get(host, str(host)): count
+                       for host, count in FilterIndex._value_counts(self.host[rows])}
+
+        categories = dict()
+        for category, category_mask in self.category_masks.items():
+            count = int(np.count_nonzero(category_mask & mask))
+            if count > 0 and category in self.categories:
+                name, color = self.categories[category]
+                categories[name] = {'count': count, 'color': color}
+
+        topics = {self.topic_names.get(topic, str(topic)): count
+                  for topic, count in FilterIndex._value_counts(self.topic[rows])}
+
+        return {
+            'paper_count': len(rows),
+            'author_count': len(np.unique(self.author_ids[mask[self.author_rows]])),
+            'paper_host_count': len(paper_hosts),
+            'published_at': {
+                'x': [str(np.datetime64(week, 'D')) for week in weeks.tolist()],
+                'added': added.tolist(),
+                'total': np.cumsum(added).tolist()
+            },
+            'paper_hosts': paper_hosts,
+            'categories': categories,
+            'topics': topics
+        }
+
+
+class FilterIndexProvider:
+    """
+    Holds the filter index of the current paper matrix. The index is rebuilt in the background when the paper
+    matrix or the data version changes. An index of an older data version is used until the rebuild finished, an
+    index of another paper matrix is not used at all.
+    """
+
+    def __init__(self):
+        self._index = None
+        self._building = False
+        self._lock = threading.Lock()
+
+    def _build(self, matrix_index_arr, matrix_version, data_version):
+        try:
+            index = FilterIndex.build(matrix_index_arr, matrix_version, data_version)
+            with self._lock:
+                self._index = index
+            print(f'Built filter index with {index.size} papers')
+        except Exception as e:
+            print("Could not build filter index:", e)
+        finally:
+            with self._lock:
+                self._building = False
+
+    def index(self, paper_matrix, wait=False):
+        """
+        Returns the filter index of the given paper matrix.
+        :param paper_matrix: The paper matrix dict.
+        :param wait: If True, the index is built synchronously if it does not exist.
+        :return: The index or None if no index for the paper matrix is available.
+        """
+        matrix_version = paper_matrix.get('version')
+        data_version = get_data_version().version
+
+        with self._lock:
+            index = self._index
+            stale = index is None or index.matrix_version != matrix_version or index.data_version != data_version
+            start_build = stale and not self._building
+            if start_build:
+                self._building = True
+
+        if start_build:
+            arguments = (paper_matrix['index_arr'], matrix_version, data_version)
+            if wait:
+                self._build(*arguments)
+                with self._lock:
+                    index = self._index
+            else:
+                threading.Thread(target=self._build, args=arguments, daemon=True).start()
+
+        if index is None or index.matrix_version != matrix_version:
+            return None
+        return index
+
+
+filter_index_provider = FilterIndexProvider()
+
+
+def get_filter_index(paper_matrix):
+    if not settings.USE_FILTER_INDEX:
+        return None
+    return filter_index_provider.index(paper_matrix)
@@ -0,0 +1,124 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from src.search.data_version import get_data_version
+
+
+class SearchResultCache:
+    """
+    Bounded LRU cache for the sorted result dois of a search. The key is the canonical form without the page and the
+    result type, such that paging through the results and computing their statistics reuse one search. Entries are
+    only valid for the paper matrix and the data version they were computed with. Concurrent identical searches
+    compute the result only once.
+    """
+    IGNORED_FORM_KEYS = ('page', 'result_type')
+
+    def __init__(self, max_size=128, ttl=None):
+        self._max_size = max_size
+        self._ttl = ttl
+
+        self._entries = OrderedDict()
+        self._in_flight = dict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(form: dict):
+        canonical_form = {key: value for key, value in form.items() if key not in SearchResultCache.IGNORED_FORM_KEYS}
+        if isinstance(canonical_form.get('query'), str):
+            canonical_form['query'] = ' '.join(canonical_form['query'].split())
+        return json.dumps(canonical_form, sort_keys=True, default=str)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _lookup(self, key, version):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        created_at, entry_version, sorted_dois = entry
+        if entry_version != version or (self._ttl is not None and time.time() - created_at > self._ttl):
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return sorted_dois
+
+    def get_or_compute(self, form: dict, matrix_version, compute):
+        """
+        Returns the cached result of the form or computes it.
+        :param form: The search form.
+        :param matrix_version: Version of the currently loaded paper matrix.
+        :param compute: Function without arguments that returns the sorted result dois and the data version of the
+        data they were computed from.
+        :return: Tuple of sorted result dois.
+        """
+        key = SearchResultCache.key(form)
+        version = (matrix_version, get_data_version().version)
+
+        while True:
+            with self._lock:
+                sorted_dois = self._lookup(key, version)
+                if sorted_dois is not None:
+                    self.hits += 1
+                    return sorted_dois
+
+                event = self._in_flight.get(key)
+                if event is None:
+                    event = threading.Event()
+                    self._in_flight[key] = event
+                    self.misses += 1
+                    break
+
+            # another thread computes the same search, the result is taken from the cache afterwards
+            event.wait()
+
+        try:
+            sorted_dois, data_version = compute()
+            sorted_dois = tuple(sorted_dois)
+            if data_version != version[1]:
+                # computed from stale data, e.g. a filter index that is still rebuilt, it must not outlive it
+                return sorted_dois
+
+            with self._lock:
+                self._entries[key] = (time.time(), version, sorted_dois)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self._max_size:
+                    self._entries.popitem(last=False)
+            return sorted_dois
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            event.set()
+
+    def statistics(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self._max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests > 0 else 0.0
+            }
+
+
+search_result_cache = None
+search_result_cache_lock = threading.Lock()
+
+
+def get_search_result_cache():
+    global search_result_cache
+    with search_result_cache_lock:
+        if search_result_cache is None:
+            search_result_cache = SearchResultCache(max_size=settings.SEARCH_RESULT_CACHE_SIZE,
+                                                    ttl=settings.SEARCH_RESULT_CACHE_TTL)
+    return search_result_cache
@@ -6,6 +6,9 @@ from data.models import Paper, Author, Journal, Category, CategoryMembership, Ge
 
 from src.search.elasticsearch import ElasticsearchRequestHelper
 from src.search.utils import TimerUtilities
+from src.search.filter_index import get_filter_index
+from src.search.data_version import get_data_version
+from src.analyze import get_semantic_paper_search
 from .semantic_search import SemanticSearch
 from .development.title_search import TitleSearch
 
@@ -30,6 +33,8 @@ class SearchEngine:
             raise ValueError("No valid tab provided")
 
         self.form = form
+        # version of the data the result is computed from, set by search
+        self.data_version = None
 
     def filter_papers(self):
         """
@@ -152,36 +157,71 @@ class SearchEngine:
         """
 
         query = self.form["query"].strip()
+        self.data_version = get_data_version().version
+
+        if not query:
+            filtered, papers = TimerUtilities.time_function(self.filter_papers)
+            return self.get_papers_no_query(papers)
 
-        filtered, papers = self.filter_papers()
         paper_score_table = defaultdict(int)
 
-        if query and papers.count() > 0:
-            filtered_dois = None
-
-            if filtered:
-                filtered_dois = list(papers.values_list('doi', flat=True))
-
-            if settings.DEBUG:
-                if settings.USING_ELASTICSEARCH:
-                    print("Using elasticsearch")
-                else:
-                    print("Using postgres search")
-
-            if self.search_type == SearchEngine.KEYWORD_SEARCH:
-                if settings.USING_ELASTICSEARCH:
-                    TimerUtilities.time_function(ElasticsearchRequestHelper.find,
-                                                 paper_score_table, query, ids=filtered_dois)
-                else:
-                    TimerUtilities.time_function(TitleSearch.find, paper_score_table, query, papers=papers)
-            elif self.search_type == SearchEngine.COMBINED_SEARCH:
-                TimerUtilities.time_function(SemanticSearch.find, paper_score_table, query, ids=filtered_dois)
-
-                if settings.USING_ELASTICSEARCH:
-                    TimerUtilities.time_function(ElasticsearchRequestHelper.enhance_results, paper_score_table, query)
+        # The loaded paper matrix may be replaced while the search runs, all matrix rows of the search refer to this
+        # snapshot
+        paper_search = get_semantic_paper_search()
+        paper_matrix = paper_search.paper_matrix
+
+        filter_index = get_filter_index(paper_matrix)
+        if filter_index is not None:
+            # The filters are evaluated in memory, without round trips to the database
+            filtered, mask = TimerUtilities.time_function(filter_index.filter, self.form)
+            # the index may still be of an older data version while it is rebuilt
+            self.data_version = filter_index.data_version
+            if not mask.any():
+                return paper_score_table
+            papers = None
+        else:
+            filtered, papers = TimerUtilities.time_function(self.filter_papers)
+            if papers.count() == 0:
+                return paper_score_table
+            mask = None
+
+        def filtered_dois():
+            if not filtered:
+                return None
+            if filter_index is not None:
+                return filter_index.dois_of(mask)
+            return list(papers.values_list('doi', flat=True))
+
+        if settings.DEBUG:
+            if settings.USING_ELASTICSEARCH:
+                print("Using elasticsearch")
             else:
-                raise ValueError("No valid search type provided")
-        elif not query:
-            return self.get_papers_no_query(papers)
+                print("Using postgres search")
+
+        if self.search_type == SearchEngine.KEYWORD_SEARCH:
+            if settings.USING_ELASTICSEARCH:
+                TimerUtilities.time_function(ElasticsearchRequestHelper.find,
+                                             paper_score_table, query, ids=filtered_dois())
+            else:
+                if papers is None:
+                    papers = Paper.objects.filter(pk__in=filtered_dois()) if filtered else Paper.objects.all()
+                TimerUtilities.time_function(TitleSearch.find, paper_score_table, query, papers=papers)
+        elif self.search_type == SearchEngine.COMBINED_SEARCH:
+            if filter_index is not None:
+                TimerUtilities.time_function(SemanticSearch.find, paper_score_table, query,
+                                             mask=filter_index.matrix_mask(mask) if filtered else None,
+                                             paper_matrix=paper_matrix)
+            else:
+                TimerUtilities.time_function(SemanticSearch.find, paper_score_table, query, ids=filtered_dois(),
+                                             paper_matrix=paper_matrix)
+
+            lexical_index = paper_search.fresh_lexical_index(paper_matrix)
+            if lexical_index is not None:
+                TimerUtilities.time_function(SemanticSearch.enhance, paper_score_table, query, lexical_index,
+                                             paper_matrix=paper_matrix)
+            elif settings.USING_ELASTICSEARCH:
+                TimerUtilities.time_function(ElasticsearchRequestHelper.enhance_results, paper_score_table, query)
+        else:
+            raise ValueError("No valid search type provided")
 
         return paper_score_table
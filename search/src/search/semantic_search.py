@@ -1,7 +1,9 @@
 from typing import List
 
+from django.conf import settings
 from src.analyze import get_semantic_paper_search
 from math import floor
+import numpy as np
 
 
 class SemanticSearch:
@@ -9,7 +11,7 @@ class SemanticSearch:
     Provides semantic search functionality.
     """
     @staticmethod
-    def find(score_table: dict, query: str, ids: List[str], top=None):
+    def find(score_table: dict, query: str, ids: List[str] = None, top=None, mask=None, paper_matrix=None):
         """
         Makes a semantic search for a given query.
         :param score_table: The score table.
@@ -17,25 +19,71 @@ class SemanticSearch:
         :param ids: Filtered ids, i.e. the dois of papers that match the applied filters. Can be None if
         all dois should be included.
         :param top: Optional. Include only the top n papers if set to an integer.
+        :param mask: Optional. Boolean mask over the paper matrix rows that is used instead of the filtered ids.
+        :param paper_matrix: Optional. The paper matrix dict the mask refers to, defaults to the loaded matrix. All
+        rows of the search refer to this matrix, even if the loaded one is replaced in the meantime.
         """
 
-        ids_set = set(ids) if ids else None
+        paper_search = get_semantic_paper_search()
+        paper_matrix = paper_matrix or paper_search.paper_matrix
 
-        similar_papers = sorted([(doi, score) for doi, score in get_semantic_paper_search().query(query) if
-                                 ids_set is None or doi in ids_set], key=lambda x: x[1], reverse=True)
+        if mask is None and ids:
+            mask = paper_search.row_mask(ids, paper_matrix=paper_matrix)
 
-        if top:
-            similar_papers = similar_papers[:top]
+        if top is None and mask is None and settings.USE_ANN_INDEX:
+            # Without filters, only the best matches are shown, such that an approximate top-k search is sufficient.
+            top = settings.ANN_INDEX_TOP_K
+
+        rows, scores = paper_search.query_scores(query, top=top, paper_matrix=paper_matrix)
+        if rows is None:
+            rows = np.arange(len(scores))
+
+        if mask is not None:
+            matches_filter = mask[rows]
+            rows, scores = rows[matches_filter], scores[matches_filter]
+
+        if len(scores) == 0:
+            return
+
+        if top and len(scores) > top:
+            best = np.argpartition(scores, len(scores) - top)[-top:]
+            rows, scores = rows[best], scores[best]
 
         #  In case of a filtered result, we want to show at least the best result (and some other) when they are not
         #  worse than .2
-        max_score = similar_papers[0][1]
+        max_score = scores.max()
         score_min = min(0.55, floor(max_score * 10) / 10)
 
         if score_min >= 0.2:
-            for doi, score in similar_papers:
-                if score >= score_min:
-                    score_table[doi] += score
-                else:
-                    # List is sorted, thus we can break
-                    break
\ No newline at end of file
+            # Only papers that make it into the score table are converted to python objects
+            selected = scores >= score_min
+            for doi, score in zip(paper_search.dois(rows[selected], paper_matrix=paper_matrix), scores[selected].tolist()):
+                score_table[doi] += score
+
+    @staticmethod
+    def enhance(score_table: dict, query: str, lexical_index, paper_matrix=None):
+        """
+        Boosts the best results that contain the words of the query, like ElasticsearchRequestHelper.enhance_results
+        but with the lexical index of the paper matrix. Only the best LEXICAL_RESCORE_WINDOW results are reordered.
+        :param score_table: The doi scores.
+        :param query: The query.
+        :param lexical_index: The lexical index of the paper matrix.
+        :param paper_matrix: Optional. The paper matrix dict of the lexical index, defaults to the loaded matrix.
+        """
+        if len(score_table) == 0:
+            return
+
+        window = sorted(score_table.keys(), key=lambda doi: score_table[doi],
+                        reverse=True)[:settings.LEXICAL_RESCORE_WINDOW]
+
+        id_map = (paper_matrix or get_semantic_paper_search().paper_matrix)['id_map']
+        rows = np.array([id_map[doi] for doi in window], dtype=np.int64)
+        scores = lexical_index.scores(query, rows)
+
+        max_score = scores.max()
+        if max_score <= 0:
+            return
+
+        for doi, score in zip(window, np.round(scores / max_score, 2).tolist()):
+            if score > 0:
+                score_table[doi] += score
@@ -1,4 +1,5 @@
 from django.conf import settings
+from collabovid_metrics import stage_timer
 import time
 
 
@@ -10,16 +11,17 @@ class TimerUtilities:
     @staticmethod
     def time_function(function, *args, **kwargs):
         """
-        Times a given function in DEBUG mode and prints the result to the console.
+        Times a given function, records the duration as stage of the current request and prints it to the
+        console in DEBUG mode.
         :param function: The function
         :param args: The arguments that should be passed to the function.
         :param kwargs: The arguments that should be passed to the function.
         :return: The function result.
         """
-        if settings.DEBUG:
-            start_time = time.monotonic()
+        stage = getattr(function, '__qualname__', function.__class__.__name__)
+        start_time = time.monotonic()
+        with stage_timer(stage):
             result = function(*args, **kwargs)
+        if settings.DEBUG:
             print(function.__class__.__name__, function.__name__, 'took', time.monotonic() - start_time)
-            return result
-        else:
-            return function(*args, **kwargs)
\ No newline at end of file
+        return result
@@ -4,6 +4,9 @@ from data.models import Paper
 from math import ceil
 
 from src.search.elasticsearch import ElasticsearchRequestHelper
+from src.search.filter_index import get_filter_index, SCORE_SORTS
+from src.search.data_version import get_data_version
+from src.analyze import get_semantic_paper_search
 from django.conf import settings
 from typing import Union
 
@@ -16,24 +19,52 @@ class VirtualPaginator:
     """
     PAPER_PAGE_COUNT = 10
 
-    def __init__(self, search_results: Union[dict, QuerySet], form: dict):
-
+    def __init__(self, sorted_dois, form: dict):
+        """
+        :param sorted_dois: Sequence of all result dois in the requested order, see sort_results.
+        :param form: The search form.
+        """
         self._form = form
+        self.sorted_dois = sorted_dois
+        self.count = len(self.sorted_dois)
 
+        self.per_page = VirtualPaginator.PAPER_PAGE_COUNT
+        self.num_pages = ceil(self.count / self.per_page)
+
+    @staticmethod
+    def sort_results(search_results: Union[dict, QuerySet], form: dict):
+        """
+        Orders the search results as requested by the form.
+        :param search_results: The search results, either a dict of dois with a score or a paper query set.
+        :param form: The search form.
+        :return: List of dois.
+        """
         if isinstance(search_results, dict):
+            sorted_by = form['sorted_by']
+            if sorted_by == 'top' and not form['query'].strip():
+                sorted_by = 'newest'
+            if sorted_by == 'newest' or sorted_by in SCORE_SORTS:
+                filter_index = get_filter_index(get_semantic_paper_search().paper_matrix)
+                # The sort keys are precomputed as rank arrays, no database query is needed. A stale index or one
+                # that does not know all results falls back to the database.
+                if filter_index is not None and filter_index.data_version == get_data_version().version:
+                    sorted_dois = filter_index.sort(search_results.keys(), sorted_by)
+                    if sorted_dois is not None:
+                        return sorted_dois
+
             paper_query = Paper.objects.filter(pk__in=search_results.keys())
         else:
             paper_query = search_results
 
         if form['sorted_by'] == 'newest' or (form['sorted_by'] == 'top' and not form['query'].strip()):
-            self.sorted_dois = paper_query.order_by("-published_at", "-created_at")
+            sorted_dois = paper_query.order_by("-published_at", "-created_at")
         elif form['sorted_by'] == 'top':
             if isinstance(search_results, QuerySet):
-                self.sorted_dois = paper_query
+                sorted_dois = paper_query
             else:
-                self.sorted_dois = sorted(search_results.keys(), key=lambda x: search_results[x], reverse=True)
+                sorted_dois = sorted(search_results.keys(), key=lambda x: search_results[x], reverse=True)
         elif form['sorted_by'] == 'popularity':
-            self.sorted_dois = paper_query.order_by(
+            sorted_dois = paper_query.order_by(
                 F('altmetric_data__score').desc(nulls_last=True)
             )
         elif form['sorted_by'].startswith('trending'):
@@ -42,19 +73,15 @@ class VirtualPaginator:
                 raise ValueError("Sorted by has unknown value" + str(form['sorted_by']))
 
             sort_key = f'altmetric_data__score_{span}'
-            self.sorted_dois = paper_query.order_by(
+            sorted_dois = paper_query.order_by(
                 F(sort_key).desc(nulls_last=True)
             )
         else:
             raise ValueError("Sorted by has unknown value" + str(form['sorted_by']))
 
-        if isinstance(self.sorted_dois, QuerySet):
-            self.count = self.sorted_dois.count()
-        else:
-            self.count = len(self.sorted_dois)
-
-        self.per_page = VirtualPaginator.PAPER_PAGE_COUNT
-        self.num_pages = ceil(self.count / self.per_page)
+        if isinstance(sorted_dois, QuerySet):
+            return list(sorted_dois.values_list('doi', flat=True))
+        return sorted_dois
 
     def build_paginator(self):
 
@@ -69,10 +96,7 @@ class VirtualPaginator:
         bottom = (self._form['page'] - 1) * self.per_page
         top = bottom + self.per_page
 
-        if isinstance(self.sorted_dois, QuerySet):
-            dois_for_page = list(self.sorted_dois[bottom:top].values_list('doi', flat=True))
-        else:
-            dois_for_page = self.sorted_dois[bottom:top]
+        dois_for_page = list(self.sorted_dois[bottom:top])
 
         paginator = self.build_paginator()
         paginator['page'] = self._form['page']
@@ -84,8 +108,9 @@ class VirtualPaginator:
             authors = []
 
             if settings.USING_ELASTICSEARCH:
-                ElasticsearchRequestHelper.highlights(results, self._form['query'], ids=dois_for_page)
-                ElasticsearchRequestHelper.find_authors(authors, self._form['query'], self._form['authors'])
+                ElasticsearchRequestHelper.highlights_and_authors(results, authors, self._form['query'],
+                                                                  ids=dois_for_page,
+                                                                  excluded_author_ids=self._form['authors'])
 
             paginator['results'] = sorted(list(results.values()), key=lambda x: x['order'])
             paginator['authors'] = authors
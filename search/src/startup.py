@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+
+from src.analyze import get_semantic_paper_search, get_similar_paper_finder
+from src.search.filter_index import filter_index_provider
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Startup:
+    """
+    Loads everything the search service needs before it serves requests. The models and the paper matrix are
+    loaded in parallel, afterwards the artifacts of the matrix are loaded in parallel and a warm up query is run.
+    The progress of every stage is reported by the startup probe.
+    """
+    # the service cannot answer requests without these stages, the others only make requests faster
+    REQUIRED_STAGES = ['models', 'paper_matrix']
+
+    def __init__(self):
+        self._stages = OrderedDict((name, {'state': PENDING}) for name in
+                                   ['models', 'paper_matrix', 'ann_index', 'quantized_embeddings', 'lexical_index',
+                                    'neighbor_graph', 'filter_index', 'warmup'])
+        self._lock = threading.Lock()
+        self._thread = None
+        self._started_at = None
+        self._finished_at = None
+
+    @property
+    def started(self):
+        return self._thread is not None
+
+    @property
+    def finished(self):
+        return self._finished_at is not None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._started_at = time.time()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _update(self, name, **kwargs):
+        with self._lock:
+            self._stages[name].update(kwargs)
+
+    def _run_stage(self, name, function):
+        self._update(name, state=RUNNING)
+        start = time.time()
+        try:
+            function()
+            self._update(name, state=DONE, duration=time.time() - start)
+        except Exception as e:
+            print(f'Startup stage {name} failed:', e)
+            self._update(name, state=FAILED, duration=time.time() - start, error=str(e))
+
+    def _run(self):
+        semantic_paper_search = get_semantic_paper_search()
+        similar_paper_finder = get_similar_paper_finder()
+        if semantic_paper_search is None or similar_paper_finder is None:
+            for name in self._stages.keys():
+                self._update(name, state=FAILED, error="Search is not available")
+            self._finished_at = time.time()
+            return
+
+        def load_ann_index():
+            _ = semantic_paper_search.ann_index
+
+        def load_quantized_embeddings():
+            _ = semantic_paper_search.vectorizer.quantized_embeddings
+
+        def load_lexical_index():
+            _ = semantic_paper_search.lexical_index
+
+        def load_neighbor_graph():
+            _ = similar_paper_finder.neighbor_graph
+
+        def build_filter_index():
+            if settings.USE_FILTER_INDEX:
+                filter_index_provider.index(semantic_paper_search.paper_matrix, wait=True)
+
+        def warmup():
+            semantic_paper_search.query_scores(settings.STARTUP_WARMUP_QUERY)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            models = executor.submit(self._run_stage, 'models', semantic_paper_search.vectorizer.initialize_models)
+            self._run_stage('paper_matrix', lambda: semantic_paper_search.paper_matrix)
+
+            # the freshness of the artifacts is checked against the loaded paper matrix
+            artifacts = [executor.submit(self._run_stage, name, function) for name, function in
+                         [('ann_index', load_ann_index), ('quantized_embeddings', load_quantized_embeddings),
+                          ('lexical_index', load_lexical_index), ('neighbor_graph', load_neighbor_graph),
+                          ('filter_index', build_filter_index)]]
+            wait([models] + artifacts)
+
+        if self.stage_state('models') == DONE and self.stage_state('paper_matrix') == DONE:
+            self._run_stage('warmup', warmup)
+
+        self._finished_at = time.time()
+        print(f'Startup finished after {self._finished_at - self._started_at:.1f}s')
+
+    def stage_state(self, name):
+        with self._lock:
+            return self._stages[name]['state']
+
+    def is_ready(self):
+        with self._lock:
+            return self.finished and all(self._stages[name]['state'] == DONE
+                                                         for name in Startup.REQUIRED_STAGES)
+
+    def status(self):
+        with self._lock:
+            stages = OrderedDict((name, dict(stage)) for name, stage in self._stages.items())
+            finished_at = self._finished_at or time.time()
+        return {
+            'ready': self.is_ready(),
+            'elapsed': finished_at - self._started_at if self._started_at is not None else 0.0,
+            'stages': stages
+        }
+
+
+startup = Startup()
+
+
+def get_startup():
+    return startup
@@ -4,4 +4,5 @@ from src.analyze.reduce_embedding_dimensionality import *
 from src.analyze.recompute_topic_assignment import *
 from src.analyze.cluster_topic import *
 from src.analyze.nearest_neighbor_topic_assignment import *
-from src.analyze.assign_keywords import *
\ No newline at end of file
+from src.analyze.assign_keywords import *
+from src.analyze.compact_paper_matrix import *
@@ -1,10 +1,13 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
 from django.core.serializers.json import DjangoJSONEncoder
 from django.db.models import F
 from django.shortcuts import render
-from django.http import HttpResponseNotFound
+from django.http import HttpResponseNotFound, Http404
 
 from core.date_utils import DateUtils
-from data.models import GeoCity, GeoCountry, Paper, Category, Topic
+from data.models import GeoCity, GeoCountry, Paper, Category, Topic, PaperSimilarities
 from collabovid_statistics import PaperStatistics, CategoryStatistics
 import json
 
@@ -13,6 +16,8 @@ import requests
 
 from django.conf import settings
 from search.request_helper import SimilarPaperRequestHelper
+from search.paginator import ScoreSortPaginator
+from search.paper_hydration import PaperHydration
 from django.shortcuts import get_object_or_404
 
 
@@ -50,16 +55,37 @@ def home(request):
                                                   'topic_count': topic_count})
 
 
-def paper(request, doi):
-    current_paper = get_object_or_404(Paper, doi=doi)
-    similar_request = SimilarPaperRequestHelper([doi], total_papers=10, papers_per_page=10)
-    similar_paper = []
-    if not similar_request.error:
-        similar_paper = similar_request.paginator.page(1)
-    return render(request, "core/paper.html", {
-        "paper": current_paper,
+def _precomputed_similar_papers(doi):
+    """
+    :param doi: The doi of the paper.
+    :return: The precomputed similar papers as (doi, score) items or None if they were not computed yet.
+    """
+    similarities = PaperSimilarities.objects.filter(paper_id=doi).only('similar_papers').first()
+    if similarities is None:
+        return None
+    return [(similar_doi, score) for similar_doi, score in similarities.similar_papers[:10]]
+
+
+async def paper(request, doi):
+    current_papers, paper_score_items = await asyncio.gather(sync_to_async(PaperHydration.page)([doi]),
+                                                             sync_to_async(_precomputed_similar_papers)(doi))
+    if not current_papers:
+        raise Http404
+    if paper_score_items is not None:
+        # the similar papers are precomputed by the search service
+        similar_paper = await sync_to_async(ScoreSortPaginator(paper_score_items, 10).page)(1)
+        error = False
+    else:
+        similar_request = await SimilarPaperRequestHelper.fetch([doi], total_papers=10, papers_per_page=10)
+        similar_paper = []
+        if not similar_request.error:
+            similar_paper = await sync_to_async(similar_request.paginator.page)(1)
+        error = similar_request.error
+
+    return await sync_to_async(render)(request, "core/paper.html", {
+        "paper": current_papers[0],
         "similar_papers": similar_paper,
-        "error": similar_request.error
+        "error": error
     })
 
 
@@ -98,8 +124,7 @@ def paper_cards(request):
     if not dois:
         return HttpResponseNotFound()
     dois = json.loads(dois)
-    papers = Paper.objects.filter(pk__in=dois)
-    papers = sorted(papers, key=lambda x: dois.index(x.doi))
+    papers = PaperHydration.page(dois)
     return render(template_name="search/ajax/_search_results.html", request=request,
                   context={'papers': papers, 'show_score': False, 'use_paging': False})
 
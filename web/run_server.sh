@@ -1,4 +1,8 @@
 #!/bin/bash
 chmod 777 -R /cache
 chown -R root:root /cache
+# the workers share their metrics through this directory, it is cleared on every start
+export prometheus_multiproc_dir=/tmp/metrics
+export PROMETHEUS_MULTIPROC_DIR=/tmp/metrics
+rm -rf /tmp/metrics && mkdir -p /tmp/metrics && chown www-data /tmp/metrics
 gunicorn ${PROJECT_NAME}.wsgi --user www-data --bind 0.0.0.0:8000 --workers 4 --timeout 500 & nginx -g "daemon off;"
\ No newline at end of file
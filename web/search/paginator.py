@@ -1,6 +1,9 @@
-from data.models import Paper
+from datetime import date
+
 from django.core.paginator import Paginator
 
+from search.paper_hydration import PaperHydration
+
 
 class FakePaginator(Paginator):
     def __init__(self, result_size, per_page, papers, page):
@@ -22,8 +25,11 @@ class ScoreSortPaginator(Paginator):
         paper_score_table = dict()
         for paper_doi, score in self.object_list[bottom:top]:
             paper_score_table[paper_doi] = score
-        papers = Paper.objects.filter(pk__in=paper_score_table.keys()).order_by("-published_at")
-        papers = sorted(papers, key=lambda paper: paper_score_table[paper.doi], reverse=True)
+        # papers with equal scores are ordered by descending publication date (unknown dates first, like the
+        # database orders them) and then by doi, such that paging is deterministic
+        papers = sorted(PaperHydration.page(list(paper_score_table.keys())),
+                        key=lambda paper: (paper_score_table[paper.doi], paper.published_at is None,
+                                           paper.published_at or date.min, paper.doi), reverse=True)
 
         return self._get_page(papers, number, self)
 
@@ -0,0 +1,36 @@
+from django.db.models import Prefetch
+
+from data.models import Paper, AuthorPaperMembership, GeoLocation
+
+
+class PaperHydration:
+    """
+    Loads papers together with everything their cards show: data, altmetric data, host, journal, topic,
+    categories, ranked authors and locations. A page needs a fixed number of queries, independent of its size.
+    """
+
+    @staticmethod
+    def query(dois):
+        """
+        :param dois: The dois of the papers.
+        :return: Query set of the papers with their relations.
+        """
+        return Paper.objects.filter(pk__in=dois) \
+            .select_related('data', 'altmetric_data', 'host', 'journal', 'topic') \
+            .defer('data__content') \
+            .prefetch_related(
+                'categories',
+                Prefetch('authorpapermembership_set', to_attr='ranked_memberships',
+                         queryset=AuthorPaperMembership.objects.select_related('author').order_by('rank')),
+                Prefetch('locations', to_attr='prefetched_locations',
+                         queryset=GeoLocation.objects.select_related('geocity__country', 'geocountry')))
+
+    @staticmethod
+    def page(dois):
+        """
+        Loads the papers of a page in the given order, dois of papers that do not exist are skipped.
+        :param dois: The ordered dois.
+        :return: List of papers.
+        """
+        papers = {paper.doi: paper for paper in PaperHydration.query(dois)}
+        return [papers[doi] for doi in dois if doi in papers]
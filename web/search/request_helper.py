@@ -1,48 +1,90 @@
+import asyncio
 from math import ceil
 
 import requests
+from asgiref.sync import sync_to_async
+from collabovid_metrics import stage_timer
+from collabovid_search_client import get_search_client, get_async_search_client
 from django.conf import settings
 import logging
 from data.models import Paper, Author
+from collabovid_statistics import PaperStatistics, AggregatedPaperStatistics
 
 from search.forms import SearchForm
 from search.models import SearchQuery
 from search.paginator import FakePaginator, ScoreSortPaginator
+from search.paper_hydration import PaperHydration
 from search.tagify.tagify_searchable import AuthorSearchable
 import json
 from django.conf import settings
-class SearchRequestHelper:
 
-    def __init__(self, form: SearchForm, save_request: bool = False, highlight: bool = True):
-        logger = logging.getLogger(__name__)
 
+# Response argument of the request helpers if the request was not sent yet
+_NOT_REQUESTED = object()
+
+
+def _log_request_exception(name, exception):
+    logger = logging.getLogger(__name__)
+    if isinstance(exception, requests.exceptions.Timeout):
+        logger.error(f"{name} Request Connection Timeout")
+    elif isinstance(exception, requests.exceptions.HTTPError):
+        logger.error("Http Error occured")
+    else:
+        logger.error("Some unknown request exception occured")
+
+
+async def _fetch(stage, name, request):
+    """
+    Awaits a request of the async search client.
+    :return: The response or None if the request failed.
+    """
+    try:
+        with stage_timer(stage):
+            return await request
+    except requests.exceptions.RequestException as e:
+        _log_request_exception(name, e)
+        return None
+
+
+class SearchRequestHelper:
+
+    def __init__(self, form: SearchForm, save_request: bool = False, highlight: bool = True,
+                 response=_NOT_REQUESTED):
+        """
+        :param response: The response of the search service if it was already fetched, see fetch.
+        """
         self._response = None
         self._error = False
         self._form = form
         self._highlight = highlight
 
-        try:
-            response = requests.get(form.url, params={
-                'form': form.to_json()
-            })
-            response.raise_for_status()
-
-            self._response = response.json()
-        except requests.exceptions.Timeout:
-            logger.error("Search Request Connection Timeout")
-            self._error = True
-        except requests.exceptions.HTTPError:
-            self._error = True
-            logger.error("Http Error occured")
-        except requests.exceptions.RequestException:
-            logger.error("Some unknown request exception occured")
-            self._error = True
+        if response is _NOT_REQUESTED:
+            try:
+                with stage_timer('search_request'):
+                    self._response = get_search_client().search(form.to_json())
+            except requests.exceptions.RequestException as e:
+                _log_request_exception("Search", e)
+                self._error = True
+        else:
+            self._response = response
 
         if self._response is None:
             self._error = True
         elif settings.SAVE_SEARCH_QUERIES and save_request and form.interesting:
             SearchQuery.objects.create(query=form.to_dict())
 
+    @staticmethod
+    async def fetch(form: SearchForm, save_request: bool = False, highlight: bool = True):
+        """
+        Searches with the async search client, the search query is saved while the search service answers.
+        """
+        requests_to_await = [_fetch('search_request', "Search", get_async_search_client().search(form.to_json()))]
+        if settings.SAVE_SEARCH_QUERIES and save_request and form.interesting:
+            requests_to_await.append(sync_to_async(SearchQuery.objects.create)(query=form.to_dict()))
+
+        response = (await asyncio.gather(*requests_to_await))[0]
+        return SearchRequestHelper(form, highlight=highlight, response=response)
+
     @property
     def error(self):
         return self._error
@@ -53,10 +95,12 @@ class SearchRequestHelper:
 
     def _parse_result_papers(self):
         result_dois = [p['doi'] for p in self.response['results']]
-        papers = sorted(list(Paper.objects.filter(pk__in=result_dois).all()), key=lambda x: result_dois.index(x.doi))
+        papers = PaperHydration.page(result_dois)
+        infos_by_doi = {infos['doi']: infos for infos in self.response['results']}
 
         sorted_by = self._form.cleaned_data['sorted_by']
-        for paper, infos in zip(papers, self.response['results']):
+        for paper in papers:
+            infos = infos_by_doi[paper.doi]
             if sorted_by in SearchForm.TRENDING_CHOICES.keys():
                 if paper.altmetric_data and paper.altmetric_data.score > 0.0:
                     paper.trend = int(ceil(SearchForm.TRENDING_CHOICES[sorted_by]['value'](paper)))
@@ -83,8 +127,12 @@ class SearchRequestHelper:
                                   papers=papers)
 
         authors = []
+        # the primary keys of elasticsearch hits are strings
+        author_objects = Author.objects.in_bulk([int(author['pk']) for author in self.response['authors']])
         for author in self.response['authors']:
-            current_author = Author.objects.get(pk=author['pk'])
+            if int(author['pk']) not in author_objects:
+                continue
+            current_author = author_objects[int(author['pk'])]
             current_author.display_name = author['full_name']
             current_author.json_object = json.dumps(AuthorSearchable.single_object(current_author))
             authors.append(current_author)
@@ -95,9 +143,13 @@ class SearchRequestHelper:
                 'authors': authors}
 
     def _parse_result_statistics(self):
-        result_dois = self.response['results']
-        papers = Paper.objects.filter(pk__in=result_dois)
-        return {'result_type': SearchForm.RESULT_TYPE_STATISTICS, 'papers': papers}
+        if 'statistics' in self.response:
+            statistics = AggregatedPaperStatistics(self.response['statistics'])
+        else:
+            # the search service could not aggregate the statistics, they are computed from the matching papers
+            result_dois = self.response['results']
+            statistics = PaperStatistics(Paper.objects.filter(pk__in=result_dois))
+        return {'result_type': SearchForm.RESULT_TYPE_STATISTICS, 'statistics': statistics}
 
     def build_search_result(self):
         if not self.error:
@@ -111,33 +163,39 @@ class SearchRequestHelper:
 
 class SimilarPaperRequestHelper:
 
-    def __init__(self, dois, total_papers, papers_per_page=0):
-        logger = logging.getLogger(__name__)
-
+    def __init__(self, dois, total_papers, papers_per_page=0, response=_NOT_REQUESTED):
+        """
+        :param response: The response of the search service if it was already fetched, see fetch.
+        """
         self._response = None
         self._error = False
         self._papers = None
         self._papers_per_page = papers_per_page
         self._result_dois = None
-        try:
-            response = requests.get(settings.SEARCH_SERVICE_URL + '/similar', params={
-                'dois': dois,
-                'limit': total_papers
-            })
-            response.raise_for_status()
-            self._response = response.json()
-        except requests.exceptions.Timeout:
-            logger.error("Similar Request Connection Timeout")
-            self._error = True
-        except requests.exceptions.HTTPError:
-            self._error = True
-        except requests.exceptions.RequestException as e:
-            logger.error("Some unknown request exception occured", e)
-            self._error = True
+
+        if response is _NOT_REQUESTED:
+            try:
+                with stage_timer('similar_request'):
+                    self._response = get_search_client().similar(dois, limit=total_papers)
+            except requests.exceptions.RequestException as e:
+                _log_request_exception("Similar", e)
+                self._error = True
+        else:
+            self._response = response
 
         if self._response is None:
             self._error = True
 
+    @staticmethod
+    async def fetch(dois, total_papers, papers_per_page=0):
+        """
+        Requests the similar papers with the async search client, such that an async view can await them
+        concurrently with other work.
+        """
+        response = await _fetch('similar_request', "Similar",
+                                get_async_search_client().similar(dois, limit=total_papers))
+        return SimilarPaperRequestHelper(dois, total_papers, papers_per_page=papers_per_page, response=response)
+
     @property
     def dois(self):
         if not self._result_dois:
@@ -1,3 +1,68 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase
+
+from collabovid_search_client import SearchClient, DOI_LIST_CONTENT_TYPE, encode_dois, decode_dois
+from data.models import (Author, AuthorPaperMembership, DataSource, GeoCity, GeoCountry, GeoLocationMembership, Paper,
+                         PaperData, PaperHost, VerificationState)
+from search.paper_hydration import PaperHydration
+
+
+class DoiEncodingTests(SimpleTestCase):
+    DOIS = ['10.1101/2020.04.{:02d}.{:06d}'.format(day, number) for day in range(1, 31) for number in range(20)]
+
+    def test_round_trip(self):
+        self.assertEqual(decode_dois(encode_dois(self.DOIS)), self.DOIS)
+
+    def test_round_trip_of_empty_list(self):
+        self.assertEqual(decode_dois(encode_dois([])), [])
+
+    def test_encoding_is_smaller_than_plain_list(self):
+        self.assertLess(len(encode_dois(self.DOIS)), len('\n'.join(self.DOIS)) // 4)
+
+    def test_client_sends_large_lists_encoded(self):
+        client = SearchClient('http://search', compact_doi_threshold=100)
+        with mock.patch.object(client, '_request') as request:
+            client.similar(self.DOIS, limit=10)
+        method, path = request.call_args.args
+        self.assertEqual((method, path), ('POST', '/similar'))
+        self.assertEqual(request.call_args.kwargs['headers']['Content-Type'], DOI_LIST_CONTENT_TYPE)
+        self.assertEqual(decode_dois(request.call_args.kwargs['data']), self.DOIS)
+
+    def test_client_sends_small_lists_as_parameters(self):
+        client = SearchClient('http://search', compact_doi_threshold=100)
+        with mock.patch.object(client, '_request') as request:
+            client.similar(self.DOIS[:3], limit=10)
+        request.assert_called_once_with('GET', '/similar', params={'dois': self.DOIS[:3], 'limit': 10})
+
+
+class PaperHydrationTests(TestCase):
+
+    def setUp(self):
+        self.paper = Paper.objects.create(doi='10.1/a', title='paper', host=PaperHost.objects.create(name='host'),
+                                          data=PaperData.objects.create(abstract=''),
+                                          data_source_value=DataSource.ARXIV)
+        for rank in reversed(range(7)):
+            author = Author.objects.create(first_name='First', last_name=f'Last {rank}')
+            AuthorPaperMembership.objects.create(author=author, paper=self.paper, rank=rank)
+
+        germany = GeoCountry.objects.create(geonames_id=1, name='Germany', alpha_2='DE', latitude=0, longitude=0)
+        france = GeoCountry.objects.create(geonames_id=2, name='France', alpha_2='FR', latitude=0, longitude=0)
+        italy = GeoCountry.objects.create(geonames_id=3, name='Italy', alpha_2='IT', latitude=0, longitude=0)
+        munich = GeoCity.objects.create(geonames_id=4, name='Munich', country=germany, latitude=0, longitude=0)
+        berlin = GeoCity.objects.create(geonames_id=5, name='Berlin', country=germany, latitude=0, longitude=0)
+        for location in [berlin, italy, france, munich]:
+            GeoLocationMembership.objects.create(paper=self.paper, location=location, state=VerificationState.ACCEPTED)
+
+    def test_hydrated_authors_are_all_ranked_authors(self):
+        paper, = PaperHydration.page(['10.1/a'])
+        self.assertEqual(len(paper.highlighted_authors), self.paper.authors.count())
+        self.assertEqual([author.last_name for author in paper.highlighted_authors],
+                         [f'Last {rank}' for rank in range(7)])
+
+    def test_hydrated_locations_are_ordered_like_queried_locations(self):
+        paper, = PaperHydration.page(['10.1/a'])
+        with self.assertNumQueries(0):
+            hydrated = [location.name for location in paper.ordered_locations]
+        self.assertEqual(hydrated, [location.name for location in Paper.objects.get(pk='10.1/a').ordered_locations])
+        self.assertEqual(hydrated, ['Italy', 'France', 'Germany', 'Munich', 'Berlin'])
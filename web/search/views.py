@@ -9,15 +9,17 @@ from search.literature_utils.literature_file_analyzer import BibFileAnalyzer
 from search.literature_utils.literature_file_exporter import RisFileExporter, BibTeXFileExporter
 
 from search.suggestions_helper import SuggestionsHelper
-from collabovid_statistics import PaperStatistics
+from collabovid_metrics import stage_timer, set_request_labels
 
 from search.request_helper import SearchRequestHelper, SimilarPaperRequestHelper
+from search.paper_hydration import PaperHydration
 
 from search.forms import SearchForm, FindSimilarPapersForm, FindSimilarPapersByTextForm
 from search.tagify.tagify_searchable import *
 
 from data.documents import AuthorDocument, JournalDocument, TopicDocument
 from django.conf import settings
+from asgiref.sync import sync_to_async
 import io
 
 MAX_UPLOAD_FILE_SIZE = 5000000  # in bytes, 5MB
@@ -39,7 +41,7 @@ def favorite_analysis(request):
     if not dois:
         return HttpResponseNotFound()
     dois = json.loads(dois)
-    papers = Paper.objects.filter(pk__in=dois)
+    papers = PaperHydration.page(dois)
 
     return render(request, "search/ajax/_favorite_analysis.html", {"papers": papers})
 
@@ -96,19 +98,22 @@ def similar_papers(request):
     return HttpResponseNotFound()
 
 
-def search(request):
-    if request.method == "GET":
+def render_search_page(request):
+    form = SearchForm(request.GET)
+    if form.is_valid():
+        pass
+
+    return render(request, "search/search.html", {'form': form,
+                                                  'categories': Category.objects.all(),
+                                                  'paper_hosts': PaperHost.objects.order_by('name')})
 
-        form = SearchForm(request.GET)
-        if form.is_valid():
-            pass
 
-        return render(request, "search/search.html", {'form': form,
-                                                      'categories': Category.objects.all(),
-                                                      'paper_hosts': PaperHost.objects.order_by('name')})
+async def search(request):
+    if request.method == "GET":
+        return await sync_to_async(render_search_page)(request)
     elif request.method == "POST":
         form = SearchForm(request.POST)
-        return render_search_result(request, form)
+        return await render_search_result(request, form)
 
     return HttpResponseNotFound()
 
@@ -162,24 +167,33 @@ def export_paper(request, export_type, doi):
     return HttpResponseNotFound()
 
 
-def render_search_result(request, form):
-    if not form.is_valid():
-        return render(request, "search/ajax/_search_result_error.html",
-                      {'message': 'Your request is invalid.' + str(form.errors)})
+async def render_search_result(request, form):
+    """
+    Awaits the search with the async search client, the database is only accessed in threads.
+    """
+    if not await sync_to_async(form.is_valid)():
+        return await sync_to_async(render)(request, "search/ajax/_search_result_error.html",
+                                           {'message': 'Your request is invalid.' + str(form.errors)})
+
+    set_request_labels(form.cleaned_data)
+    is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+    search_response_helper = await SearchRequestHelper.fetch(form, save_request=not is_authenticated)
+    return await sync_to_async(render_search_response)(request, search_response_helper)
 
-    search_response_helper = SearchRequestHelper(form, save_request=not request.user.is_authenticated)
 
+def render_search_response(request, search_response_helper):
     if search_response_helper.error:
         return render(request, "search/ajax/_search_result_error.html",
                       {'message': 'We encountered an unexpected error. Please try again.'})
 
-    search_result = search_response_helper.build_search_result()
+    with stage_timer('hydration'):
+        search_result = search_response_helper.build_search_result()
 
     if search_result['result_type'] == SearchForm.RESULT_TYPE_STATISTICS:
-        statistics = PaperStatistics(search_result['papers'])
-        return render(request, "search/ajax/_statistics.html", {
-            'statistics': statistics,
-            'default_result_type': SearchForm.defaults['result_type']})
+        with stage_timer('render'):
+            return render(request, "search/ajax/_statistics.html", {
+                'statistics': search_result['statistics'],
+                'default_result_type': SearchForm.defaults['result_type']})
 
     elif search_result['result_type'] == SearchForm.RESULT_TYPE_PAPERS:
 
@@ -191,7 +205,8 @@ def render_search_result(request, form):
         search_result['papers'] = page_obj
         search_result['use_paging'] = True
 
-        return render(request, "search/ajax/_search_results.html", search_result)
+        with stage_timer('render'):
+            return render(request, "search/ajax/_search_results.html", search_result)
 
     return render(request, "search/ajax/_search_result_error.html",
                   {'message': 'Your request uses an invalid result type.'})
@@ -35,6 +35,7 @@ INSTALLED_APPS = [
 INSTALLED_APPS += SHARED_INSTALLED_APPS
 
 MIDDLEWARE = [
+    'collabovid_metrics.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -152,3 +153,19 @@ from web.pipeline import *
 
 
 SAVE_SEARCH_QUERIES=False
+
+# Timeouts of requests to the search service in seconds
+SEARCH_CLIENT_CONNECT_TIMEOUT = int(os.getenv('SEARCH_CLIENT_CONNECT_TIMEOUT', 2))
+SEARCH_CLIENT_READ_TIMEOUT = int(os.getenv('SEARCH_CLIENT_READ_TIMEOUT', 30))
+
+# Retries of failed connections and gateway errors of the search service
+SEARCH_CLIENT_RETRIES = int(os.getenv('SEARCH_CLIENT_RETRIES', 2))
+
+# Number of keep-alive connections to the search service
+SEARCH_CLIENT_POOL_SIZE = int(os.getenv('SEARCH_CLIENT_POOL_SIZE', 10))
+
+# Lists of at least this many dois are sent compactly encoded to the search service, 0 disables the encoding
+SEARCH_CLIENT_COMPACT_DOI_THRESHOLD = int(os.getenv('SEARCH_CLIENT_COMPACT_DOI_THRESHOLD', 100))
+
+# Bearer token scrapers of /metrics have to send, the endpoint is only served to requests that were not proxied
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
@@ -3,6 +3,7 @@ from django.urls import path, include
 from django.conf.urls.static import static
 from django.conf import settings
 from django.conf.urls import url
+from collabovid_metrics.views import metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -11,4 +12,5 @@ urlpatterns = [
     path('dashboard/', include('dashboard.urls')),
     path('classification/', include('classification.urls')),
     url(r'^system-health/?', include('health_check.urls')),
+    path('metrics', metrics),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)